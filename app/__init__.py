@@ -3,21 +3,36 @@ from .config import config
 from .extensions import db,login_manager,mail
 from .auth import auth_bp
 from .main import main_bp
+from .admin import admin_bp
 from flask_migrate import Migrate
-from .services import DueExpenseMonitor
+from .services import DueExpenseMonitor,ReportJobQueue,ReportCache,SqlInstrumentation,Profiler,category_cache,user_cache,forecast
+from .commands import register_commands
 migrate=Migrate()
+report_jobs=ReportJobQueue()
+report_cache=ReportCache()
+sql_metrics=SqlInstrumentation()
+profiler=Profiler()
 due_monitor=None
 def create_app(config_name='default'):
     app=Flask(__name__)
     app.config.from_object(config[config_name])
     
     db.init_app(app)
+    sql_metrics.init_app(app)
+    profiler.init_app(app)
     login_manager.init_app(app)
     migrate.init_app(app,db)
     mail.init_app(app)
+    report_jobs.init_app(app)
+    report_cache.init_app(app)
+    category_cache.init_app(app)
+    user_cache.init_app(app)
+    forecast.init_app(app)
 
     app.register_blueprint(auth_bp,url_prefix='/auth')
     app.register_blueprint(main_bp)
+    app.register_blueprint(admin_bp,url_prefix='/admin')
+    register_commands(app)
     global due_monitor
     due_monitor=DueExpenseMonitor(app)
     due_monitor.start_monitoring()
@@ -0,0 +1,42 @@
+from flask import jsonify,current_app,request,render_template,send_from_directory
+from flask_login import login_required
+from . import admin_bp
+from ..utils import admin_required
+
+
+@admin_bp.route('/metrics/sql')
+@login_required
+@admin_required
+def sql_metrics():
+    metrics=current_app.extensions['sql_metrics']
+    if not metrics.enabled:
+        return jsonify({'enabled':False,'endpoints':[]})
+    return jsonify({'enabled':True,'n_plus_one_threshold':metrics.threshold,'endpoints':metrics.snapshot()})
+
+@admin_bp.route('/metrics/sql/reset',methods=['POST'])
+@login_required
+@admin_required
+def reset_sql_metrics():
+    current_app.extensions['sql_metrics'].reset()
+    return jsonify({'success':True})
+
+@admin_bp.route('/profiles')
+@login_required
+@admin_required
+def profiles():
+    profiler=current_app.extensions['profiler']
+    limit=request.args.get('limit',current_app.config['PROFILER_TOP_N'],type=int)
+    return render_template('admin/profiles.html',profiles=profiler.profiles(limit),enabled=profiler.enabled,
+                           slow_ms=current_app.config['PROFILER_SLOW_MS'],sample_rate=profiler.sample_rate)
+
+@admin_bp.route('/profiles/<filename>')
+@login_required
+@admin_required
+def profile_file(filename):
+    return send_from_directory(current_app.extensions['profiler'].directory,filename,mimetype='text/plain',as_attachment=True)
+
+@admin_bp.route('/metrics/caches')
+@login_required
+@admin_required
+def cache_metrics():
+    return jsonify({'user_loader':current_app.extensions['user_cache'].stats()})
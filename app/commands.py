@@ -0,0 +1,210 @@
+import click
+from datetime import date,datetime,timedelta
+from sqlalchemy import select
+from .extensions import db
+from .models import Expense,RecurringExpense,MonthlyCategoryTotal
+
+
+def route_queries(user_id,keyword='food'):
+    """The statements behind the hot routes and the due expense monitor, keyed by a readable name.
+    Built by the same service methods the app runs, so the plans follow the code"""
+    from flask import current_app
+    from werkzeug.datastructures import MultiDict
+    from .models import NotificationLedger
+    from .services import ExpenseSearch,ExpenseReport,DueItems,CashFlowForecast
+    today=date.today()
+    now=datetime.utcnow()
+    page=51 #keyset pages read per_page+1 rows
+    search=ExpenseSearch()
+    filters=search.parse_filters(MultiDict())
+    matches,score=search.apply(search.apply_filters(Expense.query.filter_by(user_id=user_id),filters),keyword,user_id)
+    #a report over two whole months plus partial ones at both ends, so both the rollup and the edge queries show
+    report=ExpenseReport(user_id,(today.replace(day=1)-timedelta(days=45)).replace(day=15),today)
+    reminder_days=current_app.config['OVERDUE_REMINDER_DAYS']
+    pending=lambda stmt:NotificationLedger.pending(stmt,today,now,reminder_days)
+    chunk=current_app.config['DUE_SCAN_CHUNK_SIZE']
+    queries={
+        'dashboard':select(RecurringExpense).where(RecurringExpense.user_id==user_id,RecurringExpense.is_active==True),
+        'dashboard_data':MonthlyCategoryTotal.category_totals_select(user_id),
+        'expense_list':select(Expense).where(Expense.user_id==user_id).order_by(Expense.date.desc(),
+            Expense.id.desc()).limit(page),
+        'expense_list.next_page':select(Expense).where(Expense.user_id==user_id,
+            db.tuple_(Expense.date,Expense.id)<(datetime.now(),1000)).order_by(Expense.date.desc(),Expense.id.desc()).limit(page),
+        'search_expenses':matches.order_by(Expense.date.desc(),Expense.id.desc()).limit(page).statement,
+    }
+    if score is not None:
+        queries['search_expenses.relevance']=matches.add_columns(score).order_by(score.desc(),
+            Expense.id.desc()).limit(page).statement
+    queries['search_expenses.facets']=search.facet_query(matches).statement
+    queries['export']=search.rows_select(user_id,filters)
+    queries['report.line_items']=report.line_items_select()
+    for i,statement in enumerate(MonthlyCategoryTotal.range_totals_selects(user_id,report.start,report.end)):
+        queries[f'report.category_totals.{i+1}']=statement
+    queries['process_due']=DueItems.query(user_id,today).order_by(RecurringExpense.next_due_date,
+        RecurringExpense.id).limit(page).statement
+    queries['monitor.users']=DueItems.scan_users_select(today,chunk,refine=pending)
+    queries['monitor.rows']=DueItems.scan_rows_select(1,chunk,today,refine=pending)
+    queries['forecast']=CashFlowForecast.rules_select(user_id)
+    return queries
+
+
+def explain(statement):
+    """Run the dialect specific EXPLAIN for a statement and return the plan lines"""
+    conn=db.session.connection()
+    dialect=conn.dialect
+    compiled=statement.compile(dialect=dialect)
+    if compiled.positional:
+        params=tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params=compiled.params
+    if dialect.name=='sqlite':
+        rows=conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}',params).all()
+        return [row[-1] for row in rows]
+    rows=conn.exec_driver_sql(f'EXPLAIN {compiled}',params).all()
+    return [row[0] for row in rows]
+
+
+def register_commands(app):
+    @app.cli.command('explain-queries')
+    @click.option('--user-id',default=1,show_default=True,help='User id bound into the per user queries')
+    @click.option('--only',default=None,help='Only explain queries whose name starts with this prefix')
+    @click.option('--keyword',default='food',show_default=True,help='Search keyword for the search_expenses queries')
+    def explain_queries(user_id,only,keyword):
+        """Print the EXPLAIN plan of every route query against the configured database"""
+        click.echo(f"Dialect: {db.engine.dialect.name}")
+        for name,statement in route_queries(user_id,keyword).items():
+            if only and not name.startswith(only):
+                continue
+            click.echo(f"\n== {name}")
+            for line in explain(statement):
+                click.echo(f"  {line}")
+
+    @app.cli.command('rebuild-rollups')
+    @click.option('--user-id',type=int,default=None,help='Only rebuild this user (default: everyone)')
+    def rebuild_rollups(user_id):
+        """Recompute the monthly category totals from the expenses table (backfills and repairs)"""
+        written=MonthlyCategoryTotal.rebuild(user_id)
+        click.echo(f"Rebuilt {written} monthly category totals")
+
+    @app.cli.command('import-expenses')
+    @click.argument('path',type=click.Path(exists=True,dir_okay=False))
+    @click.option('--user-id',type=int,required=True)
+    @click.option('--format','file_format',type=click.Choice(['auto','csv','ofx']),default='auto',show_default=True)
+    @click.option('--category-id',type=int,default=None,help='Category for rows without a matching category')
+    @click.option('--date-format',default=None,help='strptime format of the date column, detected when omitted')
+    @click.option('--debit-sign',type=click.Choice(['negative','positive']),default=None,
+                  help='Sign of spending in the CSV amount column, detected from the column name when omitted')
+    @click.option('--batch-size',type=int,default=None)
+    def import_expenses(path,user_id,file_format,category_id,date_format,debit_sign,batch_size):
+        """Import a CSV or OFX bank statement for a user"""
+        from .services import ExpenseImporter
+        importer=ExpenseImporter(user_id,default_category_id=category_id,date_format=date_format,debit_sign=debit_sign,
+                                 batch_size=batch_size or app.config['IMPORT_BATCH_SIZE'],
+                                 on_progress=lambda report:click.echo(
+                                     f"  batch {report['batches']}: {report['inserted']} imported so far"))
+        with open(path,encoding='utf-8-sig',errors='replace',newline='') as lines:
+            report=importer.run(lines,filename=path,file_format=file_format)
+        click.echo(importer.summary())
+        for error in report['errors']:
+            click.echo(f"  line {error['line']}: {error['error']}")
+
+    @app.cli.command('outbox-worker')
+    @click.option('--once',is_flag=True,help='Send what is queued now and exit')
+    @click.option('--batch-size',type=int,default=None,help='Messages leased at a time (default OUTBOX_BATCH_SIZE)')
+    @click.option('--interval',type=float,default=None,help='Seconds between polls of an empty outbox (default OUTBOX_POLL_SECONDS)')
+    @click.option('--requeue-dead',is_flag=True,help='Move dead-lettered messages back to pending first')
+    def outbox_worker(once,batch_size,interval,requeue_dead):
+        """Send the emails queued in the email outbox"""
+        from .services import OutboxWorker
+        worker=OutboxWorker(app)
+        if requeue_dead:
+            click.echo(f"Requeued {worker.requeue_dead()} dead-lettered messages")
+        if once:
+            totals=worker.drain(batch_size)
+            click.echo(f"Sent {totals['sent']}, {totals['retried']} to retry, {totals['dead']} dead-lettered "
+                       f"in {totals['batches']} batches")
+            return
+        worker.run_forever(interval,batch_size)
+
+    @app.cli.command('bench-gmail')
+    @click.option('--sends',type=int,default=200,show_default=True,help='Messages sent in each mode')
+    @click.option('--latency-ms',type=float,default=0,show_default=True,help='Delay the fake endpoint adds to every call')
+    def bench_gmail(sends,latency_ms):
+        """Time GmailService.send_email against a local fake Gmail endpoint, rebuilding the client per
+        message (the old behaviour) and with the cached client"""
+        import io
+        import time
+        from contextlib import redirect_stdout
+        from .services import GmailService
+        from .devtools import FakeGmailServer,gmail_env
+        with FakeGmailServer(latency=latency_ms/1000) as fake,gmail_env(fake):
+            gmail=GmailService()
+            for mode,reset in (('rebuild per send',True),('cached client',False)):
+                GmailService.reset_clients()
+                before=dict(fake.counts)
+                started=time.perf_counter()
+                with redirect_stdout(io.StringIO()):
+                    sent=0
+                    for i in range(sends):
+                        if reset:
+                            GmailService.reset_clients()
+                        sent+=gmail.send_email(f'user{i}@example.com','Benchmark','<p>hello</p>','hello')
+                elapsed=time.perf_counter()-started
+                click.echo(f"{mode:>17}: {sent}/{sends} sent, {elapsed*1000/sends:.2f} ms per send, "
+                           f"{fake.counts['token']-before['token']} token refreshes")
+
+    @app.cli.command('bench-email-dispatch')
+    @click.option('--messages',type=int,default=500,show_default=True)
+    @click.option('--latency-ms',type=float,default=50,show_default=True,help='Delay the fake endpoint adds to every call')
+    @click.option('--fail-rate',type=float,default=0.05,show_default=True,help='Share of sends answered with 429')
+    @click.option('--units-per-second',type=float,default=100000,show_default=True,
+                  help='Quota refill rate, pass 250 to see the real Gmail per-user limit')
+    def bench_email_dispatch(messages,latency_ms,fail_rate,units_per_second):
+        """Throughput of EmailDispatcher against a local fake Gmail endpoint, one by one vs pooled and batched"""
+        import io
+        from contextlib import redirect_stdout
+        from .services import GmailService,EmailDispatcher,TokenBucket
+        from .devtools import FakeGmailServer,gmail_env
+        batch=[{'to':f'user{i}@example.com','subject':'Benchmark','html':'<p>hello</p>','text':'hello'} for i in range(messages)]
+        with FakeGmailServer(latency=latency_ms/1000,fail_rate=fail_rate,seed=1) as fake,gmail_env(fake):
+            for mode,overrides in (('serial',{'workers':1,'batch_size':1}),('pooled',{'batch_size':1}),('pooled+batch',{})):
+                dispatcher=EmailDispatcher.from_config(GmailService(),app.config)
+                dispatcher.backoff_base=0.05
+                for name,value in overrides.items():
+                    setattr(dispatcher,name,value)
+                dispatcher.bucket=TokenBucket(units_per_second,max(units_per_second,dispatcher.send_units))
+                with redirect_stdout(io.StringIO()):
+                    _,stats=dispatcher.dispatch(batch)
+                click.echo(f"{mode:>13}: {stats['sent']}/{stats['messages']} sent in {stats['elapsed']}s "
+                           f"({stats['per_second']}/s), {stats['requests']} requests, {stats['retries']} retries, "
+                           f"{stats['failed']} failed")
+
+    @app.cli.command('bench-email-render')
+    @click.option('--users',type=int,default=10000,show_default=True,help='Digests rendered')
+    @click.option('--items',type=int,default=20,show_default=True,help='Due expenses in every digest')
+    def bench_email_render(users,items):
+        """Time rendering the due expenses email (html and text) for many users, no database or Gmail involved"""
+        import time
+        from types import SimpleNamespace
+        from .services import GmailService
+        today=date.today()
+        frequencies=['daily','weekly','monthly','yearly']
+        categories=[SimpleNamespace(name=name) for name in ('Rent','Utilities','Subscriptions','Insurance','Loans')]
+        digests=[(SimpleNamespace(username=f'user{u}',email=f'user{u}@example.com'),
+                  [SimpleNamespace(title=f'Expense {i}',amount=100+i*7.5,frequency=frequencies[i%4],
+                                   category=categories[i%5],next_due_date=today-timedelta(days=(u+i)%10),
+                                   description=f'Note for expense {i}' if i%3==0 else None) for i in range(items)])
+                 for u in range(users)]
+        gmail=GmailService()
+        started=time.perf_counter()
+        gmail.email_templates()
+        compiled=time.perf_counter()-started
+        size=0
+        started=time.perf_counter()
+        for user,due_expenses in digests:
+            html,text=gmail.create_due_expenses_email(user,due_expenses,today,app.config['APP_BASE_URL'])
+            size+=len(html)+len(text)
+        elapsed=time.perf_counter()-started
+        click.echo(f"Compiled templates in {compiled*1000:.1f} ms")
+        click.echo(f"Rendered {users} digests x {items} items in {elapsed:.2f}s: {elapsed*1000/users:.3f} ms per digest, "
+                   f"{elapsed*1e6/(users*items):.1f} us per item, {size/users/1024:.1f} KiB per digest")
@@ -14,6 +14,60 @@ class Config:
     MAIL_USE_TLS=os.getenv('MAIL_USE_TLS')
     MAIL_USERNAME=os.getenv('MAIL_USERNAME')
     MAIL_PASSWORD=os.getenv('MAIL_PASSWORD')
+    EXPENSES_PAGE_SIZE=int(os.getenv('EXPENSES_PAGE_SIZE',50))
+    EXPENSES_MAX_PAGE_SIZE=int(os.getenv('EXPENSES_MAX_PAGE_SIZE',200))
+    IMPORT_BATCH_SIZE=int(os.getenv('IMPORT_BATCH_SIZE',5000))
+    MAX_CONTENT_LENGTH=int(os.getenv('MAX_UPLOAD_MB',20))*1024*1024
+    EXPORT_BATCH_SIZE=int(os.getenv('EXPORT_BATCH_SIZE',1000))
+    REPORT_WORKERS=int(os.getenv('REPORT_WORKERS',2))
+    REPORT_JOBS_PER_USER=int(os.getenv('REPORT_JOBS_PER_USER',2))
+    REPORT_QUEUE_LIMIT=int(os.getenv('REPORT_QUEUE_LIMIT',20))
+    REPORT_JOB_TIMEOUT=int(os.getenv('REPORT_JOB_TIMEOUT',600)) #seconds before a queued job counts as lost
+    REPORT_JOB_RETENTION=int(os.getenv('REPORT_JOB_RETENTION',3600)) #seconds finished files are kept
+    REPORT_OUTPUT_DIR=os.getenv('REPORT_OUTPUT_DIR',os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','instance','reports')))
+    REPORT_CACHE_DIR=os.getenv('REPORT_CACHE_DIR',os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','instance','report_cache')))
+    REPORT_CACHE_MAX_BYTES=int(os.getenv('REPORT_CACHE_MAX_MB',200))*1024*1024
+    REPORT_CACHE_MAX_AGE=int(os.getenv('REPORT_CACHE_MAX_AGE',30*24*3600)) #seconds a cached pdf is served
+    REPORT_TEMPLATE_VERSION=os.getenv('REPORT_TEMPLATE_VERSION') #defaults to a hash of the report template
+    ADMIN_EMAILS=[e.strip().lower() for e in os.getenv('ADMIN_EMAILS','').split(',') if e.strip()]
+    SQL_INSTRUMENTATION=os.getenv('SQL_INSTRUMENTATION','false').lower() in ('1','true','yes') #per request/job query counts, off by default
+    SQL_N_PLUS_ONE_THRESHOLD=int(os.getenv('SQL_N_PLUS_ONE_THRESHOLD',10)) #same statement this many times in one request logs a warning
+    PROFILER_ENABLED=os.getenv('PROFILER_ENABLED','false').lower() in ('1','true','yes')
+    PROFILER_SAMPLE_RATE=float(os.getenv('PROFILER_SAMPLE_RATE',0.01)) #fraction of requests profiled regardless of latency
+    PROFILER_SLOW_MS=int(os.getenv('PROFILER_SLOW_MS',1000)) #requests/jobs slower than this are always kept
+    PROFILER_INTERVAL_MS=int(os.getenv('PROFILER_INTERVAL_MS',5))
+    PROFILER_MAX_FILES=int(os.getenv('PROFILER_MAX_FILES',200))
+    PROFILER_TOP_N=int(os.getenv('PROFILER_TOP_N',20))
+    PROFILER_DIR=os.getenv('PROFILER_DIR',os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','instance','profiles')))
+    CATEGORY_CACHE_TTL=int(os.getenv('CATEGORY_CACHE_TTL',300)) #seconds, 0 keeps categories until a write invalidates them
+    USER_CACHE_SIZE=int(os.getenv('USER_CACHE_SIZE',1024))
+    USER_CACHE_TTL=int(os.getenv('USER_CACHE_TTL',300)) #seconds a logged in user is served from memory
+    DUE_SCAN_CHUNK_SIZE=int(os.getenv('DUE_SCAN_CHUNK_SIZE',500)) #users per chunk of the due expense monitor's scan
+    OVERDUE_REMINDER_DAYS=int(os.getenv('OVERDUE_REMINDER_DAYS',3)) #days between reminders for an overdue expense, 0 reminds once
+    NOTIFICATION_LEDGER_RETENTION_DAYS=int(os.getenv('NOTIFICATION_LEDGER_RETENTION_DAYS',90))
+    APP_BASE_URL=os.getenv('APP_BASE_URL','http://localhost:5000') #links in notification emails
+    #notification emails go out through a thread pool, throttled to Gmail's per-user quota (250 units/s, 100 per send)
+    EMAIL_WORKERS=int(os.getenv('EMAIL_WORKERS',4))
+    EMAIL_BATCH_SIZE=int(os.getenv('EMAIL_BATCH_SIZE',10)) #messages per Gmail batch request, 1 sends them one by one
+    EMAIL_QUOTA_UNITS_PER_SECOND=float(os.getenv('EMAIL_QUOTA_UNITS_PER_SECOND',250))
+    EMAIL_SEND_UNITS=int(os.getenv('EMAIL_SEND_UNITS',100))
+    EMAIL_MAX_RETRIES=int(os.getenv('EMAIL_MAX_RETRIES',5)) #retries of a message answered with 429/5xx
+    EMAIL_BACKOFF_BASE=float(os.getenv('EMAIL_BACKOFF_BASE',1.0)) #seconds, doubled on every retry
+    EMAIL_BACKOFF_MAX=float(os.getenv('EMAIL_BACKOFF_MAX',60.0))
+    #emails are queued in the email_outbox table and sent by `flask outbox-worker`
+    OUTBOX_BATCH_SIZE=int(os.getenv('OUTBOX_BATCH_SIZE',100))
+    OUTBOX_POLL_SECONDS=float(os.getenv('OUTBOX_POLL_SECONDS',10))
+    OUTBOX_LEASE_SECONDS=int(os.getenv('OUTBOX_LEASE_SECONDS',300)) #a leased batch is handed to another worker after this
+    OUTBOX_SMTP_TIMEOUT=float(os.getenv('OUTBOX_SMTP_TIMEOUT',30)) #seconds an SMTP connect or command may take, keep well below the lease
+    OUTBOX_MAX_ATTEMPTS=int(os.getenv('OUTBOX_MAX_ATTEMPTS',8)) #then the message is dead-lettered
+    OUTBOX_BACKOFF_BASE=float(os.getenv('OUTBOX_BACKOFF_BASE',60)) #seconds before the first retry, doubled after each
+    OUTBOX_BACKOFF_MAX=float(os.getenv('OUTBOX_BACKOFF_MAX',6*3600))
+    OUTBOX_RETENTION_DAYS=int(os.getenv('OUTBOX_RETENTION_DAYS',7)) #sent messages are deleted after this
+    #run the worker as a scheduler job of the web process, turn off when a separate worker runs
+    OUTBOX_IN_PROCESS_WORKER=os.getenv('OUTBOX_IN_PROCESS_WORKER','true').lower() in ('1','true','yes')
+    FORECAST_DEFAULT_HORIZON=int(os.getenv('FORECAST_DEFAULT_HORIZON',90)) #days /api/forecast projects when no horizon is given
+    FORECAST_MAX_HORIZON=int(os.getenv('FORECAST_MAX_HORIZON',5*366))
+    EXPENSE_SEARCH_BACKEND=os.getenv('EXPENSE_SEARCH_BACKEND','auto') #'auto' uses FTS5/tsvector when installed,'ilike' forces the fallback
     
 class DevelopmentConfig(Config):
     DEBUG=True
@@ -0,0 +1,3 @@
+#development helpers (local stand-ins for external services) used by the bench commands and the tests,
+#nothing in the running app imports this package
+from .fake_gmail import FakeGmailServer,gmail_env
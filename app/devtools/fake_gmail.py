@@ -0,0 +1,157 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeGmailServer:
+    """Local stand-in for the Google token and Gmail send endpoints, for the bench commands and the tests.
+
+    Point GmailService at it with gmail_env(), which sets GOOGLE_TOKEN_URI=<url>/token and
+    GMAIL_API_ENDPOINT=<url>. Every request waits latency seconds, counters record what was called
+    and batch_sizes the number of sends in each batch request. Statuses queued with script() answer
+    the next sends in order (None is a success), after that a fail_rate share of sends is answered
+    with fail_status, to exercise retries.
+    """
+
+    def __init__(self, latency=0.0, token_ttl=3600, fail_rate=0.0, fail_status=429, seed=None):
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.counts = {'token': 0, 'send': 0, 'batch': 0, 'failed': 0}
+        self.batch_sizes = []
+        self._script = deque()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+            return self.counts[name]
+
+    def script(self, *statuses):
+        """Answer the next sends with these statuses, None for a success"""
+        with self._lock:
+            self._script.extend(statuses)
+
+    def _send(self):
+        """(status, payload) for one messages.send call"""
+        with self._lock:
+            if self._script:
+                status = self._script.popleft()
+            else:
+                status = self.fail_status if self.fail_rate and self._random.random() < self.fail_rate else None
+        if status is not None:
+            self._count('failed')
+            return status, {'error': {'code': status, 'message': 'Injected failure'}}
+        return 200, {'id': f"fake-{self._count('send')}"}
+
+    def _batch(self, content_type, body):
+        """Answer a multipart/mixed batch request part by part, like the Gmail batch endpoint"""
+        self._count('batch')
+        request = BytesParser().parsebytes(b'Content-Type: ' + content_type.encode('ascii') + b'\r\n\r\n' + body)
+        boundary = f'batch_{uuid.uuid4().hex}'
+        parts = []
+        with self._lock:
+            self.batch_sizes.append(len(request.get_payload()))
+        for part in request.get_payload():
+            inner = part.get_payload()
+            inner = inner if isinstance(inner, str) else inner[0].as_string()
+            if ' /gmail/v1/users/me/messages/send' in inner.split('\n', 1)[0]:
+                status, payload = self._send()
+            else:
+                status, payload = 404, {'error': {'code': 404, 'message': 'Unknown batch path'}}
+            content_id = part['Content-ID'] or ''
+            parts.append(f'--{boundary}\r\nContent-Type: application/http\r\n'
+                         f'Content-ID: <response-{content_id.strip("<>")}>\r\n\r\n'
+                         f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\n'
+                         f'Content-Type: application/json; charset=UTF-8\r\n\r\n{json.dumps(payload)}\r\n')
+        return f'multipart/mixed; boundary={boundary}', (''.join(parts) + f'--{boundary}--\r\n').encode('utf-8')
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # keep-alive responses go out in one segment, otherwise Nagle + delayed ACK add ~40ms per call
+            disable_nagle_algorithm = True
+            wbufsize = -1
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload, content_type='application/json'):
+                body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if self.path.startswith('/token'):
+                    fake._count('token')
+                    self._reply(200, {'access_token': 'fake-token', 'expires_in': fake.token_ttl, 'token_type': 'Bearer'})
+                elif self.path.startswith('/gmail/v1/users/me/messages/send'):
+                    self._reply(*fake._send())
+                elif self.path.startswith('/batch/gmail/v1'):
+                    content_type, payload = fake._batch(self.headers.get('Content-Type', ''), body)
+                    self._reply(200, payload, content_type)
+                else:
+                    self._reply(404, {'error': {'code': 404, 'message': f'Unknown path {self.path}'}})
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-gmail', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+@contextmanager
+def gmail_env(fake):
+    """Point GmailService at a FakeGmailServer for the duration of the block"""
+    from app.services import GmailService
+    values = {'GOOGLE_CLIENT_ID': 'fake', 'GOOGLE_CLIENT_SECRET': 'fake', 'GOOGLE_REFRESH_TOKEN': 'fake',
+              'GOOGLE_TOKEN_URI': f'{fake.url}/token', 'GMAIL_API_ENDPOINT': fake.url,
+              'GMAIL_SENDER_EMAIL': 'fake@example.com'}
+    saved = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    GmailService.reset_clients()
+    try:
+        yield
+    finally:
+        GmailService.reset_clients()
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
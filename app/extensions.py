@@ -9,5 +9,5 @@ login_manager.login_view='auth.login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    from .models.user import User
-    return User.query.get(int(user_id))
\ No newline at end of file
+    from .services.user_cache import user_cache
+    return user_cache.get(int(user_id))
\ No newline at end of file
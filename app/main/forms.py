@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField,FileRequired,FileAllowed
 from wtforms import StringField,SubmitField,DateField,FloatField,SelectField,BooleanField
 from wtforms.validators import DataRequired,NumberRange,Optional
-from ..models.category import Category
+from ..services.category_cache import category_cache
 from datetime import date
 
 class ExpenseForm(FlaskForm):
@@ -13,7 +14,7 @@ class ExpenseForm(FlaskForm):
 
     def __init__(self,*args,**kwargs):
         super(ExpenseForm,self).__init__(*args,**kwargs)
-        self.category_id.choices=[(c.id,c.name)for c in Category.query.all()]
+        self.category_id.choices=category_cache.choices()
         #self.category_id.choices will be [(1,'Food'),(2,'Transportation')] like this...
 class RecurringExpenseForm(FlaskForm):
     title=StringField('Title',validators=[DataRequired()])
@@ -29,5 +30,22 @@ class RecurringExpenseForm(FlaskForm):
     
     def __init__(self,*args,**kwargs):
         super(RecurringExpenseForm,self).__init__(*args,**kwargs)
-        self.category_id.choices=[(c.id,c.name)for c in Category.query.all()]
-    
\ No newline at end of file
+        self.category_id.choices=category_cache.choices()
+
+class ImportExpensesForm(FlaskForm):
+    file=FileField('Bank Statement',validators=[FileRequired(),FileAllowed(['csv','ofx','qfx'],'Upload a CSV or OFX file')])
+    file_format=SelectField('Format',choices=[('auto','Detect automatically'),('csv','CSV'),('ofx','OFX / QFX')],default='auto')
+    default_category_id=SelectField('Category for unmatched rows',coerce=int,validators=[DataRequired()])
+    date_format=StringField('Date Format (Optional)',validators=[Optional()],description='e.g. %d/%m/%Y, detected when empty')
+    date_column=StringField('Date Column (Optional)',validators=[Optional()])
+    amount_column=StringField('Amount Column (Optional)',validators=[Optional()])
+    description_column=StringField('Description Column (Optional)',validators=[Optional()])
+    category_column=StringField('Category Column (Optional)',validators=[Optional()])
+    debit_sign=SelectField('Spending Amounts Are',choices=[('','Detected from the column (Debit/Withdrawal positive, Amount negative)'),
+                                                          ('negative','Negative, credits are positive'),
+                                                          ('positive','Positive, refunds are negative')],default='',validators=[Optional()])
+    submit=SubmitField('Import Expenses')
+
+    def __init__(self,*args,**kwargs):
+        super(ImportExpensesForm,self).__init__(*args,**kwargs)
+        self.default_category_id.choices=category_cache.choices()
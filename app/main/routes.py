@@ -1,15 +1,20 @@
-from flask import render_template,redirect,request,url_for,flash,jsonify,make_response
+from flask import render_template,redirect,request,url_for,flash,jsonify,make_response,Response,stream_with_context,current_app,send_file
 from flask_login import login_required,current_user
 from ..extensions import db
 from . import main_bp
-from sqlalchemy.sql import func
 from ..models import Expense
-from ..models import Category
-from .forms import ExpenseForm,RecurringExpenseForm
+from .forms import ExpenseForm,RecurringExpenseForm,ImportExpensesForm
+from ..utils import keyset_page,ranked_page
+from ..services import ExpenseSearch,ExpenseImporter,ExpenseReport,DueItems,ReportJobLimitError,category_cache,forecast
 from ..models import RecurringExpense
-from datetime import date,datetime
-from weasyprint import HTML,CSS
-from io import BytesIO
+from ..models import MonthlyCategoryTotal
+from datetime import date,datetime,timedelta
+from io import StringIO,TextIOWrapper
+import os
+import csv
+import json
+
+expense_search=ExpenseSearch()
 
 
 @main_bp.route('/')
@@ -23,16 +28,19 @@ def dashboard():
     recurring_count = len(recurring_expenses)
     due_count = sum(1 for re in recurring_expenses if re.is_due())
     
-    return render_template('main/dashboard.html',recurring_count=recurring_count,due_count=due_count,show_navbar=True)
+    categories=category_cache.all()
+    return render_template('main/dashboard.html',recurring_count=recurring_count,due_count=due_count,categories=categories,
+                           show_navbar=True)
 
 @main_bp.route('/api/dashboard-data',methods=['GET','POST']) 
 @login_required
 def dashboard_data():
     try:
-        total_expenses=db.session.query(func.sum(Expense.amount)).filter_by(user_id=current_user.id).scalar()or 0
-        query_res=db.session.query(Category.name,func.sum(Expense.amount).label('total')).join(Expense).filter(
-        Expense.user_id==current_user.id).group_by(Category.name).all()
-        expenses_by_category=[(row.name,float(row.total))for row in query_res]
+        #read the monthly rollup so the cost follows categories x months, not the number of expenses
+        query_res=db.session.execute(MonthlyCategoryTotal.category_totals_select(current_user.id)).all()
+        category_names=category_cache.names()
+        expenses_by_category=[(category_names.get(row.category_id,''),float(row.total))for row in query_res]
+        total_expenses=sum(total for _,total in expenses_by_category)
         return jsonify({
             'success':True,
             'total_expenses':float(total_expenses),
@@ -48,11 +56,21 @@ def dashboard_data():
             'category_count':0
         }),500
 
+@main_bp.route('/api/forecast')
+@login_required
+def forecast_data():
+    #projected recurring outflows per day/week/month and category for the next `horizon` days
+    horizon=forecast.horizon(request.args.get('horizon'))
+    result=forecast.forecast(current_user.id,horizon,request.args.get('period','month'))
+    return jsonify(dict(result,success=True))
+
 @main_bp.route('/expenses')
 @login_required
 def expense_list():
-    expenses=Expense.query.filter_by(user_id=current_user.id).all()
-    return render_template('main/expense_list.html',expenses=expenses,show_navbar=False)
+    query=Expense.query.filter_by(user_id=current_user.id)
+    expenses,next_cursor=keyset_page(query,Expense.date,Expense.id,per_page=request.args.get('per_page'))
+    return render_template('main/expense_list.html',expenses=expenses,next_cursor=next_cursor,categories=category_cache.all(),
+                           category_names=category_cache.names(),show_navbar=False)
 
 @main_bp.route('/expense/new',methods=['GET','POST'])
 @login_required
@@ -62,11 +80,34 @@ def expense_create():
         expense=Expense(amount=form.amount.data,description=form.description.data,date=form.date.data,
                 user_id=current_user.id,category_id=form.category_id.data)
         db.session.add(expense)
+        MonthlyCategoryTotal.record(expense)
         db.session.commit()
         flash("Expense added successfully!",category='success')
         return redirect(url_for('main.expense_list'))
     return render_template('main/expense_create.html',form=form,show_navbar=False)
 
+@main_bp.route('/expenses/import',methods=['GET','POST'])
+@login_required
+def import_expenses():
+    form=ImportExpensesForm()
+    report=None
+    if form.validate_on_submit():
+        upload=form.file.data
+        columns={'date':form.date_column.data,'amount':form.amount_column.data,
+                 'description':form.description_column.data,'category':form.category_column.data}
+        importer=ExpenseImporter(current_user.id,default_category_id=form.default_category_id.data,
+                                 date_format=form.date_format.data or None,columns=columns,
+                                 debit_sign=form.debit_sign.data or None,
+                                 batch_size=current_app.config['IMPORT_BATCH_SIZE'])
+        #decode the upload as a stream instead of reading the whole file into memory
+        lines=TextIOWrapper(upload.stream,encoding='utf-8-sig',errors='replace',newline='')
+        try:
+            report=importer.run(lines,filename=upload.filename or '',file_format=form.file_format.data)
+            flash(f"Import finished: {importer.summary()}",category='success' if not report['failed'] else 'warning')
+        except Exception as e:
+            flash(f"Error importing expenses: {str(e)}",category='danger')
+    return render_template('main/import_expenses.html',form=form,report=report,show_navbar=False)
+
 @main_bp.route('/recurring-expenses')
 @login_required
 def recurring_expenses():
@@ -132,43 +173,31 @@ def delete_recurring_expense(id):
 @main_bp.route('/process-due')
 @login_required
 def process_due():
-    due_expenses=[]
-    all_expenses=RecurringExpense.query.filter().all() #querying all recurring expense
-    #optimal one is querying only valid rows using sqlalchemy
-    #due_expenses=RecurringExpense.query.filter(RecurringExpense.user_id == current_user.id,RecurringExpense.is_active,RecurringExpense.next_due_date <= date.today()).all()
+    due_expenses,next_cursor,due_count=[],None,0
+    cursor=request.args.get('cursor')
     try:
-        for expense in all_expenses:
-            if expense.user_id==current_user.id and expense.is_active and expense.next_due_date<=date.today():
-                due_expenses.append(expense)
+        #one indexed page of this user's unprocessed due items, oldest first
+        due_expenses,next_cursor=DueItems.page(current_user.id,cursor=cursor,per_page=request.args.get('per_page'))
+        due_count=len(due_expenses) if not (cursor or next_cursor) else DueItems.count(current_user.id)
         #no such expense found
-        if not due_expenses:
+        if not due_expenses and not cursor:
             flash("No recurring expenses were due for processing.",category='info')
     except Exception as e:
         flash(f"Error fetching due expenses: {str(e)}",category='danger')
-    return render_template('main/process_due.html',due_expenses=due_expenses,today=date.today(),show_navbar=False)
+    return render_template('main/process_due.html',due_expenses=due_expenses,due_count=due_count,next_cursor=next_cursor,
+                           category_names=category_cache.names(),today=date.today(),show_navbar=False)
 
 @main_bp.route('/process-selected',methods=['POST'])
 @login_required
 def process_selected():
     processed_expenses=[]
     try:
-        selected_ids=request.form.getlist('selected_expenses')
+        selected_ids=[int(i) for i in request.form.getlist('selected_expenses') if i.isdigit()]
         if not selected_ids:
             flash("No expenses selected for processing",category='warning')
             return redirect(url_for('main.process_due'))
-        for expense_id in selected_ids:
-            expense=RecurringExpense.query.filter(RecurringExpense.id==expense_id,RecurringExpense.user_id==current_user.id).first()
-            if expense and expense.process_due:
-                new_expense=expense.create_expense_entry()
-                db.session.add(new_expense)
-                processed_expenses.append({
-                    'title': expense.title,
-                    'amount': float(expense.amount),
-                    'due_date': expense.next_due_date.strftime('%Y-%m-%d'),
-                    'next_due': expense.calculate_next_due_date().strftime('%Y-%m-%d')
-                })
-                expense.update_next_due_date()
-        db.session.commit()
+        #one locking select, one bulk insert and one bulk update for the whole selection
+        processed_expenses=DueItems.process(current_user.id,selected_ids,catch_up=bool(request.form.get('catch_up')))
         if processed_expenses:
             flash(f"Successfully processed {len(processed_expenses)} recurring expenses!",category='sucesss')
         else:
@@ -189,12 +218,14 @@ def process_individual(expense_id):
         if not expense.process_due:
             flash("This expense is not due for processing",category='warning')
             return redirect(url_for('main.process_due'))
-        new_expense=expense.create_expense_entry()
-        db.session.add(new_expense)
-        old_due_date=expense.next_due_date
-        expense.update_next_due_date()
-        db.session.commit()
-        flash(f"Successfully processed '{expense.title}' - ₹{expense.amount}. Next due: {expense.next_due_date.strftime('%Y-%m-%d')}", category='success')
+        #catch up generates every missed occurrence up to today instead of just the current one
+        processed=DueItems.process(current_user.id,[expense.id],catch_up=bool(request.form.get('catch_up')))
+        if not processed:
+            flash("Nothing was owed for this expense",category='warning')
+            return redirect(url_for('main.process_due'))
+        result=processed[0]
+        occurrences=f" x{result['occurrences']}" if result['occurrences']>1 else ''
+        flash(f"Successfully processed '{result['title']}'{occurrences} - ₹{result['amount']:.2f}. Next due: {result['next_due']}", category='success')
     except Exception as e:
         db.session.rollback()
         flash(f"Error processing expense:{str(e)}",category='danger')
@@ -205,82 +236,150 @@ def process_individual(expense_id):
 @login_required
 def search_expenses():
     keyword = request.args.get('q', '').strip()
-    query = Expense.query.filter_by(user_id=current_user.id)
+    sort = request.args.get('sort', 'date')
+    cursor = request.args.get('cursor')
+    filters = expense_search.parse_filters(request.args)
+    query = expense_search.apply_filters(Expense.query.filter_by(user_id=current_user.id), filters)
+    score = None
     if keyword:
-        query = query.filter(Expense.description.ilike(f'%{keyword}%'))
-    expenses = query.order_by(Expense.date.desc()).all()
+        query, score = expense_search.apply(query, keyword, current_user.id)
+    #facets describe the whole result set so they are only sent with the first page
+    facets = None if cursor else expense_search.facets(query, current_user.id, keyword, filters)
+    if sort == 'relevance' and score is not None:
+        expenses, next_cursor = ranked_page(query, score, Expense.id, cursor=cursor,
+                                            per_page=request.args.get('per_page'))
+    else:
+        expenses, next_cursor = keyset_page(query, Expense.date, Expense.id, cursor=cursor,
+                                            per_page=request.args.get('per_page'))
+    category_names = category_cache.names()
     res = []
     for exp in expenses:
         res.append({
+            'id': exp.id,
             'amount': float(exp.amount),
             'description': exp.description,
             'date': exp.date.strftime('%Y-%m-%d'),
-            'category': exp.category.name if exp.category else ''
+            'category': category_names.get(exp.category_id, ''),
+            'recurring': exp.recurring_expense_id is not None
         })
-    return jsonify(res)
+    payload = {'expenses': res, 'next_cursor': next_cursor}
+    if facets is not None:
+        payload['facets'] = facets
+    return jsonify(payload)
+
+def _export_rows(user_id,filters):
+    #plain column tuples streamed with a server side cursor so memory does not grow with history
+    stmt=expense_search.rows_select(user_id,filters)
+    batch_size=current_app.config['EXPORT_BATCH_SIZE']
+    for partition in db.session.execute(stmt.execution_options(yield_per=batch_size)).partitions():
+        yield partition
+
+def _export_response(body,mimetype,extension):
+    response=Response(stream_with_context(body),mimetype=mimetype)
+    response.headers['Content-Disposition']=f'attachment; filename=expenses_{date.today().isoformat()}.{extension}'
+    response.headers['X-Accel-Buffering']='no' #let nginx pass chunks straight through
+    return response
+
+@main_bp.route('/export.csv')
+@login_required
+def export_expenses_csv():
+    filters=expense_search.parse_filters(request.args)
+    user_id=current_user.id
+    category_names=category_cache.names()
+    def generate():
+        buffer=StringIO()
+        writer=csv.writer(buffer)
+        writer.writerow(['id','date','amount','description','category','recurring'])
+        yield buffer.getvalue()
+        for rows in _export_rows(user_id,filters):
+            buffer.seek(0)
+            buffer.truncate()
+            for row in rows:
+                writer.writerow([row.id,row.date.strftime('%Y-%m-%d'),f"{row.amount:.2f}",row.description or '',
+                                 category_names.get(row.category_id,''),'yes' if row.recurring_expense_id else 'no'])
+            yield buffer.getvalue()
+    return _export_response(generate(),'text/csv','csv')
+
+@main_bp.route('/export.ndjson')
+@login_required
+def export_expenses_ndjson():
+    filters=expense_search.parse_filters(request.args)
+    user_id=current_user.id
+    category_names=category_cache.names()
+    def generate():
+        for rows in _export_rows(user_id,filters):
+            yield ''.join(json.dumps({
+                'id':row.id,
+                'date':row.date.strftime('%Y-%m-%d'),
+                'amount':float(row.amount),
+                'description':row.description,
+                'category':category_names.get(row.category_id,''),
+                'recurring':row.recurring_expense_id is not None
+            })+'\n' for row in rows)
+    return _export_response(generate(),'application/x-ndjson','ndjson')
+
+def _report_cache_key(report):
+    return current_app.extensions['report_cache'].key(current_user,report.start,report.end,report.category_id,
+                                                      report.template,variant=report.subtotal_period or '')
+
+def _report_html(report,**extra):
+    return render_template(report.template,current_user=current_user,**report.context(),**extra)
 
 @main_bp.route('/export-pdf')
 @login_required
 def export_expense_pdf():
-    start_date=request.args.get('start_date')
-    end_date=request.args.get('end_date')
-    category=request.args.get('category','all')
-    if not start_date:
-        start_date=datetime.now().replace(day=1).strftime('%Y-%m-%d')
-    if not end_date:
-        end_date=datetime.now().strftime('%Y-%m-%d')
-    query=Expense.query.options(db.joinedload(Expense.category)).filter(Expense.user_id==current_user.id)
-    query=query.filter(Expense.date>=start_date)
-    query=query.filter(Expense.date<=end_date)
-    if category!='all':
-        query=query.filter(Expense.category_id==category)
-    expenses=query.order_by(Expense.date.desc()).all()
-    total_amount=sum(expense.amount for expense in expenses)
-    category_totals={}
-    for expense in expenses:
-        category_name=expense.category.name
-        if category_name in category_totals:
-            category_totals[category_name]+=expense.amount
-        else:
-            category_totals[category_name]=expense.amount
-    html_content = render_template('main/expense_report.html',expenses=expenses,total_amount=total_amount,
-    category_totals=category_totals,start_date=start_date,end_date=end_date,current_user=current_user,generated_date=datetime.now())
-    pdf_file=BytesIO()
-    HTML(string=html_content).write_pdf(pdf_file)
-    pdf_file.seek(0)
-
-    response=make_response(pdf_file.getvalue())
-    response.headers['Content-Type']='application/pdf'
-    response.headers['Content-Disposition']=f'attachment; filename=expense_report_{start_date}_{end_date}.pdf'
-    return response
+    report=ExpenseReport.from_args(current_user.id,request.args)
+    cache=current_app.extensions['report_cache']
+    cache_key=_report_cache_key(report)
+    cached_path=cache.get(cache_key)
+    if not cached_path:
+        #only rendered files are served here, anything else goes through the background job flow
+        #(/export-pdf/jobs) which the preview page starts by itself with export=1
+        return redirect(url_for('main.preview_report',export=1,**report.args))
+    return send_file(cached_path,mimetype='application/pdf',as_attachment=True,download_name=report.filename)
+
+@main_bp.route('/export-pdf/jobs',methods=['POST'])
+@login_required
+def submit_report_job():
+    report=ExpenseReport.from_args(current_user.id,request.values)
+    cache_key=_report_cache_key(report)
+    if current_app.extensions['report_cache'].get(cache_key):
+        #same rows and template as an earlier render, skip the queue and serve that file
+        return jsonify({'success':True,'status':'done','filename':report.filename,'cached':True,
+                        'download_url':url_for('main.export_expense_pdf',**report.args)})
+    #render the html here (needs the db and templates) and hand the pdf conversion to the worker pool
+    html_content=_report_html(report)
+    try:
+        job=current_app.extensions['report_jobs'].submit(current_user.id,html_content,report.filename,cache_key=cache_key)
+    except ReportJobLimitError as e:
+        return jsonify({'success':False,'error':str(e)}),429
+    payload=job.to_dict()
+    payload.update(success=True,status_url=url_for('main.report_job_status',job_id=job.id))
+    return jsonify(payload),202
+
+@main_bp.route('/export-pdf/jobs/<job_id>')
+@login_required
+def report_job_status(job_id):
+    job=current_app.extensions['report_jobs'].get(current_user.id,job_id)
+    if not job:
+        return jsonify({'success':False,'error':'Report job not found'}),404
+    payload=job.to_dict()
+    payload['success']=True
+    if job.status=='done':
+        payload['download_url']=url_for('main.download_report_job',job_id=job.id)
+    return jsonify(payload)
+
+@main_bp.route('/export-pdf/jobs/<job_id>/download')
+@login_required
+def download_report_job(job_id):
+    job=current_app.extensions['report_jobs'].get(current_user.id,job_id)
+    if not job or job.status!='done' or not os.path.exists(job.file_path):
+        flash("Report is not available, please export it again",category='warning')
+        return redirect(url_for('main.dashboard'))
+    return send_file(job.file_path,mimetype='application/pdf',as_attachment=True,download_name=job.filename)
 
 @main_bp.route('/preview-report')
 @login_required
 def preview_report():
-    start_date=request.args.get('start_date')
-    end_date=request.args.get('end_date')
-    category=request.args.get('category','all')
-    if not start_date:
-        start_date = datetime.now().replace(day=1).strftime('%Y-%m-%d')
-    if not end_date:
-        end_date = datetime.now().strftime('%Y-%m-%d')
-    
-    query = Expense.query.filter(Expense.user_id == current_user.id)
-    query = query.filter(Expense.date >= start_date)
-    query = query.filter(Expense.date <= end_date)
-    
-    if category != 'all':
-        query = query.filter(Expense.category == category)
-    
-    expenses = query.order_by(Expense.date.desc()).all()
-    total_amount = sum(expense.amount for expense in expenses)
-    
-    category_totals = {}
-    for expense in expenses:
-        if expense.category in category_totals:
-            category_totals[expense.category] += expense.amount
-        else:
-            category_totals[expense.category] = expense.amount
-    
-    return render_template('main/expense_report.html',expenses=expenses,total_amount=total_amount,category_totals=category_totals,
-    start_date=start_date,end_date=end_date, current_user=current_user,generated_date=datetime.now(),is_preview=True)
\ No newline at end of file
+    report=ExpenseReport.from_args(current_user.id,request.args)
+    return _report_html(report,is_preview=True,auto_export=request.args.get('export')=='1')
@@ -1,4 +1,8 @@
 from .user import User
 from .expense import Expense
 from .category import Category
-from .expense import RecurringExpense
\ No newline at end of file
+from .expense import RecurringExpense
+from .rollup import MonthlyCategoryTotal
+from .report_job import ReportJob
+from .notification import NotificationLedger
+from .outbox import OutboxMessage
\ No newline at end of file
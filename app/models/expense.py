@@ -1,6 +1,6 @@
 from ..extensions import db
 from datetime import datetime,timedelta,date
-from dateutil.relativedelta import relativedelta
+from ..utils.recurrence import Recurrence,FREQUENCIES
 
 class Expense(db.Model):
     __tablename__='expenses'
@@ -10,6 +10,17 @@ class Expense(db.Model):
     date=db.Column(db.DateTime,nullable=False,default=datetime.utcnow)
     user_id=db.Column(db.Integer,db.ForeignKey('users.id'),nullable=False)
     category_id=db.Column(db.Integer,db.ForeignKey('categories.id'),nullable=False)
+    #set when the expense was generated from a recurring expense
+    recurring_expense_id=db.Column(db.Integer,db.ForeignKey('recurring_expenses.id'),nullable=True)
+    #fingerprint of the statement line an imported expense came from, re-imports are skipped by the unique index
+    import_hash=db.Column(db.String(40),nullable=True)
+
+    #every expense page filters by user first and then by date range or sort order
+    __table_args__=(
+        db.Index('ix_expenses_user_date','user_id','date'),
+        db.Index('ix_expenses_user_category_date','user_id','category_id','date'),
+        db.Index('ux_expenses_user_import_hash','user_id','import_hash',unique=True),
+    )
 
 class RecurringExpense(db.Model):
     __tablename__='recurring_expenses'
@@ -33,6 +44,13 @@ class RecurringExpense(db.Model):
     user=db.relationship('User',backref=db.backref('recurring_expenses',lazy=True))
     category = db.relationship('Category', backref=db.backref('recurring_expenses', lazy=True))
 
+    #per user pages (dashboard,recurring list,process due) and the monitor scan over active rows only
+    __table_args__=(
+        db.Index('ix_recurring_expenses_user_active_due','user_id','is_active','next_due_date'),
+        db.Index('ix_recurring_expenses_active_due','next_due_date','last_processed_date',
+                 postgresql_where=is_active==True,sqlite_where=is_active==True),
+    )
+
     def __init__(self,force_due=False,**kwargs):
         super(RecurringExpense,self).__init__(**kwargs)
         #automatically set next due date based on start date  and frequency
@@ -41,6 +59,11 @@ class RecurringExpense(db.Model):
                 self.next_due_date=self.start_date
             else:
                 self.next_due_date=self.calculate_initial_next_due_date()
+    @property
+    def recurrence(self):
+        #schedule anchored on start_date, every due date is computed from it so month ends don't drift (31st->28th->31st)
+        return Recurrence(self.frequency,self.start_date,until=self.end_date)
+
     def calculate_initial_next_due_date(self):
         #caluculate the initial next due date only when a new recurr expense is created and also identify next due date  logically with 
         #current date, if a user add a old recurr expense whom next due date is already past from current date there is no point of adding them
@@ -48,28 +71,10 @@ class RecurringExpense(db.Model):
         start=self.start_date
         today=date.today()
         #if start date is in the future next due date is start date
-        if start>today:
+        if start>today or self.frequency not in FREQUENCIES:
             return start
-        if self.frequency=='daily':
-            days_diff=(today-start).days
-            return start+timedelta(days=days_diff+1)
-        elif self.frequency=='weekly':
-            weeks_diff=(today-start).days//7
-            next_date=start+timedelta(weeks=weeks_diff)
-            if next_date<=today:
-                next_date=start+timedelta(weeks=weeks_diff+1)
-            return next_date
-        elif self.frequency=='monthly':
-            next_date=start
-            while next_date<=today:
-                next_date=next_date+relativedelta(months=1)
-            return next_date
-        elif self.frequency=='yearly':
-            next_date=start
-            while next_date<=today:
-                next_date=next_date+relativedelta(years=1)
-            return next_date
-        return start
+        #first occurrence after today, ignoring end_date like before
+        return self.recurrence.occurrence(self.recurrence.index_on_or_after(today+timedelta(days=1)))
 
     @property
     def process_due(self):
@@ -77,20 +82,33 @@ class RecurringExpense(db.Model):
                 or self.last_processed_date<self.next_due_date))
 
     def calculate_next_due_date(self):
-        current_due=self.next_due_date
-        if self.frequency=='daily':
-            return current_due+timedelta(days=1)
-        elif self.frequency=='weekly':
-            return current_due+timedelta(weeks=1)
-        elif self.frequency=='monthly':
-            return current_due+relativedelta(months=1)
-        elif self.frequency=='yearly':
-            return current_due+relativedelta(years=1)
-        return current_due
+        #the occurrence in the period after the current due date, a legacy due date that drifted off the anchor
+        #day (e.g. the 28th for a 31st start) moves back onto it next month rather than being charged twice
+        if self.frequency not in FREQUENCIES:
+            return self.next_due_date
+        return self.recurrence.following(self.next_due_date)
+
+    def occurrence_after(self,n):
+        #n periods after the current due date, computed from the anchor rather than stepped one at a time
+        if n==0 or self.frequency not in FREQUENCIES:
+            return self.next_due_date
+        rule=self.recurrence
+        return rule.occurrence(max(rule.period_index(self.next_due_date)+n,n-1))
+
+    def missed_occurrences(self,today=None):
+        #every due date from next_due_date up to today (and end_date) that a catch up has to generate
+        last=min(today or date.today(),self.end_date or date.max)
+        if self.next_due_date>last:
+            return []
+        if self.frequency not in FREQUENCIES:
+            return [self.next_due_date]
+        rule=self.recurrence
+        first=max(rule.period_index(self.next_due_date)+1,0)
+        return [self.next_due_date]+[rule.occurrence(k) for k in range(first,rule.index_on_or_before(last)+1)]
     
     def create_expense_entry(self):
         expense=Expense(user_id=self.user_id,amount=self.amount,category_id=self.category_id,description=f"{self.title}(Recurring)",
-                        date=self.next_due_date)
+                        date=self.next_due_date,recurring_expense_id=self.id)
         return expense
     
     def update_next_due_date(self):
@@ -0,0 +1,61 @@
+from ..extensions import db
+from datetime import datetime,timedelta
+from .rollup import _upsert_insert
+
+class NotificationLedger(db.Model):
+    """Emails sent about a recurring expense's due date, one row per (user,recurring expense,due date,kind).
+    kind is 'due' (sent once, on the due date) or 'overdue' (sent_at is the last reminder, repeated every
+    OVERDUE_REMINDER_DAYS). Processing moves next_due_date on, so old rows simply stop matching"""
+    __tablename__='notification_ledger'
+    user_id=db.Column(db.Integer,db.ForeignKey('users.id'),primary_key=True)
+    recurring_expense_id=db.Column(db.Integer,db.ForeignKey('recurring_expenses.id',ondelete='CASCADE'),primary_key=True)
+    due_date=db.Column(db.Date,primary_key=True)
+    kind=db.Column(db.String(10),primary_key=True)
+    sent_at=db.Column(db.DateTime,nullable=False,default=datetime.utcnow)
+    reminders=db.Column(db.Integer,nullable=False,default=1)
+
+    @staticmethod
+    def kind_of(due_date,today):
+        return 'overdue' if due_date<today else 'due'
+
+    @classmethod
+    def pending(cls,select,today,now,reminder_days):
+        """Anti-join a RecurringExpense select against the ledger, keeping rows never notified for their current
+        due date and state, plus overdue rows whose last reminder is at least reminder_days old (0 sends it once)"""
+        from .expense import RecurringExpense
+        kind=db.case((RecurringExpense.next_due_date<today,'overdue'),else_='due')
+        select=select.outerjoin(cls,db.and_(cls.user_id==RecurringExpense.user_id,cls.recurring_expense_id==RecurringExpense.id,
+                                            cls.due_date==RecurringExpense.next_due_date,cls.kind==kind))
+        if reminder_days>0:
+            return select.where(db.or_(cls.sent_at.is_(None),db.and_(cls.kind=='overdue',cls.sent_at<=now-timedelta(days=reminder_days))))
+        return select.where(cls.sent_at.is_(None))
+
+    @classmethod
+    def record(cls,expenses,today,now=None):
+        """Log that `expenses` were just emailed, inside the caller's transaction"""
+        now=now or datetime.utcnow()
+        rows=[{'user_id':expense.user_id,'recurring_expense_id':expense.id,'due_date':expense.next_due_date,
+               'kind':cls.kind_of(expense.next_due_date,today),'sent_at':now,'reminders':1} for expense in expenses]
+        if not rows:
+            return
+        insert=_upsert_insert(db.session.get_bind().dialect.name)
+        if insert is None:
+            for row in rows:
+                entry=db.session.get(cls,(row['user_id'],row['recurring_expense_id'],row['due_date'],row['kind']))
+                if entry is None:
+                    db.session.add(cls(**row))
+                else:
+                    entry.sent_at=now
+                    entry.reminders+=1
+            return
+        stmt=insert(cls).values(rows)
+        stmt=stmt.on_conflict_do_update(
+            index_elements=[cls.user_id,cls.recurring_expense_id,cls.due_date,cls.kind],
+            set_={'sent_at':stmt.excluded.sent_at,'reminders':cls.reminders+1}
+        )
+        db.session.execute(stmt)
+
+    @classmethod
+    def prune(cls,before):
+        """Delete entries last sent before `before`, returns how many went"""
+        return db.session.execute(db.delete(cls).where(cls.sent_at<before)).rowcount
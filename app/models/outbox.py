@@ -0,0 +1,40 @@
+from ..extensions import db
+from datetime import datetime
+
+class OutboxMessage(db.Model):
+    """A rendered email waiting to be sent by the outbox worker (flask outbox-worker).
+    Producers add rows inside their own transaction, so an email exists exactly when the change that
+    caused it was committed. transport is 'gmail' (GmailService) or 'mail' (Flask-Mail/SMTP)"""
+    __tablename__='email_outbox'
+    id=db.Column(db.Integer,primary_key=True)
+    transport=db.Column(db.String(10),nullable=False,default='gmail')
+    to_email=db.Column(db.String(120),nullable=False)
+    subject=db.Column(db.String(255),nullable=False)
+    html_body=db.Column(db.Text,nullable=False)
+    text_body=db.Column(db.Text)
+    status=db.Column(db.String(10),nullable=False,default='pending') #pending,sent,dead
+    attempts=db.Column(db.Integer,nullable=False,default=0)
+    available_at=db.Column(db.DateTime,nullable=False,default=datetime.utcnow) #not tried again before this
+    #a worker owns the row until leased_until, a crashed worker's rows become available again after it
+    lease_token=db.Column(db.String(32))
+    leased_until=db.Column(db.DateTime)
+    last_error=db.Column(db.String(255))
+    created_at=db.Column(db.DateTime,nullable=False,default=datetime.utcnow)
+    sent_at=db.Column(db.DateTime)
+
+    #workers look for pending rows that are available, oldest first
+    __table_args__=(
+        db.Index('ix_email_outbox_status_available','status','available_at'),
+        db.Index('ix_email_outbox_lease_token','lease_token'),
+    )
+
+    @classmethod
+    def enqueue(cls,to_email,subject,html,text=None,transport='gmail'):
+        """Add an email to the caller's transaction, it is sent once that commits"""
+        message=cls(to_email=to_email,subject=subject,html_body=html,text_body=text,transport=transport,
+                    status='pending',attempts=0,available_at=datetime.utcnow())
+        db.session.add(message)
+        return message
+
+    def to_message(self):
+        return {'to':self.to_email,'subject':self.subject,'html':self.html_body,'text':self.text_body}
@@ -0,0 +1,19 @@
+from ..extensions import db
+from datetime import datetime
+
+class ReportJob(db.Model):
+    """A PDF report rendered in the background, the file lives in REPORT_OUTPUT_DIR until it expires"""
+    __tablename__='report_jobs'
+    id=db.Column(db.String(32),primary_key=True)
+    user_id=db.Column(db.Integer,db.ForeignKey('users.id'),nullable=False,index=True)
+    status=db.Column(db.String(20),nullable=False,default='queued') #queued,done,failed
+    filename=db.Column(db.String(120),nullable=False)
+    file_path=db.Column(db.String(255))
+    error=db.Column(db.String(255))
+    created_at=db.Column(db.DateTime,nullable=False,default=datetime.utcnow)
+    finished_at=db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {'job_id':self.id,'status':self.status,'filename':self.filename,'error':self.error,
+                'created_at':self.created_at.isoformat(),
+                'finished_at':self.finished_at.isoformat() if self.finished_at else None}
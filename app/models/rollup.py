@@ -0,0 +1,133 @@
+from ..extensions import db
+from datetime import date,datetime,time,timedelta
+from dateutil.relativedelta import relativedelta
+from sqlalchemy.sql import func
+
+
+def month_start(value):
+    return date(value.year,value.month,1)
+
+def month_bucket(column,dialect):
+    #sql expression truncating a datetime column to the first day of its month
+    if dialect=='sqlite':
+        return func.date(column,'start of month')
+    return func.date_trunc('month',column).cast(db.Date)
+
+def _upsert_insert(dialect):
+    if dialect=='postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect=='sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+class MonthlyCategoryTotal(db.Model):
+    """Running per (user,category,month) totals kept in step with the expenses table"""
+    __tablename__='monthly_category_totals'
+    user_id=db.Column(db.Integer,db.ForeignKey('users.id'),primary_key=True)
+    category_id=db.Column(db.Integer,db.ForeignKey('categories.id'),primary_key=True)
+    month=db.Column(db.Date,primary_key=True)
+    total=db.Column(db.Float,nullable=False,default=0)
+    expense_count=db.Column(db.Integer,nullable=False,default=0)
+
+    @classmethod
+    def record(cls,expense):
+        cls.record_many([expense])
+
+    @classmethod
+    def record_many(cls,expenses):
+        """Add new expenses to their monthly buckets inside the caller's transaction"""
+        deltas={}
+        for expense in expenses:
+            key=(expense.user_id,expense.category_id,month_start(expense.date))
+            total,count=deltas.get(key,(0.0,0))
+            deltas[key]=(total+float(expense.amount),count+1)
+        if not deltas:
+            return
+        from .user import User
+        User.bump_data_version({user_id for user_id,_,_ in deltas})
+        rows=[{'user_id':user_id,'category_id':category_id,'month':month,'total':total,'expense_count':count}
+              for (user_id,category_id,month),(total,count) in deltas.items()]
+        insert=_upsert_insert(db.session.get_bind().dialect.name)
+        if insert is None:
+            for row in rows:
+                bucket=db.session.get(cls,(row['user_id'],row['category_id'],row['month']))
+                if bucket is None:
+                    db.session.add(cls(**row))
+                else:
+                    bucket.total+=row['total']
+                    bucket.expense_count+=row['expense_count']
+            return
+        stmt=insert(cls).values(rows)
+        stmt=stmt.on_conflict_do_update(
+            index_elements=[cls.user_id,cls.category_id,cls.month],
+            set_={'total':cls.total+stmt.excluded.total,'expense_count':cls.expense_count+stmt.excluded.expense_count}
+        )
+        db.session.execute(stmt)
+
+    @classmethod
+    def rebuild(cls,user_id=None):
+        """Recompute the buckets from the expenses table (all users or one) and return how many were written"""
+        from .expense import Expense
+        delete=db.delete(cls)
+        source=db.select(Expense.user_id,Expense.category_id,
+                         month_bucket(Expense.date,db.session.get_bind().dialect.name).label('month'),
+                         func.sum(Expense.amount),func.count(Expense.id))
+        if user_id is not None:
+            delete=delete.where(cls.user_id==user_id)
+            source=source.where(Expense.user_id==user_id)
+        source=source.group_by(Expense.user_id,Expense.category_id,'month')
+        db.session.execute(delete)
+        res=db.session.execute(db.insert(cls).from_select(['user_id','category_id','month','total','expense_count'],source))
+        db.session.commit()
+        return res.rowcount
+
+    @classmethod
+    def category_totals_select(cls,user_id):
+        """(category_id,total) of everything a user has spent, what the dashboard charts"""
+        return db.select(cls.category_id,func.sum(cls.total).label('total')).where(cls.user_id==user_id).group_by(cls.category_id)
+
+    @classmethod
+    def range_totals_selects(cls,user_id,start_date,end_date,category_id=None):
+        """The (category name,sum) statements range_totals adds up, whole months come from the rollup
+        and only the partial months at the edges touch the expenses table"""
+        from .expense import Expense
+        from .category import Category
+        end_excl=end_date+timedelta(days=1)
+        first_full=month_start(start_date)
+        if first_full<start_date:
+            first_full+=relativedelta(months=1)
+        last_full=month_start(end_excl)
+        if first_full>=last_full:
+            edges=[(start_date,end_excl)]
+        else:
+            edges=[(start_date,first_full),(last_full,end_excl)]
+
+        selects=[]
+        if first_full<last_full:
+            stmt=db.select(Category.name,func.sum(cls.total)).join(cls,cls.category_id==Category.id).where(
+                cls.user_id==user_id,cls.month>=first_full,cls.month<last_full)
+            if category_id is not None:
+                stmt=stmt.where(cls.category_id==category_id)
+            selects.append(stmt.group_by(Category.name))
+        for lower,upper in edges:
+            if lower>=upper:
+                continue
+            stmt=db.select(Category.name,func.sum(Expense.amount)).join(Expense).where(
+                Expense.user_id==user_id,Expense.date>=datetime.combine(lower,time.min),
+                Expense.date<datetime.combine(upper,time.min))
+            if category_id is not None:
+                stmt=stmt.where(Expense.category_id==category_id)
+            selects.append(stmt.group_by(Category.name))
+        return selects
+
+    @classmethod
+    def range_totals(cls,user_id,start_date,end_date,category_id=None):
+        """Per category totals for the inclusive date range"""
+        totals={}
+        for stmt in cls.range_totals_selects(user_id,start_date,end_date,category_id):
+            for name,amount in db.session.execute(stmt).all():
+                if amount:
+                    totals[name]=totals.get(name,0)+float(amount)
+        return totals
@@ -8,6 +8,8 @@ class User(UserMixin,db.Model):
     username=db.Column(db.String(50),unique=True,nullable=False)
     email=db.Column(db.String(120),unique=True,nullable=False)
     password_hash=db.Column(db.String(512),nullable=False)
+    #bumped whenever the user's expenses or recurring expenses change so derived data (facets,reports) can be cached per version
+    data_version=db.Column(db.Integer,nullable=False,default=0,server_default='0')
     expenses=db.relationship('Expense',backref='user',lazy=True)
 
     #method for updating password.
@@ -17,4 +19,12 @@ class User(UserMixin,db.Model):
     #method to verify if the entered password matches with the stored passoword
     #if entered and stored password are same their hash value are also same return true else false.
     def check_password(self,password):
-        return check_password_hash(self.password_hash,password)
\ No newline at end of file
+        return check_password_hash(self.password_hash,password)
+
+    @classmethod
+    def bump_data_version(cls,user_ids):
+        db.session.execute(db.update(cls).where(cls.id.in_(list(user_ids))).values(data_version=cls.data_version+1))
+
+    @classmethod
+    def get_data_version(cls,user_id):
+        return db.session.query(cls.data_version).filter(cls.id==user_id).scalar() or 0
@@ -1,2 +1,15 @@
 from .gmail_service import GmailService
-from .due_expense_monitor import DueExpenseMonitor
\ No newline at end of file
+from .due_expense_monitor import DueExpenseMonitor
+from .expense_search import ExpenseSearch
+from .expense_import import ExpenseImporter
+from .expense_report import ExpenseReport
+from .due_items import DueItems
+from .report_jobs import ReportJobQueue,ReportJobLimitError
+from .report_cache import ReportCache
+from .sql_metrics import SqlInstrumentation,track_queries
+from .profiler import Profiler,profile_block
+from .category_cache import CategoryCache,category_cache
+from .user_cache import UserCache,user_cache
+from .forecast import CashFlowForecast,forecast
+from .email_dispatcher import EmailDispatcher,TokenBucket
+from .outbox import OutboxWorker
@@ -0,0 +1,97 @@
+import time
+import threading
+from collections import namedtuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+CategoryEntry = namedtuple('CategoryEntry', ['id', 'name'])
+
+
+class CategoryCache:
+    """Process-wide copy of the categories table.
+
+    Categories are a small, nearly static lookup list, so forms, reports and JSON responses read
+    them from memory. Any insert, update or delete of a Category through the ORM drops the copy
+    once its transaction commits (or rolls back), and CATEGORY_CACHE_TTL (seconds, 0 for none)
+    bounds how long writes made by other processes can go unseen.
+    """
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._generation = 0
+        self._loaded_at = 0.0
+        self._listening = False
+
+    def init_app(self, app):
+        self.ttl = app.config['CATEGORY_CACHE_TTL']
+        app.extensions['category_cache'] = self
+        if not self._listening:
+            from ..models import Category
+            for name in ('after_insert', 'after_update', 'after_delete'):
+                event.listen(Category, name, self._on_write)
+            event.listen(Session, 'after_commit', self._on_end)
+            event.listen(Session, 'after_rollback', self._on_end)
+            self._listening = True
+
+    def _on_write(self, mapper, connection, target):
+        # flushed rows aren't visible to other connections until the commit, a copy loaded in between
+        # would keep the old categories, so the session only notes the write here
+        session = object_session(target)
+        if session is None:
+            self.invalidate()
+        else:
+            session.info['category_cache_stale'] = True
+
+    def _on_end(self, session):
+        if session.info.pop('category_cache_stale', False):
+            self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self._generation += 1
+
+    def _load(self):
+        snapshot = self._snapshot
+        if snapshot is not None and (not self.ttl or time.monotonic() - self._loaded_at < self.ttl):
+            return snapshot
+        from ..models import Category
+        from ..extensions import db
+        generation = self._generation
+        rows = db.session.query(Category.id, Category.name).order_by(Category.name).all()
+        entries = tuple(CategoryEntry(category_id, name) for category_id, name in rows)
+        snapshot = {
+            'entries': entries,
+            'by_id': {entry.id: entry.name for entry in entries},
+            'by_name': {entry.name.lower(): entry.id for entry in entries},
+        }
+        with self._lock:
+            # a write that landed while we were reading leaves the copy for the next caller to reload
+            if generation == self._generation:
+                self._snapshot = snapshot
+                self._loaded_at = time.monotonic()
+        return snapshot
+
+    def all(self):
+        """(id, name) entries ordered by name"""
+        return self._load()['entries']
+
+    def choices(self):
+        """Select field choices"""
+        return [(entry.id, entry.name) for entry in self.all()]
+
+    def names(self):
+        """{id: name} for resolving category ids on rows"""
+        return self._load()['by_id']
+
+    def name(self, category_id, default=''):
+        return self._load()['by_id'].get(category_id, default)
+
+    def id_for(self, name):
+        """Case-insensitive name lookup, None when there is no such category"""
+        return self._load()['by_name'].get((name or '').strip().lower())
+
+
+category_cache = CategoryCache()
@@ -3,6 +3,10 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import date, datetime, timedelta
 import logging
 from .gmail_service import GmailService
+from .outbox import OutboxWorker
+from .sql_metrics import track_queries
+from .profiler import profile_block
+from .due_items import DueItems
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -13,6 +17,8 @@ class DueExpenseMonitor:
         self.scheduler = BackgroundScheduler()
         self.gmail_service = GmailService()
         self.app = app
+        self._last_prune = None
+        self.outbox_worker = OutboxWorker(app, self.gmail_service)
         
         if app is not None:
             self.init_app(app)
@@ -20,6 +26,7 @@ class DueExpenseMonitor:
     def init_app(self, app):
         """Initialize with Flask app context"""
         self.app = app
+        self.outbox_worker.app = app
         
         # Ensure scheduler shuts down when app stops
         import atexit
@@ -28,7 +35,8 @@ class DueExpenseMonitor:
     def check_newly_due_expenses(self):
         """Check for expenses that became due since last check"""
         if self.app:
-            with self.app.app_context():
+            with self.app.app_context(), track_queries(self.app, 'job:check_newly_due_expenses'), \
+                    profile_block(self.app, 'job:check_newly_due_expenses'):
                 self._check_due_expenses()
         else:
             self._check_due_expenses()
@@ -37,52 +45,46 @@ class DueExpenseMonitor:
         """Internal method to check due expenses"""
         try:
             # Import here to avoid circular imports
-            from app.models import RecurringExpense, User
+            from app.models import NotificationLedger
             from app.extensions import db
             
             current_date = date.today()
+            now = datetime.utcnow()
+            config = self.app.config if self.app else {}
+            chunk_size = config.get('DUE_SCAN_CHUNK_SIZE', 500)
+            reminder_days = config.get('OVERDUE_REMINDER_DAYS', 3)
             logger.info(f"Checking for due expenses on {current_date}")
             
-            # Find recurring expenses that are due for processing
-            newly_due = RecurringExpense.query.filter(
-                RecurringExpense.is_active == True,
-                RecurringExpense.next_due_date <= current_date,
-                # Either never processed OR last processed before current due date
-                db.or_(
-                    RecurringExpense.last_processed_date.is_(None),
-                    RecurringExpense.last_processed_date < RecurringExpense.next_due_date
-                )
-            ).all()
-            
-            if newly_due:
-                logger.info(f"Found {len(newly_due)} newly due recurring expenses")
-                
-                # Group by user for consolidated emails
-                users_with_due = {}
-                for recurring_expense in newly_due:
-                    if recurring_expense.user_id not in users_with_due:
-                        users_with_due[recurring_expense.user_id] = []
-                    users_with_due[recurring_expense.user_id].append(recurring_expense)
-                
-                # Send notifications to each user
-                for user_id, due_expenses in users_with_due.items():
-                    user = User.query.get(user_id)
-                    if user and self.should_send_notification(user):
-                        self.send_due_notification(user, due_expenses)
-            
-            # Also check for overdue expenses (past due and not processed)
-            overdue = RecurringExpense.query.filter(
-                RecurringExpense.is_active == True,
-                RecurringExpense.next_due_date < current_date,
-                db.or_(
-                    RecurringExpense.last_processed_date.is_(None),
-                    RecurringExpense.last_processed_date < RecurringExpense.next_due_date
-                )
-            ).all()
-            
-            if overdue:
-                logger.info(f"Found {len(overdue)} overdue recurring expenses")
-                self.handle_overdue_expenses(overdue)
+            # One pass over due and overdue expenses (active, next due date <= today and not processed yet),
+            # anti-joined against the notification ledger so each due date is emailed once and an overdue
+            # one again only every reminder_days. A user gets a single email covering both
+            def pending(select):
+                return NotificationLedger.pending(select, current_date, now, reminder_days)
+            
+            # Emails of a chunk are rendered here and queued in the outbox in the same transaction as their
+            # ledger entries, the outbox worker sends them, so this job never waits on Gmail
+            pending_count = 0
+            queued = 0
+            for chunk in DueItems.scan(current_date, chunk_size, refine=pending):
+                notified = []
+                for user, due_expenses in chunk:
+                    pending_count += len(due_expenses)
+                    if self.should_send_notification(user):
+                        self.queue_due_notification(user, due_expenses, current_date)
+                        notified.extend(due_expenses)
+                        queued += 1
+                self.mark_notification_sent(notified, current_date, now)
+            if pending_count:
+                logger.info(f"Found {pending_count} due or overdue recurring expenses, queued {queued} notifications")
+            
+            # Entries nobody will look up again (processed, or reminded long ago) are cleared once a day
+            if self._last_prune != current_date:
+                retention = config.get('NOTIFICATION_LEDGER_RETENTION_DAYS', 90)
+                pruned = NotificationLedger.prune(now - timedelta(days=retention))
+                db.session.commit()
+                self._last_prune = current_date
+                if pruned:
+                    logger.info(f"Pruned {pruned} old notification ledger entries")
                 
         except Exception as e:
             logger.error(f"Error checking due expenses: {str(e)}", exc_info=True)
@@ -96,135 +98,58 @@ class DueExpenseMonitor:
         # Uncomment if you have email preferences:
         # return getattr(user, 'email_notifications_enabled', True)
     
-    def send_due_notification(self, user, due_expenses):
-        """Send notification for due recurring expenses"""
-        try:
-            # Check if we already sent notification today for this user
-            if self.already_notified_today(user, due_expenses):
-                logger.info(f"Already notified {user.email} today, skipping")
-                return
-            
-            html_content, text_content = self.gmail_service.create_due_expenses_email(
-                user, due_expenses
-            )
-            
-            # Determine email subject based on overdue vs due today
-            overdue_count = len([exp for exp in due_expenses if exp.next_due_date < date.today()])
-            due_today_count = len([exp for exp in due_expenses if exp.next_due_date == date.today()])
-            
-            if overdue_count > 0:
-                subject = f" {overdue_count} Overdue + {due_today_count} Due Expenses"
-            else:
-                subject = f" {due_today_count} Expense(s) Due Today!"
-            
-            success = self.gmail_service.send_email(
-                user.email,
-                subject,
-                html_content,
-                text_content
-            )
-            
-            if success:
-                logger.info(f"Due notification sent successfully to {user.email}")
-                self.mark_notification_sent(user, due_expenses)
-            else:
-                logger.error(f"Failed to send notification to {user.email}")
-            
-        except Exception as e:
-            logger.error(f"Error sending due notification to {user.email}: {str(e)}")
+    @property
+    def base_url(self):
+        return self.app.config.get('APP_BASE_URL') if self.app else None
     
-    def handle_overdue_expenses(self, overdue_expenses):
-        """Handle overdue expenses separately if needed"""
-        # Group by user
-        users_overdue = {}
-        for expense in overdue_expenses:
-            if expense.user_id not in users_overdue:
-                users_overdue[expense.user_id] = []
-            users_overdue[expense.user_id].append(expense)
+    def build_due_notification(self, user, due_expenses, today=None):
+        """The email ({to, subject, html, text}) for a user's due and overdue recurring expenses"""
+        today = today or date.today()
+        html_content, text_content = self.gmail_service.create_due_expenses_email(
+            user, due_expenses, today, self.base_url
+        )
         
-        for user_id, expenses in users_overdue.items():
-            from app.models import User
-            user = User.query.get(user_id)
-            
-            if user and self.should_send_notification(user):
-                # Check if it's been more than 24 hours since last overdue notification
-                if self.should_send_overdue_reminder(user, expenses):
-                    self.send_overdue_reminder(user, expenses)
-    
-    def send_overdue_reminder(self, user, overdue_expenses):
-        """Send reminder for overdue expenses"""
-        try:
-            html_content, text_content = self.gmail_service.create_due_expenses_email(
-                user, overdue_expenses
-            )
-            
-            days_overdue = max((date.today() - exp.next_due_date).days for exp in overdue_expenses)
-            subject = f" {len(overdue_expenses)} Overdue Expense(s) - {days_overdue} Days Past Due"
-            
-            success = self.gmail_service.send_email(
-                user.email,
-                subject,
-                html_content,
-                text_content
-            )
-            
-            if success:
-                logger.info(f"Overdue reminder sent to {user.email}")
-                self.mark_overdue_notification_sent(user, overdue_expenses)
-            
-        except Exception as e:
-            logger.error(f"Error sending overdue reminder to {user.email}: {str(e)}")
-    
-    def already_notified_today(self, user, due_expenses):
-        """Check if user was already notified today about these expenses"""
-        # Simple approach: check if any expense has a recent notification
-        # You might want to add a last_notification_date field to RecurringExpense model
-        return False  # For now, always send
+        # Determine email subject based on overdue vs due today
+        overdue_count = sum(1 for exp in due_expenses if exp.next_due_date < today)
+        due_today_count = sum(1 for exp in due_expenses if exp.next_due_date == today)
         
-        # If you add last_notification_date field to RecurringExpense:
-        # today = date.today()
-        # return any(
-        #     getattr(exp, 'last_notification_date', None) == today 
-        #     for exp in due_expenses
-        # )
+        if overdue_count > 0 and due_today_count == 0:
+            days_overdue = max((today - exp.next_due_date).days for exp in due_expenses)
+            subject = f" {overdue_count} Overdue Expense(s) - {days_overdue} Days Past Due"
+        elif overdue_count > 0:
+            subject = f" {overdue_count} Overdue + {due_today_count} Due Expenses"
+        else:
+            subject = f" {due_today_count} Expense(s) Due Today!"
+        return {'to': user.email, 'subject': subject, 'html': html_content, 'text': text_content}
     
-    def should_send_overdue_reminder(self, user, expenses):
-        """Check if we should send overdue reminder"""
-        # Send overdue reminders every 3 days to avoid spam
-        return True  # For now, always send overdue reminders
+    def queue_due_notification(self, user, due_expenses, today=None):
+        """Add the notification to the email outbox, it is sent when the caller commits"""
+        from app.models import OutboxMessage
+        message = self.build_due_notification(user, due_expenses, today)
+        return OutboxMessage.enqueue(message['to'], message['subject'], message['html'], message['text'])
     
-    def mark_notification_sent(self, user, due_expenses):
-        """Mark that notification was sent (optional enhancement)"""
-        # If you want to track notifications, you can add a field to your model
-        # and update it here
-        pass
-        
-        # Example if you add last_notification_date to RecurringExpense:
-        # from app.extensions import db
-        # today = date.today()
-        # for expense in due_expenses:
-        #     expense.last_notification_date = today
-        # db.session.commit()
+    def mark_notification_sent(self, due_expenses, today, now=None):
+        """Record queued expenses in the notification ledger and commit them with their emails"""
+        from app.models import NotificationLedger
+        from app.extensions import db
+        try:
+            NotificationLedger.record(due_expenses, today, now)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error queueing notifications: {str(e)}")
     
-    def mark_overdue_notification_sent(self, user, overdue_expenses):
-        """Mark that overdue notification was sent"""
-        # Similar to mark_notification_sent but for overdue tracking
-        pass
+    def drain_outbox(self):
+        """Send queued emails, the in process stand-in for `flask outbox-worker`"""
+        with self.app.app_context(), track_queries(self.app, 'job:drain_outbox'):
+            try:
+                self.outbox_worker.drain()
+            except Exception as e:
+                logger.error(f"Error draining email outbox: {str(e)}", exc_info=True)
     
     def get_user_due_expenses(self, user_id):
         """Get all due expenses for a specific user"""
-        from app.models import RecurringExpense
-        from app.extensions import db
-        
-        return RecurringExpense.query.filter(
-            RecurringExpense.user_id == user_id,
-            RecurringExpense.is_active == True,
-            RecurringExpense.next_due_date <= date.today(),
-            db.or_(
-                RecurringExpense.last_processed_date.is_(None),
-                RecurringExpense.last_processed_date < RecurringExpense.next_due_date
-            )
-        ).all()
+        return DueItems.for_user(user_id)
     
     def start_monitoring(self):
         """Start monitoring for due expenses"""
@@ -259,6 +184,16 @@ class DueExpenseMonitor:
                 replace_existing=True
             )
             
+            # Send queued emails, unless a separate `flask outbox-worker` does
+            if self.app and self.app.config['OUTBOX_IN_PROCESS_WORKER']:
+                self.scheduler.add_job(
+                    self.drain_outbox,
+                    'interval',
+                    seconds=self.app.config['OUTBOX_POLL_SECONDS'],
+                    id='outbox_drain',
+                    replace_existing=True
+                )
+            
             self.scheduler.start()
             logger.info("Due expense monitoring started successfully")
             logger.info("Scheduled jobs:")
@@ -283,6 +218,7 @@ class DueExpenseMonitor:
         """Get status of the monitoring service"""
         return {
             'running': self.scheduler.running,
+            'last_outbox_batch': self.outbox_worker.last_run,
             'jobs': [
                 {
                     'id': job.id,
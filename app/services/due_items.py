@@ -0,0 +1,162 @@
+from itertools import groupby
+from operator import attrgetter
+from types import SimpleNamespace
+from datetime import date, datetime, time
+from sqlalchemy.orm import joinedload
+from ..extensions import db
+from ..utils import keyset_page
+
+
+class DueItems:
+    """Recurring expenses waiting to be processed.
+
+    Every query filters (user_id, is_active, next_due_date) so it is a range scan of
+    ix_recurring_expenses_user_active_due, and the cost follows the user's due rows rather
+    than the size of the recurring_expenses table.
+    """
+
+    @staticmethod
+    def criteria(today=None):
+        """Filter clauses for an active expense whose current due date has not been processed yet"""
+        from ..models import RecurringExpense
+        return (
+            RecurringExpense.is_active == True,
+            RecurringExpense.next_due_date <= (today or date.today()),
+            db.or_(
+                RecurringExpense.last_processed_date.is_(None),
+                RecurringExpense.last_processed_date < RecurringExpense.next_due_date
+            ),
+        )
+
+    @classmethod
+    def query(cls, user_id, today=None):
+        from ..models import RecurringExpense
+        return RecurringExpense.query.filter(RecurringExpense.user_id == user_id, *cls.criteria(today))
+
+    @classmethod
+    def for_user(cls, user_id, today=None):
+        """All of a user's due expenses, oldest due date first"""
+        from ..models import RecurringExpense
+        return cls.query(user_id, today).order_by(RecurringExpense.next_due_date, RecurringExpense.id).all()
+
+    @classmethod
+    def count(cls, user_id, today=None):
+        return cls.query(user_id, today).count()
+
+    @classmethod
+    def scan(cls, today=None, chunk_size=500, refine=None):
+        """Yield chunks of [(user, due expenses)] for every user with due items, in user_id order.
+
+        Users are taken chunk_size at a time by keyset on user_id: one query picks the next chunk of
+        user ids, one more streams their due rows with yield_per and the owning User and Category
+        joined in. refine(select) can narrow both queries (e.g. the notification ledger anti-join).
+        A chunk is fully read before it is yielded, so the caller may commit while handling it, and
+        each chunk runs in its own session (removed when the next one is asked for). Memory stays
+        flat and the query count follows the number of chunks, not of users or rows.
+        """
+        today = today or date.today()
+        last_user_id = None
+        while True:
+            user_ids = db.session.scalars(cls.scan_users_select(today, chunk_size, last_user_id, refine)).all()
+            if not user_ids:
+                return
+            try:
+                rows = db.session.scalars(cls.scan_rows_select(user_ids[0], user_ids[-1], today, refine)
+                                          .execution_options(yield_per=chunk_size))
+                chunk = []
+                for _, expenses in groupby(rows, key=attrgetter('user_id')):
+                    expenses = list(expenses)
+                    chunk.append((expenses[0].user, expenses))
+                yield chunk
+            finally:
+                db.session.remove()
+            if len(user_ids) < chunk_size:
+                return
+            last_user_id = user_ids[-1]
+
+    @classmethod
+    def scan_users_select(cls, today=None, chunk_size=500, after=None, refine=None):
+        """The next chunk_size user ids above `after` that have due items"""
+        from ..models import RecurringExpense
+        select = (refine or (lambda select: select))(db.select(RecurringExpense.user_id).where(*cls.criteria(today)))
+        if after is not None:
+            select = select.where(RecurringExpense.user_id > after)
+        return select.group_by(RecurringExpense.user_id).order_by(RecurringExpense.user_id).limit(chunk_size)
+
+    @classmethod
+    def scan_rows_select(cls, first_user_id, last_user_id, today=None, refine=None):
+        """Due rows of a chunk of users with their User and Category, grouped by user"""
+        from ..models import RecurringExpense
+        select = db.select(RecurringExpense).options(
+            joinedload(RecurringExpense.user, innerjoin=True),
+            joinedload(RecurringExpense.category, innerjoin=True),
+        ).where(RecurringExpense.user_id.between(first_user_id, last_user_id), *cls.criteria(today))
+        return (refine or (lambda select: select))(select).order_by(
+            RecurringExpense.user_id, RecurringExpense.next_due_date, RecurringExpense.id)
+
+    @classmethod
+    def page(cls, user_id, cursor=None, per_page=None, today=None):
+        """(rows, next_cursor) for one page of due expenses, oldest due date first"""
+        from ..models import RecurringExpense
+        return keyset_page(cls.query(user_id, today), RecurringExpense.next_due_date, RecurringExpense.id,
+                           cursor=cursor, per_page=per_page, ascending=True)
+
+    @classmethod
+    def process(cls, user_id, ids, today=None, catch_up=False):
+        """Generate the expenses owed by the selected due items and advance their due dates.
+
+        The rows are read with one locking IN query (FOR UPDATE on Postgres, so two requests
+        can't process the same item twice), expenses are added with one bulk INSERT and the due
+        dates with one bulk UPDATE, all in a single transaction. Normally one occurrence is
+        processed per item, with catch_up every missed occurrence up to today (and end_date) is,
+        and items whose schedule ran past end_date are deactivated. Ids that aren't due are
+        skipped. Returns a summary dict per processed item.
+        """
+        from ..models import Expense, RecurringExpense, MonthlyCategoryTotal
+        if not ids:
+            return []
+        today = today or date.today()
+        rows = cls.query(user_id, today).filter(RecurringExpense.id.in_(ids)).order_by(
+            RecurringExpense.next_due_date, RecurringExpense.id).with_for_update().all()
+        if not rows:
+            return []
+
+        expenses, updates, processed = [], [], []
+        for row in rows:
+            occurrences = row.missed_occurrences(today) if catch_up else [row.next_due_date]
+            next_due = row.occurrence_after(len(occurrences)) if catch_up else row.calculate_next_due_date()
+            update = {'id': row.id, 'next_due_date': next_due,
+                      'last_processed_date': occurrences[-1] if occurrences else row.last_processed_date,
+                      'total_processed': (row.total_processed or 0) + len(occurrences)}
+            if catch_up:
+                update['is_active'] = row.end_date is None or next_due <= row.end_date
+            updates.append(update)
+            if not occurrences:
+                continue
+            for when in occurrences:
+                expenses.append({
+                    'user_id': row.user_id,
+                    'category_id': row.category_id,
+                    'amount': float(row.amount),
+                    'description': f"{row.title}(Recurring)",
+                    'date': datetime.combine(when, time.min),
+                    'recurring_expense_id': row.id,
+                })
+            processed.append({
+                'title': row.title,
+                'amount': float(row.amount) * len(occurrences),
+                'occurrences': len(occurrences),
+                'due_date': occurrences[0].strftime('%Y-%m-%d') if len(occurrences) == 1 else
+                            f"{occurrences[0]:%Y-%m-%d} to {occurrences[-1]:%Y-%m-%d}",
+                'next_due': next_due.strftime('%Y-%m-%d'),
+            })
+        try:
+            if expenses:
+                db.session.execute(db.insert(Expense), expenses)
+                MonthlyCategoryTotal.record_many([SimpleNamespace(**expense) for expense in expenses])
+            db.session.execute(db.update(RecurringExpense), updates)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return processed
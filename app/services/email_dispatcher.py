@@ -0,0 +1,113 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# throttled or a server side hiccup, worth sending again after a pause. 0 means Gmail wasn't reached
+RETRYABLE_STATUSES = {0, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Blocking token bucket: rate tokens are added per second up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class EmailDispatcher:
+    """Sends many emails through a bounded thread pool without blocking on any single slow call.
+
+    Messages ({to,subject,html,text} dicts) are grouped into Gmail batch HTTP requests of batch_size,
+    each worker sends one batch at a time. Every message takes send_units from a token bucket refilled
+    at units_per_second, which by default matches Gmail's per-user quota (250 units/s, 100 per
+    messages.send). Messages answered with 429/5xx are sent again with exponential backoff and jitter,
+    up to max_retries times. dispatch() returns per message success and the run's throughput.
+    """
+
+    def __init__(self, gmail_service, workers=4, batch_size=10, units_per_second=250, send_units=100,
+                 max_retries=5, backoff_base=1.0, backoff_max=60.0):
+        self.gmail_service = gmail_service
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.send_units = send_units
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(units_per_second, max(units_per_second, send_units))
+        self.last_run = None
+
+    @classmethod
+    def from_config(cls, gmail_service, config):
+        return cls(gmail_service,
+                   workers=config.get('EMAIL_WORKERS', 4),
+                   batch_size=config.get('EMAIL_BATCH_SIZE', 10),
+                   units_per_second=config.get('EMAIL_QUOTA_UNITS_PER_SECOND', 250),
+                   send_units=config.get('EMAIL_SEND_UNITS', 100),
+                   max_retries=config.get('EMAIL_MAX_RETRIES', 5),
+                   backoff_base=config.get('EMAIL_BACKOFF_BASE', 1.0),
+                   backoff_max=config.get('EMAIL_BACKOFF_MAX', 60.0))
+
+    def backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    def dispatch(self, messages):
+        """Send every message, returns (list of success flags in message order, stats dict)"""
+        started = time.monotonic()
+        results = [False] * len(messages)
+        stats = {'messages': len(messages), 'sent': 0, 'failed': 0, 'retries': 0, 'requests': 0}
+        lock = threading.Lock()
+        batches = [list(range(i, min(i + self.batch_size, len(messages)))) for i in range(0, len(messages), self.batch_size)]
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(batches)), thread_name_prefix='email') as pool:
+                for future in [pool.submit(self._send_batch, messages, batch, results, stats, lock) for batch in batches]:
+                    future.result()
+        stats['elapsed'] = round(time.monotonic() - started, 3)
+        stats['per_second'] = round(stats['sent'] / stats['elapsed'], 2) if stats['elapsed'] else None
+        self.last_run = stats
+        return results, stats
+
+    def _send_batch(self, messages, pending, results, stats, lock):
+        attempt = 0
+        while pending:
+            for _ in pending:
+                self.bucket.acquire(self.send_units)
+            statuses = self.gmail_service.send_messages([messages[i] for i in pending])
+            retry = []
+            for i, status in zip(pending, statuses):
+                if status is None:
+                    results[i] = True
+                elif status in RETRYABLE_STATUSES and attempt < self.max_retries:
+                    retry.append(i)
+                else:
+                    logger.error(f"Giving up on email to {messages[i]['to']} (status {status})")
+            sent = sum(1 for i in pending if results[i])
+            with lock:
+                stats['requests'] += 1
+                stats['sent'] += sent
+                stats['failed'] += len(pending) - sent - len(retry)
+                stats['retries'] += len(retry)
+            if retry:
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+            pending = retry
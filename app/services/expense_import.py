@@ -0,0 +1,310 @@
+import re
+import csv
+import hashlib
+import logging
+from io import StringIO
+from itertools import chain
+from types import SimpleNamespace
+from datetime import datetime
+from ..extensions import db
+
+logger = logging.getLogger(__name__)
+
+# header names we recognise when the user does not map the columns explicitly
+COLUMN_CANDIDATES = {
+    'date': ['date', 'transaction date', 'txn date', 'posted date', 'posting date', 'value date'],
+    'amount': ['amount', 'debit', 'withdrawal', 'withdrawal amount', 'debit amount', 'value'],
+    'description': ['description', 'narration', 'details', 'memo', 'payee', 'name', 'particulars'],
+    'category': ['category'],
+}
+# columns that only hold money going out, their amounts are positive. Any other amount column is
+# signed the bank way (and the OFX way): debits negative, credits positive
+DEBIT_COLUMNS = {'debit', 'withdrawal', 'withdrawal amount', 'debit amount'}
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%m/%d/%Y', '%Y/%m/%d', '%d %b %Y']
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+class ImportRowError(ValueError):
+    """A statement line that can't be turned into an expense"""
+
+
+class ExpenseImporter:
+    """Stream a CSV or OFX bank statement into the expenses table in batches.
+
+    Lines are parsed and validated one at a time, valid rows are written every
+    `batch_size` lines with a single bulk INSERT (COPY into a staging table on
+    Postgres) and duplicates are dropped by the (user_id, import_hash) unique index.
+    Only debits become expenses, credits and refunds are counted as skipped. debit_sign says
+    whether debits are the 'negative' or 'positive' CSV amounts, by default it follows the column.
+    """
+
+    def __init__(self, user_id, default_category_id=None, date_format=None, columns=None, debit_sign=None,
+                 batch_size=5000, max_errors=100, on_progress=None):
+        from .category_cache import category_cache
+        self.user_id = user_id
+        self.default_category_id = default_category_id
+        self.date_format = date_format
+        self.columns = columns or {}
+        if debit_sign not in (None, 'negative', 'positive'):
+            raise ValueError(f"debit_sign must be 'negative' or 'positive', not {debit_sign!r}")
+        self.debit_sign = debit_sign
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.on_progress = on_progress
+        self.categories = {c.name.lower(): c.id for c in category_cache.all()}
+        if self.default_category_id is None:
+            self.default_category_id = self.categories.get('other')
+        self._occurrences = {}
+        self._date_formats = [date_format] if date_format else list(DATE_FORMATS)
+        self.report = {'processed': 0, 'inserted': 0, 'duplicates': 0, 'skipped': 0, 'failed': 0,
+                       'batches': 0, 'errors': []}
+
+    def run(self, lines, filename='', file_format='auto'):
+        """Import from an iterable of text lines and return the report"""
+        lines = iter(lines)
+        first = next(lines, '')
+        lines = chain([first], lines)
+        if file_format == 'auto':
+            is_ofx = filename.lower().endswith(('.ofx', '.qfx')) or 'OFX' in first.upper()
+            file_format = 'ofx' if is_ofx else 'csv'
+        records = self._ofx_records(lines) if file_format == 'ofx' else self._csv_records(lines)
+
+        batch = []
+        try:
+            for line_no, record in records:
+                self.report['processed'] += 1
+                if record is None:
+                    self.report['skipped'] += 1
+                    continue
+                try:
+                    batch.append(self._validate(record))
+                except ImportRowError as e:
+                    self._error(line_no, str(e))
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    batch = []
+            if batch:
+                self._flush(batch)
+        except ImportRowError as e:
+            # problems with the file itself (unknown columns) rather than a single line
+            self._error(0, str(e))
+        except Exception:
+            db.session.rollback()
+            raise
+        logger.info(f"Import for user {self.user_id} finished: {self.summary()}")
+        return self.report
+
+    def summary(self):
+        r = self.report
+        return (f"{r['processed']} lines, {r['inserted']} imported, {r['duplicates']} duplicates, "
+                f"{r['skipped']} skipped, {r['failed']} failed")
+
+    def _error(self, line_no, message):
+        self.report['failed'] += 1
+        if len(self.report['errors']) < self.max_errors:
+            self.report['errors'].append({'line': line_no, 'error': message})
+
+    # parsing
+
+    def _resolve_columns(self, fieldnames):
+        headers = {name.strip().lower(): name for name in fieldnames or [] if name}
+        resolved = {}
+        for field, candidates in COLUMN_CANDIDATES.items():
+            wanted = self.columns.get(field)
+            if wanted:
+                if wanted.strip().lower() not in headers:
+                    raise ImportRowError(f"Column '{wanted}' not found in the file")
+                resolved[field] = headers[wanted.strip().lower()]
+                continue
+            resolved[field] = next((headers[c] for c in candidates if c in headers), None)
+        for field in ('date', 'amount'):
+            if not resolved[field]:
+                raise ImportRowError(f"Could not find a {field} column, map it explicitly")
+        return resolved
+
+    def _csv_records(self, lines):
+        reader = csv.DictReader(lines)
+        columns = self._resolve_columns(reader.fieldnames)
+        debit_column = columns['amount'].strip().lower() in DEBIT_COLUMNS
+        debit_sign = self.debit_sign or ('positive' if debit_column else 'negative')
+        for line_no, row in enumerate(reader, start=2):
+            amount = row.get(columns['amount'])
+            negative = self._is_negative(amount)
+            # an empty debit cell is a credit line of a statement with separate debit/credit columns
+            credit = not (amount or '').strip() if debit_column else False
+            if credit or (negative is not None and negative != (debit_sign == 'negative')):
+                yield line_no, None
+                continue
+            yield line_no, {
+                'date': row.get(columns['date']),
+                'amount': amount,
+                'description': row.get(columns['description']) if columns['description'] else None,
+                'category': row.get(columns['category']) if columns['category'] else None,
+                'reference': None,
+            }
+
+    def _ofx_records(self, lines):
+        # works for both SGML (unclosed leaf tags) and XML OFX, one transaction per STMTTRN block
+        block = None
+        for line_no, line in enumerate(lines, start=1):
+            for closing, tag, value in OFX_TAG.findall(line):
+                tag = tag.upper()
+                if tag == 'STMTTRN':
+                    if not closing:
+                        block = {'line': line_no}
+                    elif block is not None:
+                        yield block['line'], self._ofx_record(block)
+                        block = None
+                elif block is not None and not closing:
+                    block[tag] = value.strip()
+
+    @staticmethod
+    def _is_negative(value):
+        # '-12.50', '12.50-' and the accounting style '(12.50)', None when there is no number to judge
+        # so the line is reported by _parse_amount
+        value = re.sub(r'[^\d.\-()]', '', value or '')
+        if not re.search(r'\d', value):
+            return None
+        return value.startswith(('-', '(')) or value.endswith('-')
+
+    @staticmethod
+    def _ofx_record(block):
+        amount = block.get('TRNAMT', '')
+        # credits (money in) are not expenses
+        if amount and not amount.strip().startswith('-'):
+            return None
+        posted = block.get('DTPOSTED', '')
+        try:
+            posted = datetime.strptime(posted[:8], '%Y%m%d')
+        except ValueError:
+            pass
+        return {
+            'date': posted,
+            'amount': amount,
+            'description': block.get('NAME') or block.get('MEMO'),
+            'category': None,
+            'reference': block.get('FITID'),
+        }
+
+    # validation
+
+    def _parse_date(self, value):
+        if isinstance(value, datetime):
+            return value
+        value = (value or '').strip()
+        if not self.date_format and len(value) == 10 and value[4:5] == '-':
+            try:
+                return datetime.fromisoformat(value)
+            except ValueError:
+                pass
+        for i, fmt in enumerate(self._date_formats):
+            try:
+                parsed = datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+            if i:
+                # a statement uses one format throughout, try the one that worked first next time
+                self._date_formats.insert(0, self._date_formats.pop(i))
+            return parsed
+        raise ImportRowError(f"Invalid date '{value}'")
+
+    @staticmethod
+    def _parse_amount(value):
+        # the sign only tells debits from credits, which the readers have already done
+        cleaned = re.sub(r'[^\d.]', '', value or '')
+        try:
+            amount = float(cleaned)
+        except ValueError:
+            raise ImportRowError(f"Invalid amount '{value}'")
+        if amount < 0.01:
+            raise ImportRowError("Amount must be at least 0.01")
+        return round(amount, 2)
+
+    def _validate(self, record):
+        when = self._parse_date(record['date'])
+        amount = self._parse_amount(record['amount'])
+        description = (record['description'] or '').strip()[:200] or None
+        category_id = self.default_category_id
+        if record['category']:
+            category_id = self.categories.get(record['category'].strip().lower(), self.default_category_id)
+        if category_id is None:
+            raise ImportRowError(f"Unknown category '{record['category'] or ''}' and no default category")
+
+        # bank ids are stable across exports, otherwise identical lines are told apart by occurrence
+        # so re-importing a file skips everything while two equal purchases in one file both count
+        if record['reference']:
+            raw = f"ref|{record['reference']}"
+        else:
+            base = f"{when:%Y-%m-%d}|{amount:.2f}|{(description or '').lower()}"
+            occurrence = self._occurrences.get(base, 0)
+            self._occurrences[base] = occurrence + 1
+            raw = f"{base}|{occurrence}"
+        return {
+            'amount': amount,
+            'description': description,
+            'date': when,
+            'user_id': self.user_id,
+            'category_id': category_id,
+            'import_hash': hashlib.sha1(raw.encode('utf-8')).hexdigest(),
+        }
+
+    # writing
+
+    def _flush(self, batch):
+        from ..models import MonthlyCategoryTotal
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            inserted = self._copy_batch(batch)
+        else:
+            inserted = self._insert_batch(batch, dialect)
+        MonthlyCategoryTotal.record_many(inserted)
+        db.session.commit()
+
+        self.report['batches'] += 1
+        self.report['inserted'] += len(inserted)
+        self.report['duplicates'] += len(batch) - len(inserted)
+        if self.on_progress:
+            self.on_progress(self.report)
+
+    def _insert_batch(self, batch, dialect):
+        from ..models import Expense
+        table = Expense.__table__
+        returning = (table.c.user_id, table.c.category_id, table.c.date, table.c.amount)
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(table).on_conflict_do_nothing(index_elements=['user_id', 'import_hash'])
+            return db.session.execute(stmt.returning(*returning), batch).all()
+        # no upsert support: drop known hashes with one indexed IN query for the whole batch
+        existing = {h for (h,) in db.session.query(Expense.import_hash).filter(
+            Expense.user_id == self.user_id, Expense.import_hash.in_([r['import_hash'] for r in batch]))}
+        fresh = [r for r in batch if r['import_hash'] not in existing]
+        if fresh:
+            db.session.execute(db.insert(table), fresh)
+        return [SimpleNamespace(**r) for r in fresh]
+
+    def _copy_batch(self, batch):
+        conn = db.session.connection()
+        conn.exec_driver_sql(
+            "CREATE TEMP TABLE IF NOT EXISTS expense_import_stage ("
+            "amount double precision, description varchar(200), date timestamp, "
+            "user_id integer, category_id integer, import_hash varchar(40)) ON COMMIT DELETE ROWS"
+        )
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        for r in batch:
+            writer.writerow([r['amount'], r['description'] or '', r['date'].isoformat(), r['user_id'],
+                             r['category_id'], r['import_hash']])
+        buffer.seek(0)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY expense_import_stage (amount, description, date, user_id, category_id, import_hash) "
+                "FROM STDIN WITH (FORMAT csv)", buffer)
+        finally:
+            cursor.close()
+        return conn.exec_driver_sql(
+            "INSERT INTO expenses (amount, description, date, user_id, category_id, import_hash) "
+            "SELECT amount, description, date, user_id, category_id, import_hash FROM expense_import_stage "
+            "ON CONFLICT (user_id, import_hash) DO NOTHING "
+            "RETURNING user_id, category_id, date, amount"
+        ).all()
@@ -0,0 +1,145 @@
+import logging
+from datetime import datetime, time, timedelta
+from sqlalchemy.sql import func
+from ..extensions import db
+from .category_cache import category_cache
+
+logger = logging.getLogger(__name__)
+
+SUBTOTAL_PERIODS = ('day', 'week', 'month')
+
+
+def period_bucket(column, dialect, period):
+    """SQL expression truncating a datetime column to the first day of its day, week (Monday) or month"""
+    from ..models.rollup import month_bucket
+    if period == 'month':
+        return month_bucket(column, dialect)
+    if dialect == 'sqlite':
+        if period == 'week':
+            return func.date(column, 'weekday 0', '-6 days')
+        return func.date(column)
+    if period == 'week':
+        return func.date_trunc('week', column).cast(db.Date)
+    return func.cast(column, db.Date)
+
+
+class ExpenseReport:
+    """Report data for the preview page, the PDF export and background report jobs.
+
+    Totals come from SQL aggregates (category sums through the monthly rollup), and line items
+    are plain rows streamed into the template, so the cost in queries doesn't grow with the
+    number of expenses in the range.
+    """
+
+    template = 'main/expense_report.html'
+
+    def __init__(self, user_id, start, end, category_id=None, subtotals=None):
+        self.user_id = user_id
+        self.start = start
+        self.end = end
+        self.category_id = category_id
+        self.subtotal_period = subtotals if subtotals in SUBTOTAL_PERIODS else None
+
+    @classmethod
+    def from_args(cls, user_id, args):
+        """Build from request args: start_date/end_date (defaults to this month so far), category, subtotals.
+        A missing or malformed date falls back to its default"""
+        today = datetime.now().date()
+        return cls(user_id,
+                   cls.parse_date(args.get('start_date'), today.replace(day=1)),
+                   cls.parse_date(args.get('end_date'), today),
+                   cls.category_id_for(args.get('category', 'all')),
+                   args.get('subtotals'))
+
+    @staticmethod
+    def parse_date(value, default):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date() if value else default
+        except ValueError:
+            return default
+
+    @staticmethod
+    def category_id_for(category):
+        """Category ids from the dashboard form, 'all' or anything unknown means no filter"""
+        if not category or category == 'all':
+            return None
+        if category.isdigit():
+            return int(category)
+        return category_cache.id_for(category)
+
+    @property
+    def start_date(self):
+        return self.start.strftime('%Y-%m-%d')
+
+    @property
+    def end_date(self):
+        return self.end.strftime('%Y-%m-%d')
+
+    @property
+    def filename(self):
+        return f"expense_report_{self.start_date}_{self.end_date}.pdf"
+
+    @property
+    def args(self):
+        """Query args that rebuild this report, for links to the other report routes"""
+        args = {'start_date': self.start_date, 'end_date': self.end_date, 'category': self.category_id or 'all'}
+        if self.subtotal_period:
+            args['subtotals'] = self.subtotal_period
+        return args
+
+    def _filter(self, stmt):
+        from ..models import Expense
+        # end date is inclusive of the whole day
+        stmt = stmt.where(Expense.user_id == self.user_id,
+                          Expense.date >= datetime.combine(self.start, time.min),
+                          Expense.date < datetime.combine(self.end + timedelta(days=1), time.min))
+        if self.category_id is not None:
+            stmt = stmt.where(Expense.category_id == self.category_id)
+        return stmt
+
+    def transaction_count(self):
+        from ..models import Expense
+        return db.session.execute(self._filter(db.select(func.count(Expense.id)))).scalar()
+
+    def category_totals(self):
+        from ..models import MonthlyCategoryTotal
+        return MonthlyCategoryTotal.range_totals(self.user_id, self.start, self.end, self.category_id)
+
+    def subtotals(self):
+        """[(period start, total, count)] newest first, or [] when no subtotal period was asked for"""
+        from ..models import Expense
+        if not self.subtotal_period:
+            return []
+        bucket = period_bucket(Expense.date, db.session.get_bind().dialect.name, self.subtotal_period).label('period')
+        stmt = self._filter(db.select(bucket, func.sum(Expense.amount), func.count(Expense.id)))
+        rows = db.session.execute(stmt.group_by(bucket).order_by(bucket.desc())).all()
+        # sqlite hands back the bucket as 'YYYY-MM-DD' text
+        return [(datetime.strptime(period, '%Y-%m-%d').date() if isinstance(period, str) else period, float(total), count)
+                for period, total, count in rows]
+
+    def line_items_select(self):
+        from ..models import Expense
+        stmt = self._filter(db.select(Expense.id, Expense.date, Expense.description, Expense.amount,
+                                      Expense.category_id))
+        return stmt.order_by(Expense.date.desc(), Expense.id.desc())
+
+    def line_items(self):
+        """Expense rows fetched in batches as the template iterates, category names come from category_names"""
+        return db.session.execute(self.line_items_select().execution_options(yield_per=1000))
+
+    def context(self):
+        """Keyword arguments for rendering the report template"""
+        category_totals = self.category_totals()
+        return {
+            'expenses': self.line_items(),
+            'category_names': category_cache.names(),
+            'transaction_count': self.transaction_count(),
+            'category_totals': category_totals,
+            'total_amount': sum(category_totals.values()),
+            'subtotal_period': self.subtotal_period,
+            'subtotals': self.subtotals(),
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+            'report_args': self.args,
+            'generated_date': datetime.now(),
+        }
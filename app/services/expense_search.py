@@ -0,0 +1,199 @@
+import re
+import logging
+import threading
+from datetime import datetime, timedelta
+from cachetools import TTLCache
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.sql import func
+from ..extensions import db
+
+logger = logging.getLogger(__name__)
+
+#backends are created by the full text search migrations:
+#  fts5     - sqlite virtual table expenses_fts over the description and an owner token ('u' || user_id),
+#             kept in sync by triggers
+#  tsvector - postgres generated column expenses.search_vector with a GIN index
+FTS5 = 'fts5'
+TSVECTOR = 'tsvector'
+
+
+class ExpenseSearch:
+    """Keyword search over Expense.description using the database's text index when one exists"""
+
+    def __init__(self, facet_cache_size=1024, facet_cache_ttl=3600):
+        self._backends = {}
+        # facet counts keyed by (user, data version, filters), a new expense bumps the version
+        # so stale entries are never read and just age out. Entries hold category ids, the names
+        # are filled in on every read so a renamed category shows up at once
+        self._facet_cache = TTLCache(maxsize=facet_cache_size, ttl=facet_cache_ttl)
+        self._facet_lock = threading.Lock()
+
+    def backend(self):
+        """Detect (once per engine) which text index is installed, None means fall back to ILIKE"""
+        if current_app.config.get('EXPENSE_SEARCH_BACKEND', 'auto') == 'ilike':
+            return None
+        engine = db.engine
+        key = engine.url.render_as_string()
+        if key not in self._backends:
+            self._backends[key] = self._detect(engine)
+            logger.info(f"Expense search backend: {self._backends[key] or 'ilike'}")
+        return self._backends[key]
+
+    def _detect(self, engine):
+        try:
+            inspector = inspect(engine)
+            if engine.dialect.name == 'sqlite':
+                if 'expenses_fts' not in inspector.get_table_names():
+                    return None
+                if not any(c['name'] == 'owner' for c in inspector.get_columns('expenses_fts')):
+                    logger.warning("expenses_fts has no owner column, run `flask db upgrade`. Using ILIKE until then")
+                    return None
+                return FTS5
+            if engine.dialect.name == 'postgresql':
+                columns = inspector.get_columns('expenses')
+                return TSVECTOR if any(c['name'] == 'search_vector' for c in columns) else None
+        except Exception as e:
+            logger.error(f"Error detecting search backend: {str(e)}")
+        return None
+
+    @staticmethod
+    def terms(keyword):
+        return re.findall(r'\w+', keyword.lower())
+
+    def _plan(self, keyword):
+        """(backend, terms) apply() uses for a keyword, backend None means ILIKE on the raw keyword"""
+        terms = self.terms(keyword)
+        return (self.backend() if terms else None), terms
+
+    def match_key(self, keyword):
+        """What the rows matched by apply(keyword) depend on, for cache keys. Text index searches only
+        see the word terms, the ILIKE fallback sees the whole keyword (punctuation included)"""
+        if not keyword:
+            return None
+        backend, terms = self._plan(keyword)
+        return (backend, tuple(terms)) if backend else ('ilike', keyword)
+
+    def apply(self, query, keyword, user_id):
+        """Restrict a user's Expense query to rows matching every keyword term as a prefix.
+        Returns (query, score) where score is a relevance expression (higher is better)
+        or None when the ILIKE fallback was used"""
+        from ..models import Expense
+        backend, terms = self._plan(keyword)
+        if backend == FTS5:
+            # each term is quoted so FTS5 operators typed by the user are matched literally. The owner
+            # token limits the match to this user's rows inside the index, so the cost follows the user's
+            # matches rather than the term's frequency across every user (owner is weighted 0 in bm25)
+            match = 'owner : "u{}" AND description : ({})'.format(
+                int(user_id), ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms))
+            hits = db.text(
+                "SELECT rowid AS expense_id, -bm25(expenses_fts, 1.0, 0.0) AS score "
+                "FROM expenses_fts WHERE expenses_fts MATCH :match"
+            ).bindparams(match=match).columns(expense_id=db.Integer, score=db.Float).subquery('fts_hits')
+            return query.join(hits, hits.c.expense_id == Expense.id), hits.c.score
+        if backend == TSVECTOR:
+            tsquery = func.to_tsquery('simple', ' & '.join(f'{term}:*' for term in terms))
+            vector = db.literal_column('expenses.search_vector')
+            return query.filter(vector.op('@@')(tsquery)), func.ts_rank(vector, tsquery)
+        return query.filter(Expense.description.ilike(f'%{keyword}%')), None
+
+    @staticmethod
+    def parse_filters(args):
+        """Read the optional search filters from request args, unparsable values are ignored"""
+        def parse_date(name):
+            try:
+                return datetime.strptime(args.get(name, ''), '%Y-%m-%d').date()
+            except ValueError:
+                return None
+
+        def parse_amount(name):
+            try:
+                return float(args[name]) if args.get(name) else None
+            except ValueError:
+                return None
+
+        category_ids = sorted({int(c) for c in args.getlist('category') if c.isdigit()})
+        recurring = {'yes': True, 'true': True, '1': True, 'no': False, 'false': False, '0': False}.get(
+            args.get('recurring', '').lower())
+        return {
+            'start_date': parse_date('start_date'),
+            'end_date': parse_date('end_date'),
+            'min_amount': parse_amount('min_amount'),
+            'max_amount': parse_amount('max_amount'),
+            'category_ids': tuple(category_ids),
+            'recurring': recurring,
+        }
+
+    def apply_filters(self, query, filters):
+        from ..models import Expense
+        if filters['start_date']:
+            query = query.filter(Expense.date >= filters['start_date'])
+        if filters['end_date']:
+            query = query.filter(Expense.date < filters['end_date'] + timedelta(days=1))
+        if filters['min_amount'] is not None:
+            query = query.filter(Expense.amount >= filters['min_amount'])
+        if filters['max_amount'] is not None:
+            query = query.filter(Expense.amount <= filters['max_amount'])
+        if filters['category_ids']:
+            query = query.filter(Expense.category_id.in_(filters['category_ids']))
+        if filters['recurring'] is True:
+            query = query.filter(Expense.recurring_expense_id.isnot(None))
+        elif filters['recurring'] is False:
+            query = query.filter(Expense.recurring_expense_id.is_(None))
+        return query
+
+    def rows_select(self, user_id, filters):
+        """Plain column rows of a user's expenses matching the filters, newest first (the exports)"""
+        from ..models import Expense
+        stmt = db.select(Expense.id, Expense.date, Expense.amount, Expense.description, Expense.category_id,
+                         Expense.recurring_expense_id).where(Expense.user_id == user_id)
+        return self.apply_filters(stmt, filters).order_by(Expense.date.desc(), Expense.id.desc())
+
+    @staticmethod
+    def facet_query(query):
+        """(category_id, month, count, sum) groups of a filtered Expense query"""
+        from ..models import Expense
+        from ..models.rollup import month_bucket
+        month = month_bucket(Expense.date, db.engine.dialect.name).label('month')
+        return query.with_entities(
+            Expense.category_id, month, func.count(Expense.id), func.sum(Expense.amount)
+        ).group_by(Expense.category_id, month)
+
+    def facets(self, query, user_id, keyword, filters):
+        """Per category and per month counts/totals of a filtered Expense query from one grouped
+        query, cached until the user's data version changes"""
+        from ..models import User
+        key = (user_id, User.get_data_version(user_id), self.match_key(keyword), tuple(sorted(filters.items())))
+        with self._facet_lock:
+            cached = self._facet_cache.get(key)
+        if cached is not None:
+            return self._named(cached)
+
+        rows = self.facet_query(query).all()
+
+        categories, months = {}, {}
+        for category_id, month_value, count, total in rows:
+            bucket = categories.setdefault(category_id, {'id': category_id, 'count': 0, 'total': 0.0})
+            bucket['count'] += count
+            bucket['total'] += float(total or 0)
+            label = str(month_value)[:7]
+            bucket = months.setdefault(label, {'month': label, 'count': 0, 'total': 0.0})
+            bucket['count'] += count
+            bucket['total'] += float(total or 0)
+        res = {
+            'categories': sorted(categories.values(), key=lambda c: c['count'], reverse=True),
+            'months': sorted(months.values(), key=lambda m: m['month'], reverse=True),
+        }
+        with self._facet_lock:
+            self._facet_cache[key] = res
+        return self._named(res)
+
+    @staticmethod
+    def _named(facets):
+        from .category_cache import category_cache
+        names = category_cache.names()
+        return {
+            'categories': [{'id': c['id'], 'name': names.get(c['id'], ''), 'count': c['count'], 'total': c['total']}
+                           for c in facets['categories']],
+            'months': [dict(m) for m in facets['months']],
+        }
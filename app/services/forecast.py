@@ -0,0 +1,142 @@
+import threading
+from datetime import date, timedelta
+import numpy as np
+from cachetools import TTLCache
+from flask import current_app
+from sqlalchemy import event
+from ..extensions import db
+from ..utils.recurrence import DAY_STEPS, MONTH_STEPS, Schedules, day_numbers, expand, month_start
+
+FORECAST_PERIODS = ('day', 'week', 'month')
+
+
+def period_start(days, period):
+    """Bucket day numbers by day, ISO week (Monday) or calendar month"""
+    if period == 'week':
+        # 1970-01-01 was a Thursday
+        return days - (days + 3) % 7
+    if period == 'month':
+        return month_start(days.astype('datetime64[D]').astype('datetime64[M]'))
+    return days
+
+
+class CashFlowForecast:
+    """Projected outflows from a user's active recurring expenses.
+
+    Occurrences of every rule inside the horizon are generated with numpy date arithmetic (the same
+    anchored semantics as RecurringExpense), so the cost follows the number of occurrences rather than
+    a Python loop per rule and day. The stored next_due_date is projected as it is, overdue dates are
+    left to /process-due. Results are cached per (user, data_version, day, horizon, period); any write
+    to a RecurringExpense bumps the owner's data_version, as new expenses already do, so a cached
+    forecast is never read after the recurring set changes.
+    """
+
+    def __init__(self, cache_size=1024, cache_ttl=3600):
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._lock = threading.Lock()
+        self._listening = False
+
+    def init_app(self, app):
+        app.extensions['forecast'] = self
+        if not self._listening:
+            from ..models import RecurringExpense
+            for name in ('after_insert', 'after_update', 'after_delete'):
+                event.listen(RecurringExpense, name, self._on_write)
+            self._listening = True
+
+    @staticmethod
+    def _on_write(mapper, connection, target):
+        from ..models import User
+        users = User.__table__
+        connection.execute(users.update().where(users.c.id == target.user_id).values(data_version=users.c.data_version + 1))
+
+    @staticmethod
+    def horizon(requested=None):
+        """Horizon in days from the request, clamped to FORECAST_MAX_HORIZON"""
+        default = current_app.config['FORECAST_DEFAULT_HORIZON']
+        try:
+            days = int(requested) if requested else default
+        except (TypeError, ValueError):
+            days = default
+        return max(1, min(days, current_app.config['FORECAST_MAX_HORIZON']))
+
+    def forecast(self, user_id, horizon, period='month', today=None):
+        from ..models import User
+        period = period if period in FORECAST_PERIODS else 'month'
+        today = today or date.today()
+        key = (user_id, User.get_data_version(user_id), today, horizon, period)
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        result = self._compute(user_id, today, today + timedelta(days=horizon - 1), period)
+        result['horizon'] = horizon
+        with self._lock:
+            self._cache[key] = result
+        return result
+
+    @staticmethod
+    def occurrences(rows, start, end):
+        """(row index, day number) arrays of every occurrence in [start,end] for rows of
+        (frequency, start_date, end_date, next_due_date)"""
+        if not rows:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        frequency = np.array([row[0] for row in rows])
+        anchors = day_numbers([row[1] for row in rows])
+        last = np.minimum(day_numbers([row[2] or end for row in rows]), day_numbers([end])[0])
+        due = day_numbers([row[3] for row in rows])
+        lower = day_numbers([start])[0]
+        # the stored due date is the next charge whether or not it sits on the anchor day
+        mask = (due >= lower) & (due <= last)
+        found_rows, found_days = [np.flatnonzero(mask)], [due[mask]]
+        for steps, monthly in ((DAY_STEPS, False), (MONTH_STEPS, True)):
+            for name, step in steps.items():
+                index = np.flatnonzero(frequency == name)
+                if not len(index):
+                    continue
+                schedules = Schedules(anchors[index], np.full(len(index), step, dtype=np.int64), monthly)
+                first = np.maximum(schedules.period_index(due[index]) + 1, schedules.index_on_or_after(np.full(len(index), lower)))
+                k_rows, k = expand(first, schedules.index_on_or_before(last[index]))
+                found_rows.append(index[k_rows])
+                found_days.append(schedules.occurrence(k, k_rows))
+        return np.concatenate(found_rows), np.concatenate(found_days)
+
+    @staticmethod
+    def rules_select(user_id):
+        """The active recurring expenses a forecast projects, as plain rows"""
+        from ..models import RecurringExpense
+        return db.select(RecurringExpense.frequency, RecurringExpense.start_date, RecurringExpense.end_date,
+                         RecurringExpense.next_due_date, RecurringExpense.category_id, RecurringExpense.amount).where(
+            RecurringExpense.user_id == user_id, RecurringExpense.is_active == True)
+
+    def _compute(self, user_id, start, end, period):
+        from .category_cache import category_cache
+        rows = db.session.execute(self.rules_select(user_id)).all()
+        result = {'start': start.isoformat(), 'end': end.isoformat(), 'period': period,
+                  'total': 0.0, 'occurrences': 0, 'buckets': [], 'categories': {}}
+        index, days = self.occurrences([row[:4] for row in rows], start, end)
+        if not len(days):
+            return result
+        amounts = np.array([float(row.amount) for row in rows])[index]
+        category_ids, codes = np.unique(np.array([row.category_id for row in rows])[index], return_inverse=True)
+        keys, inverse = np.unique(period_start(days, period) * len(category_ids) + codes, return_inverse=True)
+        totals = np.bincount(inverse, weights=amounts)
+        names = category_cache.names()
+        buckets = {}
+        for bucket_key, total in zip(keys.tolist(), totals.tolist()):
+            bucket_day, code = divmod(bucket_key, len(category_ids))
+            name = names.get(int(category_ids[code]), '')
+            bucket = buckets.setdefault(bucket_day, {'start': str(np.datetime64(bucket_day, 'D')), 'total': 0.0, 'categories': {}})
+            bucket['total'] += total
+            bucket['categories'][name] = round(bucket['categories'].get(name, 0.0) + total, 2)
+            result['categories'][name] = result['categories'].get(name, 0.0) + total
+        for bucket in buckets.values():
+            bucket['total'] = round(bucket['total'], 2)
+        result['buckets'] = [buckets[day] for day in sorted(buckets)]
+        result['categories'] = {name: round(total, 2) for name, total in result['categories'].items()}
+        result['total'] = round(float(amounts.sum()), 2)
+        result['occurrences'] = int(len(days))
+        return result
+
+
+forecast = CashFlowForecast()
@@ -8,33 +8,92 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
 import json
-from datetime import date
+import threading
+from collections import namedtuple
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from datetime import date, datetime, timedelta
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+TEMPLATE_DIR=os.path.join(os.path.dirname(os.path.dirname(__file__)),'templates','email')
+# one expense as the email templates show it, a tuple so attribute lookups in the template are direct
+EmailItem=namedtuple('EmailItem',['title','category','frequency','due','days_text','description','amount',
+                                  'status','status_class','badge_class'])
 
 class GmailService:
+    # built clients are shared by every GmailService in the process, keyed by the account settings, so
+    # discovery and the OAuth token refresh happen once rather than on every message
+    _clients={}
+    _clients_lock=threading.Lock()
+    # httplib2 connections are not thread safe, each thread sends through its own
+    _local=threading.local()
+    # the due expenses email templates, compiled once
+    _templates=None
+
     def __init__(self):
         self.SCOPES=['https://www.googleapis.com/auth/gmail.send']
         self.credentials=None
         self.service=None
-        
+
+    @staticmethod
+    def _settings():
+        return (os.getenv('GOOGLE_CLIENT_ID'), os.getenv('GOOGLE_CLIENT_SECRET'), os.getenv('GOOGLE_REFRESH_TOKEN'),
+                os.getenv('GOOGLE_TOKEN_URI', 'https://oauth2.googleapis.com/token'), os.getenv('GMAIL_API_ENDPOINT'))
+
+    @classmethod
+    def reset_clients(cls):
+        """Forget the cached clients, e.g. after the account settings changed"""
+        with cls._clients_lock:
+            cls._clients.clear()
+
+    @staticmethod
+    def _near_expiry(creds):
+        # refresh ahead of time so a token doesn't run out between the check and the send
+        margin=timedelta(seconds=int(os.getenv('GMAIL_TOKEN_REFRESH_MARGIN', 300)))
+        return not creds.token or (creds.expiry is not None and creds.expiry-datetime.utcnow()<margin)
+
     def get_gmail_service(self):
         try:
-            creds = Credentials.from_authorized_user_info({
-                'client_id': os.getenv('GOOGLE_CLIENT_ID'),
-                'client_secret': os.getenv('GOOGLE_CLIENT_SECRET'),
-                'refresh_token': os.getenv('GOOGLE_REFRESH_TOKEN'),  
-                'token_uri': 'https://oauth2.googleapis.com/token'
-            })
-            
-            # Add token refresh check
-            if creds.expired:
-                creds.refresh(Request())
+            key=self._settings()
+            with self._clients_lock:
+                client=self._clients.get(key)
+                if client is None:
+                    client_id, client_secret, refresh_token, token_uri, api_endpoint=key
+                    # built directly, from_authorized_user_info always resets token_uri to Google's
+                    creds = Credentials(
+                        token=None,
+                        client_id=client_id,
+                        client_secret=client_secret,
+                        refresh_token=refresh_token,
+                        token_uri=token_uri
+                    )
+                    client_options={'api_endpoint': api_endpoint} if api_endpoint else None
+                    service=build('gmail','v1',credentials=creds,client_options=client_options,cache_discovery=False)
+                    client=self._clients[key]=(creds, service)
+                creds, service=client
                 
-            self.service=build('gmail','v1',credentials=creds)
+                # Add token refresh check, under the lock so concurrent senders refresh once
+                if self._near_expiry(creds):
+                    creds.refresh(Request())
+            
+            self.credentials, self.service=creds, service
             return self.service
         except Exception as e:
             print(f"Error creating gmail service: {str(e)}")
             return None
+
+    def _http(self):
+        """This thread's authorized connection for the current credentials"""
+        connections=getattr(self._local, 'connections', None)
+        if connections is None:
+            connections=self._local.connections={}
+        http=connections.get(id(self.credentials))
+        if http is None or http.credentials is not self.credentials:
+            timeout=float(os.getenv('GMAIL_HTTP_TIMEOUT', 30))
+            http=connections[id(self.credentials)]=AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=timeout))
+        return http
             
     def create_message(self,sender,to,subject,html_body,text_body=None):
         try:
@@ -64,7 +123,7 @@ class GmailService:
             message=self.create_message(sender,to_email,subject,html_body,text_body)
             if not message:
                 return False
-            res=service.users().messages().send(userId='me',body=message).execute()
+            res=service.users().messages().send(userId='me',body=message).execute(http=self._http())
             print(f"Email sent successfully. Message ID: {res['id']}")
             return True
         except HttpError as e:
@@ -74,168 +133,100 @@ class GmailService:
             print(f"Error sending email: {str(e)}")
             return False
             
-    def create_due_expenses_email(self, user, due_expenses):
-
-        total_amount = sum(float(exp.amount) for exp in due_expenses)
-        overdue_expenses = [exp for exp in due_expenses if exp.next_due_date < date.today()]
-        due_today = [exp for exp in due_expenses if exp.next_due_date == date.today()]
-        
-        # Generate HTML content
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Due Expenses Notification</title>
-            <style>
-                body {{ font-family: 'Segoe UI', Arial, sans-serif; line-height: 1.6; color: #333; margin: 0; padding: 0; background-color: #f5f5f5; }}
-                .container {{ max-width: 600px; margin: 0 auto; background: white; }}
-                .header {{ background: #e53e3e; color: white; padding: 20px; text-align: center; }}
-                .content {{ padding: 30px; }}
-                .expense-item {{ background: #f8f9fa; border-left: 4px solid #e53e3e; margin: 10px 0; padding: 15px; border-radius: 4px; }}
-                .overdue {{ border-left-color: #dc3545; }}
-                .due-today {{ border-left-color: #ffc107; }}
-                .amount {{ font-weight: bold; color: #e53e3e; font-size: 18px; }}
-                .total-box {{ background: #e9ecef; padding: 20px; margin: 20px 0; text-align: center; border-radius: 8px; }}
-                .button {{ display: inline-block; background: #28a745; color: white; padding: 12px 24px; text-decoration: none; border-radius: 6px; margin: 10px 5px; }}
-                .footer {{ background: #6c757d; color: white; text-align: center; padding: 15px; font-size: 14px; }}
-                .badge {{ padding: 4px 8px; border-radius: 12px; font-size: 12px; color: white; }}
-                .badge-danger {{ background: #dc3545; }}
-                .badge-warning {{ background: #ffc107; color: #333; }}
-                .frequency {{ font-size: 12px; background: #17a2b8; color: white; padding: 2px 6px; border-radius: 10px; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h2> Expense Tracker Reminder</h2>
-                    <p>Hello {getattr(user, 'first_name', user.username) if hasattr(user, 'first_name') else user.username}, you have {len(due_expenses)} recurring expense(s) due for processing!</p>
-                </div>
-                
-                <div class="content">
-                    <div class="total-box">
-                        <h3>Total Amount Due: ₹{total_amount:.2f}</h3>
-                        <p>
-                            {len(overdue_expenses)} overdue • {len(due_today)} due today
-                        </p>
-                    </div>
-                    
-                    <h3> Due Recurring Expenses:</h3>
-        """
-        
-        # Add each expense
+    def send_messages(self,messages):
+        """Send messages ({to,subject,html,text} dicts) in one Gmail batch HTTP request (a plain send for one).
+        Returns a status per message: None when it was sent, else the HTTP status, 0 if Gmail wasn't reached"""
+        statuses=[0]*len(messages)
+        service=self.get_gmail_service()
+        if not service or not messages:
+            return statuses
+        sender=os.getenv('GMAIL_SENDER_EMAIL')
+        bodies=[self.create_message(sender,m['to'],m['subject'],m['html'],m.get('text')) for m in messages]
+        for i,body in enumerate(bodies):
+            if body is None:
+                statuses[i]=400
+        try:
+            if len(messages)==1:
+                if bodies[0] is not None:
+                    service.users().messages().send(userId='me',body=bodies[0]).execute(http=self._http())
+                    statuses[0]=None
+                return statuses
+
+            def callback(request_id,response,exception):
+                if exception is None:
+                    statuses[int(request_id)]=None
+                else:
+                    statuses[int(request_id)]=exception.resp.status if isinstance(exception,HttpError) else 0
+
+            # new_batch_http_request() ignores api_endpoint, so the batch url is built the same way
+            endpoint=os.getenv('GMAIL_API_ENDPOINT') or 'https://gmail.googleapis.com'
+            batch=BatchHttpRequest(callback=callback,batch_uri=f"{endpoint.rstrip('/')}/batch/gmail/v1")
+            for i,body in enumerate(bodies):
+                if body is not None:
+                    batch.add(service.users().messages().send(userId='me',body=body),request_id=str(i))
+            batch.execute(http=self._http())
+        except HttpError as e:
+            print(f"Gmail api error: {e}")
+            statuses=[e.resp.status if status==0 else status for status in statuses]
+        except Exception as e:
+            print(f"Error sending email: {str(e)}")
+        return statuses
+
+    @classmethod
+    def email_templates(cls):
+        """The (html, text) due expenses templates, compiled on first use and shared by the process"""
+        if cls._templates is None:
+            with cls._clients_lock:
+                if cls._templates is None:
+                    env=Environment(loader=FileSystemLoader(TEMPLATE_DIR),autoescape=select_autoescape(['html']),
+                                    trim_blocks=True,lstrip_blocks=True,auto_reload=False)
+                    cls._templates=(env.get_template('due_expenses.html'),env.get_template('due_expenses.txt'))
+        return cls._templates
+
+    def create_due_expenses_email(self, user, due_expenses, today=None, base_url=None):
+        today = today or date.today()
+        base_url = base_url or os.getenv('APP_BASE_URL', 'http://localhost:5000')
+
+        # everything the templates show, worked out in one pass over the expenses
+        items = []
+        total_amount = 0.0
+        overdue_count = 0
+        frequency_counts = {}
         for expense in due_expenses:
-            status_class = "overdue" if expense.next_due_date < date.today() else "due-today"
-            status_text = "OVERDUE" if expense.next_due_date < date.today() else "DUE TODAY"
-            badge_class = "badge-danger" if expense.next_due_date < date.today() else "badge-warning"
-            
-            # Calculate days overdue/until due
-            days_diff = (date.today() - expense.next_due_date).days
-            if days_diff > 0:
+            amount = float(expense.amount)
+            frequency = expense.frequency.title()
+            days_diff = (today - expense.next_due_date).days
+            overdue = days_diff > 0
+            if overdue:
                 days_text = f"{days_diff} days overdue"
             elif days_diff == 0:
                 days_text = "Due today"
             else:
-                days_text = f"Due in {abs(days_diff)} days"
-            
-            html_content += f"""
-                    <div class="expense-item {status_class}">
-                        <div style="display: flex; justify-content: space-between; align-items: center;">
-                            <div style="flex: 1;">
-                                <h4 style="margin: 0; color: #333;">{expense.title}</h4>
-                                <p style="margin: 5px 0; color: #666;">
-                                    {expense.category.name} • 
-                                    <span class="frequency">{expense.frequency.title()}</span>
-                                </p>
-                                <p style="margin: 5px 0; font-size: 14px; color: #666;">
-                                    Due: {expense.next_due_date.strftime('%d %b %Y')} • {days_text}
-                                </p>
-                                {f'<p style="margin: 5px 0; font-size: 12px; color: #888;">{expense.description}</p>' if expense.description else ''}
-                            </div>
-                            <div style="text-align: right;">
-                                <div class="amount">₹{float(expense.amount):.2f}</div>
-                                <span class="badge {badge_class}">{status_text}</span>
-                            </div>
-                        </div>
-                    </div>
-            """
-        
-        # Close HTML
-        html_content += f"""
-                    <div style="text-align: center; margin-top: 30px;">
-                        <a href="{os.getenv('APP_BASE_URL', 'http://localhost:5000')}/process-due" class="button">
-                             Process Due Expenses
-                        </a>
-                        <a href="{os.getenv('APP_BASE_URL', 'http://localhost:5000')}/recurring-expenses" class="button" style="background: #6c757d;">
-                             View All Recurring Expenses
-                        </a>
-                    </div>
-                    
-                    <div style="margin-top: 30px; padding: 15px; background: #e3f2fd; border-radius: 6px;">
-                        <h4 style="color: #1976d2; margin-top: 0;">💡 Quick Tip:</h4>
-                        <p style="margin-bottom: 0; color: #1565c0;">
-                            Processing these expenses will add them to your expense records and automatically update their next due dates based on their frequency.
-                        </p>
-                    </div>
-                    
-                    <div style="margin-top: 20px; padding: 15px; background: #f8f9fa; border-radius: 6px; border-left: 4px solid #17a2b8;">
-                        <h4 style="color: #17a2b8; margin-top: 0;"> Frequency Info:</h4>
-                        <ul style="margin: 0; color: #555;">
-        """
-        
-        # Add frequency breakdown
-        frequency_counts = {}
-        for exp in due_expenses:
-            freq = exp.frequency.title()
-            frequency_counts[freq] = frequency_counts.get(freq, 0) + 1
-        
-        for freq, count in frequency_counts.items():
-            html_content += f"<li>{count} {freq} expense{'s' if count > 1 else ''}</li>"
-        
-        html_content += """
-                        </ul>
-                    </div>
-                </div>
-                
-                <div class="footer">
-                    <p>This is an automated notification from your Expense Tracker app.</p>
-                    <p style="font-size: 12px;">
-                        Don't want these emails? 
-                        <a href="{}/settings" style="color: #ffc107;">Update your preferences</a>
-                    </p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """.format(os.getenv('APP_BASE_URL', 'http://localhost:5000'))
-        
-        # Create text version (fallback)
-        text_content = f"""
-        EXPENSE TRACKER REMINDER
-        
-        Hello {getattr(user, 'first_name', user.username) if hasattr(user, 'first_name') else user.username}!
-        
-        You have {len(due_expenses)} recurring expense(s) due for processing:
-        Total Amount: ₹{total_amount:.2f}
-        
-        Due Recurring Expenses:
-        """
-        
-        for expense in due_expenses:
-            status = "OVERDUE" if expense.next_due_date < date.today() else "DUE TODAY"
-            text_content += f"• {expense.title} - ₹{float(expense.amount):.2f} ({expense.frequency.title()}) - {status}\n"
-            text_content += f"  Due: {expense.next_due_date.strftime('%d %b %Y')}\n"
-            if expense.description:
-                text_content += f"  Note: {expense.description}\n"
-            text_content += "\n"
-        
-        text_content += f"""
-        Process your expenses: {os.getenv('APP_BASE_URL', 'http://localhost:5000')}/process-due
-        View all recurring expenses: {os.getenv('APP_BASE_URL', 'http://localhost:5000')}/recurring-expenses
-        
-        ---
-        This is an automated notification from your Expense Tracker app.
-        """
-        
-        return html_content, text_content
\ No newline at end of file
+                days_text = f"Due in {-days_diff} days"
+            items.append(EmailItem(
+                expense.title,
+                expense.category.name,
+                frequency,
+                expense.next_due_date.strftime('%d %b %Y'),
+                days_text,
+                expense.description,
+                f"{amount:.2f}",
+                "OVERDUE" if overdue else "DUE TODAY",
+                "overdue" if overdue else "due-today",
+                "badge-danger" if overdue else "badge-warning",
+            ))
+            total_amount += amount
+            overdue_count += overdue
+            frequency_counts[frequency] = frequency_counts.get(frequency, 0) + 1
+
+        context = {
+            'name': getattr(user, 'first_name', None) or user.username,
+            'items': items,
+            'total': f"{total_amount:.2f}",
+            'overdue_count': overdue_count,
+            'due_today_count': sum(1 for expense in due_expenses if expense.next_due_date == today),
+            'frequency_counts': frequency_counts,
+            'base_url': base_url,
+        }
+        html_template, text_template = self.email_templates()
+        return html_template.render(context), text_template.render(context)
@@ -0,0 +1,255 @@
+import logging
+import smtplib
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask_mail import Connection, Message
+from ..extensions import db, mail
+from .email_dispatcher import EmailDispatcher
+from .gmail_service import GmailService
+
+logger = logging.getLogger(__name__)
+
+# the server is unreachable or stopped answering, the rest of the batch would fail the same way
+SMTP_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, TimeoutError, ConnectionError)
+
+
+class SMTPConnection(Connection):
+    """Flask-Mail connection whose socket times out, so a stalled server fails the send instead of
+    holding the outbox lease"""
+
+    def __init__(self, mail, timeout):
+        super().__init__(mail)
+        self.timeout = timeout
+
+    def configure_host(self):
+        smtp = smtplib.SMTP_SSL if self.mail.use_ssl else smtplib.SMTP
+        host = smtp(self.mail.server, self.mail.port, timeout=self.timeout)
+        host.set_debuglevel(int(self.mail.debug))
+        if self.mail.use_tls:
+            host.starttls()
+        if self.mail.username and self.mail.password:
+            host.login(self.mail.username, self.mail.password)
+        return host
+
+
+class OutboxWorker:
+    """Drains the email outbox in batches, independently of the requests and jobs that fill it.
+
+    A batch is leased with one UPDATE that stamps a token and lease expiry on the oldest available
+    pending rows (skipping rows another worker holds), so several workers can run side by side and a
+    crashed worker's rows come back once OUTBOX_LEASE_SECONDS pass. Messages go out in rounds the
+    size of the EmailDispatcher's pool, the lease is renewed before each one: Gmail through the
+    dispatcher (without its own retries), SMTP over one Flask-Mail connection with
+    OUTBOX_SMTP_TIMEOUT on its socket. Rows another worker took over are neither sent nor recorded.
+    A failed message is retried after an exponential backoff and dead-lettered (status 'dead')
+    after OUTBOX_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, app=None, gmail_service=None):
+        self.app = app
+        self.gmail_service = gmail_service or GmailService()
+        self._dispatcher = None
+        self._last_prune = None
+        self.last_run = None
+
+    @property
+    def dispatcher(self):
+        if self._dispatcher is None:
+            self._dispatcher = EmailDispatcher.from_config(self.gmail_service, self.app.config)
+            # failures come back to the outbox, which retries them with its own backoff. Retrying inside
+            # the dispatcher as well would keep the batch busy (and leased) for minutes
+            self._dispatcher.max_retries = 0
+        return self._dispatcher
+
+    def lease(self, batch_size, now=None):
+        """Claim up to batch_size sendable rows for this worker and return them"""
+        from ..models import OutboxMessage
+        now = now or datetime.utcnow()
+        token = uuid.uuid4().hex
+        available = db.and_(OutboxMessage.status == 'pending', OutboxMessage.available_at <= now,
+                            db.or_(OutboxMessage.leased_until.is_(None), OutboxMessage.leased_until < now))
+        candidates = db.select(OutboxMessage.id).where(available).order_by(OutboxMessage.available_at, OutboxMessage.id) \
+            .limit(batch_size).with_for_update(skip_locked=True)
+        # the outer condition is checked again on the locked row, so two workers never lease the same message
+        db.session.execute(db.update(OutboxMessage).where(OutboxMessage.id.in_(candidates), available).values(
+            lease_token=token, leased_until=now + timedelta(seconds=self.app.config['OUTBOX_LEASE_SECONDS'])
+        ).execution_options(synchronize_session=False))
+        db.session.commit()
+        return OutboxMessage.query.filter(OutboxMessage.lease_token == token).order_by(OutboxMessage.id).all()
+
+    def renew(self, token):
+        """Push the lease of a batch forward, returns how many rows this worker still holds"""
+        from ..models import OutboxMessage
+        leased_until = datetime.utcnow() + timedelta(seconds=self.app.config['OUTBOX_LEASE_SECONDS'])
+        count = db.session.execute(db.update(OutboxMessage).where(OutboxMessage.lease_token == token).values(
+            leased_until=leased_until).execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        return count
+
+    def _rounds(self, token, held, ids, size, renew_first):
+        """Chunks of ids this batch still holds, renewing the lease before each (but the batch's first).
+        held loses the rows another worker took over and the rounds stop once none are left"""
+        from ..models import OutboxMessage
+        for i in range(0, len(ids), size):
+            if i or renew_first:
+                if self.renew(token) < len(held):
+                    held &= set(db.session.scalars(db.select(OutboxMessage.id).where(OutboxMessage.lease_token == token)))
+                if not held:
+                    logger.warning(f"Outbox lease {token} expired mid batch, leaving the rest to the worker that holds it")
+                    return
+            chunk = [message_id for message_id in ids[i:i + size] if message_id in held]
+            if chunk:
+                yield chunk
+
+    def smtp_connection(self):
+        return SMTPConnection(mail, self.app.config['OUTBOX_SMTP_TIMEOUT'])
+
+    def _send_mail(self, rounds, messages, errors):
+        """Send the SMTP rounds over one connection, filling errors. Returns the ids that were tried.
+        Once the server can't be reached the remaining messages fail with that error without waiting
+        on it again"""
+        sender = self.app.config['MAIL_DEFAULT_SENDER']
+        tried, failure, connection = [], None, None
+        try:
+            connection = self.smtp_connection().__enter__()
+        except Exception as e:
+            failure = str(e) or type(e).__name__
+        try:
+            for ids in rounds:
+                for message_id in ids:
+                    tried.append(message_id)
+                    if failure:
+                        errors[message_id] = failure
+                        continue
+                    message = messages[message_id]
+                    try:
+                        connection.send(Message(subject=message['subject'], recipients=[message['to']],
+                                                html=message['html'], body=message['text'], sender=sender))
+                    except SMTP_CONNECTION_ERRORS as e:
+                        failure = errors[message_id] = str(e) or type(e).__name__
+                    except Exception as e:
+                        errors[message_id] = str(e)
+        finally:
+            if connection is not None:
+                try:
+                    connection.__exit__(None, None, None)
+                except Exception:
+                    pass  # QUIT on a connection the server already dropped
+        if failure:
+            logger.warning(f"SMTP connection failed, {sum(1 for message_id in tried if errors.get(message_id) == failure)} "
+                           f"outbox messages will be retried: {failure}")
+        return tried
+
+    def backoff(self, attempts):
+        config = self.app.config
+        return min(config['OUTBOX_BACKOFF_MAX'], config['OUTBOX_BACKOFF_BASE'] * (2 ** (attempts - 1)))
+
+    def run_once(self, batch_size=None):
+        """Lease one batch, send it and record the outcome. Returns the batch's stats"""
+        from ..models import OutboxMessage
+        batch_size = batch_size or self.app.config['OUTBOX_BATCH_SIZE']
+        started = time.monotonic()
+        leased = self.lease(batch_size)
+        stats = {'leased': len(leased), 'sent': 0, 'retried': 0, 'dead': 0}
+        if not leased:
+            return stats
+        # plain copies, the commits that renew the lease expire the ORM objects
+        token = leased[0].lease_token
+        attempts = {message.id: message.attempts for message in leased}
+        messages = {message.id: message.to_message() for message in leased}
+        gmail = [message.id for message in leased if message.transport == 'gmail']
+        smtp = [message.id for message in leased if message.transport != 'gmail']
+        held = set(messages)
+
+        # rounds the dispatcher's pool finishes in one go, so the lease is renewed every few seconds
+        size = self.dispatcher.workers * self.dispatcher.batch_size
+        errors, tried = {}, []
+        for ids in self._rounds(token, held, gmail, size, renew_first=False):
+            results, _ = self.dispatcher.dispatch([messages[message_id] for message_id in ids])
+            errors.update({message_id: 'Gmail send failed' for message_id, sent in zip(ids, results) if not sent})
+            tried.extend(ids)
+        if smtp and held:
+            tried.extend(self._send_mail(self._rounds(token, held, smtp, size, renew_first=bool(gmail)), messages, errors))
+
+        now = datetime.utcnow()
+        max_attempts = self.app.config['OUTBOX_MAX_ATTEMPTS']
+        updates = []
+        for message_id in tried:
+            count = attempts[message_id] + 1
+            error = errors.get(message_id)
+            update = {'b_id': message_id, 'attempts': count, 'status': 'pending', 'sent_at': None,
+                      'available_at': now, 'last_error': error[:255] if error else None}
+            if error is None:
+                update.update(status='sent', sent_at=now)
+                stats['sent'] += 1
+            elif count >= max_attempts:
+                update['status'] = 'dead'
+                stats['dead'] += 1
+                logger.error(f"Dead-lettered email {message_id} to {messages[message_id]['to']} after {count} attempts: {error}")
+            else:
+                update['available_at'] = now + timedelta(seconds=self.backoff(count))
+                stats['retried'] += 1
+            updates.append(update)
+        # only rows still leased by this batch are written, a row whose lease ran out belongs to whoever took it
+        table = OutboxMessage.__table__
+        if updates:
+            result = db.session.execute(table.update().where(table.c.id == db.bindparam('b_id'), table.c.lease_token == token)
+                                        .values(lease_token=None, leased_until=None), updates)
+            db.session.commit()
+            if 0 <= result.rowcount < len(updates):
+                logger.warning(f"Outbox lease {token} expired before {len(updates) - result.rowcount} results were recorded")
+        stats['elapsed'] = round(time.monotonic() - started, 3)
+        self.last_run = stats
+        logger.info(f"Outbox batch: {stats['sent']} sent, {stats['retried']} to retry, {stats['dead']} dead "
+                    f"of {stats['leased']} in {stats['elapsed']}s")
+        return stats
+
+    def drain(self, batch_size=None, max_batches=None):
+        """Send batches until nothing is available (or max_batches), returns the summed stats"""
+        totals = {'leased': 0, 'sent': 0, 'retried': 0, 'dead': 0, 'batches': 0}
+        while max_batches is None or totals['batches'] < max_batches:
+            stats = self.run_once(batch_size)
+            if not stats['leased']:
+                break
+            totals['batches'] += 1
+            for key in ('leased', 'sent', 'retried', 'dead'):
+                totals[key] += stats[key]
+        self.prune()
+        return totals
+
+    def prune(self):
+        """Delete sent messages older than OUTBOX_RETENTION_DAYS, at most once an hour. Dead ones are kept"""
+        from ..models import OutboxMessage
+        now = datetime.utcnow()
+        if self._last_prune and now - self._last_prune < timedelta(hours=1):
+            return 0
+        self._last_prune = now
+        before = now - timedelta(days=self.app.config['OUTBOX_RETENTION_DAYS'])
+        pruned = db.session.execute(db.delete(OutboxMessage).where(OutboxMessage.status == 'sent',
+                                                                   OutboxMessage.sent_at < before)).rowcount
+        db.session.commit()
+        return pruned
+
+    def run_forever(self, interval=None, batch_size=None):
+        """Worker loop: drain, then sleep interval seconds when the outbox is empty"""
+        interval = interval or self.app.config['OUTBOX_POLL_SECONDS']
+        logger.info(f"Outbox worker started (batch size {batch_size or self.app.config['OUTBOX_BATCH_SIZE']}, poll {interval}s)")
+        while True:
+            try:
+                self.drain(batch_size)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Outbox worker error: {str(e)}", exc_info=True)
+            finally:
+                db.session.remove()
+            time.sleep(interval)
+
+    @staticmethod
+    def requeue_dead():
+        """Give dead-lettered messages a fresh set of attempts, returns how many"""
+        from ..models import OutboxMessage
+        count = db.session.execute(db.update(OutboxMessage).where(OutboxMessage.status == 'dead').values(
+            status='pending', attempts=0, available_at=datetime.utcnow(), last_error=None)).rowcount
+        db.session.commit()
+        return count
@@ -0,0 +1,177 @@
+import os
+import re
+import sys
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9._-]+')
+
+
+class _Unit:
+    """Stack samples for one request or scheduler job running on a thread"""
+
+    __slots__ = ('name', 'started', 'sampled', 'stacks')
+
+    def __init__(self, name, sampled):
+        self.name = name
+        self.started = time.perf_counter()
+        self.sampled = sampled
+        self.stacks = Counter()
+
+
+class Profiler:
+    """Stack sampling profiler for requests and scheduler jobs.
+
+    While enabled a background thread samples the Python stack of every thread that is inside a
+    request or tracked job every PROFILER_INTERVAL_MS. When the unit ends its samples are written
+    as folded stacks (the input format of flamegraph tools) if it was picked by PROFILER_SAMPLE_RATE
+    or took longer than PROFILER_SLOW_MS. Only the newest PROFILER_MAX_FILES profiles are kept.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._units = {}
+        self._lock = threading.Lock()
+        # the sampler sleeps on this until a unit starts, an idle process has no wakeups
+        self._active = threading.Condition(self._lock)
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config['PROFILER_ENABLED']
+        self.sample_rate = app.config['PROFILER_SAMPLE_RATE']
+        self.slow_seconds = app.config['PROFILER_SLOW_MS'] / 1000
+        self.interval = app.config['PROFILER_INTERVAL_MS'] / 1000
+        self.directory = app.config['PROFILER_DIR']
+        self.max_files = app.config['PROFILER_MAX_FILES']
+        self.root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        app.extensions['profiler'] = self
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+
+    # sampling
+
+    def _ensure_sampler(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._sample_loop, name='profiler-sampler', daemon=True)
+            self._thread.start()
+
+    def _sample_loop(self):
+        while True:
+            with self._lock:
+                while not self._units:
+                    self._active.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                units = list(self._units.items())
+            frames = sys._current_frames()
+            samples = [(thread_id, unit, self._fold(frames[thread_id])) for thread_id, unit in units
+                       if thread_id in frames]
+            # counted under the lock and only for units still running, _end owns a unit once it popped it
+            with self._lock:
+                for thread_id, unit, stack in samples:
+                    if self._units.get(thread_id) is unit:
+                        unit.stacks[stack] += 1
+
+    def _fold(self, frame):
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            filename = code.co_filename
+            if filename.startswith(self.root):
+                filename = os.path.relpath(filename, os.path.dirname(self.root))
+            else:
+                filename = os.path.basename(filename)
+            parts.append(f"{code.co_name} ({filename}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(parts))
+
+    # units
+
+    def _begin(self, name):
+        unit = _Unit(name, random.random() < self.sample_rate)
+        with self._lock:
+            self._units[threading.get_ident()] = unit
+            self._active.notify()
+        self._ensure_sampler()
+
+    def _end(self):
+        with self._lock:
+            unit = self._units.pop(threading.get_ident(), None)
+        if unit is None:
+            return
+        elapsed = time.perf_counter() - unit.started
+        if unit.stacks and (unit.sampled or elapsed >= self.slow_seconds):
+            try:
+                self._write(unit, elapsed)
+            except Exception as e:
+                # profiling must never fail the request or job it watched
+                logger.error(f"Error writing profile for {unit.name}: {str(e)}")
+
+    def _start_request(self):
+        from flask import request
+        self._begin(request.endpoint or request.path)
+
+    def _finish_request(self, exc=None):
+        self._end()
+
+    @contextmanager
+    def profile(self, name):
+        """Profile the block as one unit, for scheduler jobs"""
+        if not self.enabled:
+            yield
+            return
+        self._begin(name)
+        try:
+            yield
+        finally:
+            self._end()
+
+    # storage
+
+    def _write(self, unit, elapsed):
+        # timestamp first so names sort oldest to newest, duration and endpoint for the listing
+        filename = f"{int(time.time() * 1000)}_{int(elapsed * 1000)}ms_{_UNSAFE.sub('-', unit.name)}.folded"
+        with open(os.path.join(self.directory, filename), 'w') as f:
+            for stack, count in unit.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith('.folded'))
+        for name in names[:max(len(names) - self.max_files, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def profiles(self, limit=20):
+        """Captured profiles, slowest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        rows = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.folded'):
+                continue
+            try:
+                stamp, duration, endpoint = name[:-len('.folded')].split('_', 2)
+                rows.append({'filename': name, 'endpoint': endpoint, 'duration_ms': int(duration[:-2]),
+                             'captured_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(int(stamp) / 1000))})
+            except ValueError:
+                continue
+        return sorted(rows, key=lambda row: -row['duration_ms'])[:limit]
+
+
+def profile_block(app, name):
+    """Context manager profiling a unit of work outside a request, a no-op when the profiler is off"""
+    profiler = app.extensions.get('profiler') if app else None
+    return profiler.profile(name) if profiler else nullcontext()
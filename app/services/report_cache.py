@@ -0,0 +1,154 @@
+import os
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from datetime import datetime, time as dtime, timedelta
+from sqlalchemy import event
+from sqlalchemy.sql import func
+from ..extensions import db
+
+logger = logging.getLogger(__name__)
+
+
+class ReportCache:
+    """On-disk cache of rendered report PDFs named by the hash of everything that shapes them.
+
+    A key covers the user, date range, category, report template and a fingerprint of the
+    data the report shows: the user's data_version (bumped by every expense write), the
+    count/sum/max id of the expenses in the range and the category names, so a closed period
+    keeps hitting the same file while any change to its rows or their categories produces a
+    new key. Old files are evicted by age and, past the size budget, least recently used first.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._template_versions = {}
+        self._lock = threading.Lock()
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config['REPORT_CACHE_DIR']
+        self.max_bytes = app.config['REPORT_CACHE_MAX_BYTES']
+        self.max_age = app.config['REPORT_CACHE_MAX_AGE']
+        self.template_version_override = app.config.get('REPORT_TEMPLATE_VERSION')
+        os.makedirs(self.directory, exist_ok=True)
+        app.extensions['report_cache'] = self
+        if not self._listening:
+            # new expenses bump data_version through MonthlyCategoryTotal.record_many, edits and
+            # deletes made through the ORM do it here
+            from ..models import Expense
+            for name in ('after_update', 'after_delete'):
+                event.listen(Expense, name, self._on_write)
+            self._listening = True
+
+    @staticmethod
+    def _on_write(mapper, connection, target):
+        from ..models import User
+        users = User.__table__
+        connection.execute(users.update().where(users.c.id == target.user_id).values(data_version=users.c.data_version + 1))
+
+    def template_version(self, template_name):
+        """Hash of the template source, read once per process"""
+        if self.template_version_override:
+            return self.template_version_override
+        if template_name not in self._template_versions:
+            source, _, _ = self.app.jinja_env.loader.get_source(self.app.jinja_env, template_name)
+            self._template_versions[template_name] = hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+        return self._template_versions[template_name]
+
+    @staticmethod
+    def data_fingerprint(user_id, start, end, category_id=None):
+        """The user's data version, count, sum and max id of the expenses in the range and a digest of
+        the category names, any insert, edit or delete of the rows or rename of a category moves it"""
+        from ..models import Expense, User
+        from .category_cache import category_cache
+        query = db.session.query(func.count(Expense.id), func.sum(Expense.amount), func.max(Expense.id)).filter(
+            Expense.user_id == user_id,
+            Expense.date >= datetime.combine(start, dtime.min),
+            Expense.date < datetime.combine(end + timedelta(days=1), dtime.min))
+        if category_id is not None:
+            query = query.filter(Expense.category_id == category_id)
+        count, total, max_id = query.one()
+        names = hashlib.sha256(repr(sorted(category_cache.names().items())).encode('utf-8')).hexdigest()[:16]
+        return f"{User.get_data_version(user_id)}:{count}:{float(total or 0):.2f}:{max_id or 0}:{names}"
+
+    def key(self, user, start, end, category_id, template_name, variant=''):
+        parts = [
+            str(user.id), user.username, user.email,
+            start.isoformat(), end.isoformat(), str(category_id or 'all'),
+            template_name, self.template_version(template_name), variant,
+            self.data_fingerprint(user.id, start, end, category_id),
+        ]
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key):
+        """Path of a cached file or None, a hit refreshes its position for LRU eviction"""
+        path = self.path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        now = time.time()
+        if now - stat.st_mtime > self.max_age:
+            self._remove(path)
+            return None
+        # mtime stays the write time for the age limit, atime records the last use
+        os.utime(path, (now, stat.st_mtime))
+        return path
+
+    def put_bytes(self, key, data):
+        path = self.path(key)
+        partial_path = f"{path}.{threading.get_ident()}.part"
+        with open(partial_path, 'wb') as f:
+            f.write(data)
+        os.replace(partial_path, path)
+        self.evict()
+        return path
+
+    def put_file(self, key, source_path):
+        """Add an already rendered file, hard linked when possible so no bytes are copied"""
+        path = self.path(key)
+        partial_path = f"{path}.{threading.get_ident()}.part"
+        try:
+            os.link(source_path, partial_path)
+        except OSError:
+            shutil.copyfile(source_path, partial_path)
+        os.replace(partial_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        with self._lock:
+            now = time.time()
+            entries = []
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith('.pdf') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if now - stat.st_mtime > self.max_age:
+                    self._remove(entry.path)
+                else:
+                    entries.append((stat.st_atime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error removing cached report {path}: {str(e)}")
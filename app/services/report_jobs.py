@@ -0,0 +1,175 @@
+import os
+import atexit
+import logging
+import threading
+import multiprocessing
+from uuid import uuid4
+from functools import partial
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from ..extensions import db
+
+logger = logging.getLogger(__name__)
+
+
+def render_pdf(html, path):
+    """Runs in a worker process so WeasyPrint's CPU time and memory stay out of the web workers"""
+    from weasyprint import HTML
+    partial_path = f"{path}.part"
+    HTML(string=html).write_pdf(partial_path)
+    os.replace(partial_path, path)
+    return path
+
+
+class ReportJobLimitError(Exception):
+    """Raised when a user or the whole queue already has too many reports in flight"""
+
+
+class ReportJobQueue:
+    """Bounded process pool for PDF rendering with job state kept in the report_jobs table"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config['REPORT_WORKERS']
+        self.per_user_limit = app.config['REPORT_JOBS_PER_USER']
+        self.queue_limit = app.config['REPORT_QUEUE_LIMIT']
+        self.timeout = timedelta(seconds=app.config['REPORT_JOB_TIMEOUT'])
+        self.retention = timedelta(seconds=app.config['REPORT_JOB_RETENTION'])
+        self.output_dir = app.config['REPORT_OUTPUT_DIR']
+        os.makedirs(self.output_dir, exist_ok=True)
+        app.extensions['report_jobs'] = self
+        atexit.register(self.shutdown)
+
+    def executor(self):
+        # created on first use, spawn so workers don't inherit the scheduler threads or db connections
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _submit(self, fn, *args):
+        executor = self.executor()
+        try:
+            return executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # a worker died (killed, out of memory) and the pool refuses new work, start a fresh one
+            logger.warning("Report worker pool is broken, starting a new one")
+            with self._executor_lock:
+                if self._executor is executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = None
+            return self.executor().submit(fn, *args)
+
+    def _in_flight(self, now=None):
+        from ..models import ReportJob
+        # a queued job older than the timeout belongs to a worker that went away, don't count it
+        now = now or datetime.utcnow()
+        return db.and_(ReportJob.status == 'queued', ReportJob.created_at > now - self.timeout)
+
+    def _reserve(self, job):
+        """Insert the job row only if the user and the queue are under their limits. The counts and the
+        insert are one INSERT ... SELECT (serialized by sqlite's write lock, and by an advisory lock on
+        Postgres) so concurrent submits can't both squeeze past a limit"""
+        from ..models import ReportJob
+        in_flight = self._in_flight(job.created_at)
+        user_count = db.select(db.func.count()).select_from(ReportJob).where(
+            in_flight, ReportJob.user_id == job.user_id).scalar_subquery()
+        total_count = db.select(db.func.count()).select_from(ReportJob).where(in_flight).scalar_subquery()
+        columns = ['id', 'user_id', 'status', 'filename', 'file_path', 'created_at']
+        row = db.select(*[db.literal(getattr(job, name), getattr(ReportJob, name).type) for name in columns]).where(
+            user_count < self.per_user_limit, total_count < self.queue_limit)
+        try:
+            if db.session.get_bind().dialect.name == 'postgresql':
+                db.session.execute(db.text("SELECT pg_advisory_xact_lock(hashtext('report_jobs'))"))
+            reserved = db.session.execute(db.insert(ReportJob).from_select(columns, row)).rowcount == 1
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return reserved
+
+    def submit(self, user_id, html, filename, cache_key=None):
+        """Queue a render and return the ReportJob, raises ReportJobLimitError when full.
+
+        With a cache_key the finished file is also added to the report cache.
+        """
+        from ..models import ReportJob
+        self.purge_expired()
+        job_id = uuid4().hex
+        job = ReportJob(id=job_id, user_id=user_id, status='queued', filename=filename,
+                        file_path=os.path.join(self.output_dir, f"{job_id}.pdf"), created_at=datetime.utcnow())
+        if not self._reserve(job):
+            if ReportJob.query.filter(self._in_flight(), ReportJob.user_id == user_id).count() >= self.per_user_limit:
+                raise ReportJobLimitError(f"You already have {self.per_user_limit} report(s) being generated")
+            raise ReportJobLimitError("The report queue is full, please try again shortly")
+
+        job = db.session.get(ReportJob, job_id)
+        try:
+            future = self._submit(render_pdf, html, job.file_path)
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)[:255]
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            raise
+        future.add_done_callback(partial(self._finished, job.id, cache_key))
+        return job
+
+    def _finished(self, job_id, cache_key, future):
+        from ..models import ReportJob
+        with self.app.app_context():
+            try:
+                job = db.session.get(ReportJob, job_id)
+                if job is None:
+                    return
+                error = future.exception() if not future.cancelled() else 'cancelled'
+                job.status = 'failed' if error else 'done'
+                job.error = str(error)[:255] if error else None
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+                if error:
+                    logger.error(f"Report job {job_id} failed: {error}")
+                elif cache_key and 'report_cache' in self.app.extensions:
+                    self.app.extensions['report_cache'].put_file(cache_key, job.file_path)
+            except Exception as e:
+                logger.error(f"Error recording report job {job_id}: {str(e)}")
+            finally:
+                db.session.remove()
+
+    def get(self, user_id, job_id):
+        from ..models import ReportJob
+        job = ReportJob.query.filter_by(id=job_id, user_id=user_id).first()
+        if job and job.status == 'queued' and job.created_at <= datetime.utcnow() - self.timeout:
+            job.status = 'failed'
+            job.error = 'Timed out'
+            db.session.commit()
+        return job
+
+    def purge_expired(self):
+        """Remove job rows and files past the retention period"""
+        from ..models import ReportJob
+        expired = ReportJob.query.filter(ReportJob.created_at < datetime.utcnow() - self.retention).all()
+        for job in expired:
+            if job.file_path and os.path.exists(job.file_path):
+                try:
+                    os.remove(job.file_path)
+                except OSError as e:
+                    logger.error(f"Error removing report file {job.file_path}: {str(e)}")
+            db.session.delete(job)
+        if expired:
+            db.session.commit()
@@ -0,0 +1,157 @@
+import re
+import time
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from collections import Counter
+from sqlalchemy import event
+from ..extensions import db
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('sql_metrics_unit', default=None)
+_PLACEHOLDER_LIST = re.compile(r'\(\s*(\?|%\([^)]*\)s|%s|:\w+)(\s*,\s*(\?|%\([^)]*\)s|%s|:\w+))+\s*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_SPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """Collapse whitespace, numbers and expanded IN (...) lists so repeats of one query compare equal"""
+    shape = _SPACE.sub(' ', statement).strip()
+    shape = _PLACEHOLDER_LIST.sub('(?...)', shape)
+    return _NUMBER.sub('N', shape)
+
+
+class _Unit:
+    """SQL counters for one request or scheduler job"""
+
+    __slots__ = ('name', 'queries', 'seconds', 'shapes')
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+
+class SqlInstrumentation:
+    """Opt-in per-request and per-job SQL counters built on engine events.
+
+    Every statement run while a unit (request or tracked job) is active adds to its query count,
+    SQL time and a count per statement shape. A shape repeated SQL_N_PLUS_ONE_THRESHOLD times in
+    one unit is logged as a likely N+1, and totals per endpoint/job are kept for the admin view.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._stats = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config['SQL_INSTRUMENTATION']
+        self.threshold = app.config['SQL_N_PLUS_ONE_THRESHOLD']
+        app.extensions['sql_metrics'] = self
+        if not self.enabled:
+            return
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+
+    # engine events
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault('sql_metrics_start', []).append(time.perf_counter())
+
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        unit = _current.get()
+        starts = conn.info.get('sql_metrics_start')
+        if unit is None or not starts:
+            return
+        unit.queries += 1
+        unit.seconds += time.perf_counter() - starts.pop()
+        unit.shapes[statement_shape(statement)] += 1
+
+    # units
+
+    def _start_request(self):
+        from flask import request
+        _current.set(_Unit(request.endpoint or request.path))
+
+    def _finish_request(self, exc=None):
+        unit = _current.get()
+        if unit is not None:
+            _current.set(None)
+            self._record(unit)
+
+    @contextmanager
+    def track(self, name):
+        """Count the SQL run inside the block as one unit, for scheduler jobs and CLI work"""
+        if not self.enabled:
+            yield
+            return
+        token = _current.set(_Unit(name))
+        try:
+            yield
+        finally:
+            unit = _current.get()
+            _current.reset(token)
+            self._record(unit)
+
+    def _record(self, unit):
+        repeated = {shape: count for shape, count in unit.shapes.items() if count >= self.threshold}
+        for shape, count in repeated.items():
+            logger.warning(f"Possible N+1 in {unit.name}: {count} x {shape[:200]}")
+        with self._lock:
+            stats = self._stats.setdefault(unit.name, {
+                'runs': 0, 'queries': 0, 'sql_seconds': 0.0, 'max_queries': 0, 'max_sql_seconds': 0.0,
+                'n_plus_one_runs': 0, 'repeated_shapes': {},
+            })
+            stats['runs'] += 1
+            stats['queries'] += unit.queries
+            stats['sql_seconds'] += unit.seconds
+            stats['max_queries'] = max(stats['max_queries'], unit.queries)
+            stats['max_sql_seconds'] = max(stats['max_sql_seconds'], unit.seconds)
+            if repeated:
+                stats['n_plus_one_runs'] += 1
+                for shape, count in repeated.items():
+                    stats['repeated_shapes'][shape] = max(stats['repeated_shapes'].get(shape, 0), count)
+
+    def snapshot(self):
+        """Per endpoint/job aggregates, highest total SQL time first"""
+        with self._lock:
+            rows = []
+            for name, stats in self._stats.items():
+                rows.append({
+                    'name': name,
+                    'runs': stats['runs'],
+                    'queries': stats['queries'],
+                    'avg_queries': round(stats['queries'] / stats['runs'], 2),
+                    'max_queries': stats['max_queries'],
+                    'sql_ms': round(stats['sql_seconds'] * 1000, 2),
+                    'avg_sql_ms': round(stats['sql_seconds'] * 1000 / stats['runs'], 2),
+                    'max_sql_ms': round(stats['max_sql_seconds'] * 1000, 2),
+                    'n_plus_one_runs': stats['n_plus_one_runs'],
+                    'repeated_shapes': [{'statement': shape, 'max_repeats': count} for shape, count in
+                                        sorted(stats['repeated_shapes'].items(), key=lambda item: -item[1])[:5]],
+                })
+        return sorted(rows, key=lambda row: -row['sql_ms'])
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def track_queries(app, name):
+    """Context manager counting SQL for a unit of work outside a request, a no-op when instrumentation is off"""
+    metrics = app.extensions.get('sql_metrics') if app else None
+    return metrics.track(name) if metrics else nullcontext()
@@ -0,0 +1,96 @@
+import threading
+from cachetools import TTLCache
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from ..extensions import db
+
+
+class UserCache:
+    """Bounded LRU+TTL cache behind the Flask-Login user loader.
+
+    Column values are cached rather than ORM instances, a hit rebuilds the User and attaches it to
+    the request's session with merge(load=False) so lazy relationships keep working without a
+    SELECT. ORM updates and deletes of a User (password reset, profile edits) drop its entry when
+    their transaction commits, and USER_CACHE_TTL bounds how long changes made by other processes
+    go unseen. data_version is changed with bulk UPDATEs and must be read with
+    User.get_data_version, not from current_user.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._listening = False
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def init_app(self, app):
+        self._cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+        app.extensions['user_cache'] = self
+        if not self._listening:
+            from ..models import User
+            for name in ('after_update', 'after_delete'):
+                event.listen(User, name, self._on_write)
+            event.listen(Session, 'after_commit', self._on_end)
+            event.listen(Session, 'after_rollback', self._on_end)
+            self._listening = True
+
+    def _on_write(self, mapper, connection, target):
+        # the flushed row is only visible to other requests after the commit, drop the entry then
+        session = object_session(target)
+        if session is None:
+            self.invalidate(target.id)
+        else:
+            session.info.setdefault('user_cache_stale', set()).add(target.id)
+
+    def _on_end(self, session):
+        for user_id in session.info.pop('user_cache_stale', ()):
+            self.invalidate(user_id)
+
+    def invalidate(self, user_id=None):
+        """Drop one user, or everyone when no id is given"""
+        with self._lock:
+            self.invalidations += 1
+            self._generation += 1
+            if user_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(user_id, None)
+
+    def get(self, user_id):
+        from ..models import User
+        with self._lock:
+            values = self._cache.get(user_id)
+            generation = self._generation
+            if values is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if values is None:
+            user = db.session.get(User, user_id)
+            if user is not None:
+                with self._lock:
+                    # skip the store if the user was written while we were loading it
+                    if generation == self._generation:
+                        self._cache[user_id] = {column.key: getattr(user, column.key) for column in User.__mapper__.column_attrs}
+            return user
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._cache),
+                'maxsize': self._cache.maxsize,
+                'ttl': self._cache.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'invalidations': self.invalidations,
+            }
+
+
+user_cache = UserCache()
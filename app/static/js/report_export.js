@@ -0,0 +1,20 @@
+// PDFs are rendered by a background worker: submit a job, poll its status, then download the file.
+// params is the report's query string, rejects with the server's message when the export fails
+async function exportReportPdf(params) {
+    const res = await fetch('/export-pdf/jobs', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
+        body: params
+    });
+    let job = await res.json();
+    if (!res.ok) throw new Error(job.error || 'Could not start the export');
+
+    while (job.status === 'queued') {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const statusRes = await fetch(job.status_url || `/export-pdf/jobs/${job.job_id}`);
+        job = Object.assign(await statusRes.json(), { status_url: job.status_url });
+        if (!statusRes.ok) throw new Error(job.error || 'Could not check the export');
+    }
+    if (job.status !== 'done') throw new Error(job.error || 'Report generation failed');
+    window.location.href = job.download_url;
+}
@@ -1 +1,4 @@
-from .token import generate_reset_token,verify_reset_token,send_reset_email
\ No newline at end of file
+from .token import generate_reset_token,verify_reset_token,send_reset_email
+from .pagination import keyset_page,ranked_page,encode_cursor,decode_cursor
+from .admin import is_admin,admin_required
+from .recurrence import Recurrence,occurrences_between
@@ -0,0 +1,15 @@
+from functools import wraps
+from flask import abort,current_app
+from flask_login import current_user
+
+def is_admin(user):
+    #admins are listed by email in ADMIN_EMAILS, there is no role column
+    return bool(user and user.is_authenticated and user.email.lower() in current_app.config['ADMIN_EMAILS'])
+
+def admin_required(view):
+    @wraps(view)
+    def wrapped(*args,**kwargs):
+        if not is_admin(current_user):
+            abort(403)
+        return view(*args,**kwargs)
+    return wrapped
@@ -0,0 +1,67 @@
+import base64
+from datetime import datetime
+from flask import current_app
+from ..extensions import db
+
+#cursor is an opaque url safe token of the last row's (date,id) so the next page starts right after it,
+#ranked pages put the row's relevance score in place of the date
+def encode_cursor(when,row_id):
+    value=when.isoformat() if hasattr(when,'isoformat') else repr(when)
+    raw=f"{value}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor,parse=datetime.fromisoformat):
+    """(value,id) from a cursor, value read with parse. None for a missing or malformed cursor"""
+    if not cursor:
+        return None
+    try:
+        raw=base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        value,row_id=raw.rsplit('|',1)
+        return parse(value),int(row_id)
+    except (ValueError,UnicodeError):
+        return None
+
+def page_size(requested=None):
+    default=current_app.config['EXPENSES_PAGE_SIZE']
+    try:
+        size=int(requested) if requested else default
+    except (TypeError,ValueError):
+        size=default
+    return max(1,min(size,current_app.config['EXPENSES_MAX_PAGE_SIZE']))
+
+def keyset_page(query,date_column,id_column,cursor=None,per_page=None,ascending=False):
+    """Return (rows,next_cursor) for the page after `cursor`, newest first (oldest first with ascending).
+    Only per_page+1 rows are read whatever the offset, next_cursor is None on the last page"""
+    per_page=page_size(per_page)
+    position=decode_cursor(cursor)
+    if position and isinstance(date_column.type,db.Date):
+        #Date columns compare against dates, a datetime parameter would not match on sqlite
+        position=(position[0].date(),position[1])
+    if position:
+        key=db.tuple_(date_column,id_column)
+        query=query.filter(key>position if ascending else key<position)
+    if ascending:
+        query=query.order_by(date_column.asc(),id_column.asc())
+    else:
+        query=query.order_by(date_column.desc(),id_column.desc())
+    rows=query.limit(per_page+1).all()
+    next_cursor=None
+    if len(rows)>per_page:
+        rows=rows[:per_page]
+        last=rows[-1]
+        next_cursor=encode_cursor(getattr(last,date_column.key),getattr(last,id_column.key))
+    return rows,next_cursor
+
+def ranked_page(query,score,id_column,cursor=None,per_page=None):
+    """Like keyset_page but ordered by a relevance expression (best first) then id"""
+    per_page=page_size(per_page)
+    position=decode_cursor(cursor,parse=float)
+    if position:
+        query=query.filter(db.tuple_(score,id_column)<position)
+    rows=query.add_columns(score).order_by(score.desc(),id_column.desc()).limit(per_page+1).all()
+    next_cursor=None
+    if len(rows)>per_page:
+        rows=rows[:per_page]
+        last,last_score=rows[-1]
+        next_cursor=encode_cursor(float(last_score),getattr(last,id_column.key))
+    return [row[0] for row in rows],next_cursor
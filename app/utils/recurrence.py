@@ -0,0 +1,173 @@
+import calendar
+from datetime import date,timedelta
+import numpy as np
+
+FREQUENCIES=('daily','weekly','monthly','yearly')
+
+def _days_in_month(year,month):
+    return calendar.monthrange(year,month)[1]
+
+def _month_offset(anchor,when):
+    return (when.year-anchor.year)*12+when.month-anchor.month
+
+class Recurrence:
+    """A repeating schedule with RRULE style options and O(1) occurrence arithmetic.
+
+    Occurrence k is always computed from the anchor (never by stepping from the previous one), so a
+    monthly rule anchored on Jan 31 gives Jan 31, Feb 28, Mar 31 and never drifts to the 28th.
+    interval repeats every n periods, last_day pins monthly/yearly occurrences to the month end and
+    until (inclusive) ends the schedule.
+    """
+    def __init__(self,frequency,anchor,interval=1,last_day=False,until=None):
+        if frequency not in FREQUENCIES:
+            raise ValueError(f"Unknown frequency '{frequency}'")
+        if interval<1:
+            raise ValueError("interval must be at least 1")
+        self.frequency=frequency
+        self.anchor=anchor
+        self.interval=interval
+        self.last_day=last_day
+        self.until=until
+
+    def __repr__(self):
+        return f'<Recurrence {self.frequency}/{self.interval} from {self.anchor}>'
+
+    def _step_days(self):
+        return self.interval*(7 if self.frequency=='weekly' else 1)
+
+    def occurrence(self,k):
+        """The k-th occurrence (0 is the anchor), ignoring until"""
+        if self.frequency in ('daily','weekly'):
+            return self.anchor+timedelta(days=k*self._step_days())
+        months=k*self.interval*(12 if self.frequency=='yearly' else 1)
+        year,month=divmod(self.anchor.month-1+months,12)
+        year+=self.anchor.year
+        month+=1
+        last=_days_in_month(year,month)
+        return date(year,month,last if self.last_day else min(self.anchor.day,last))
+
+    def period_index(self,when):
+        """Index of the period `when` falls in, occurrence(period_index(d)) is in the same day/week/month/year
+        stride as d. Negative for dates before the anchor"""
+        if self.frequency in ('daily','weekly'):
+            return (when-self.anchor).days//self._step_days()
+        months=_month_offset(self.anchor,when)
+        return months//(self.interval*(12 if self.frequency=='yearly' else 1))
+
+    def index_on_or_after(self,when):
+        """Smallest k with occurrence(k) >= when (never below 0)"""
+        k=max(self.period_index(when),0)
+        return k if self.occurrence(k)>=when else k+1
+
+    def index_on_or_before(self,when):
+        """Largest k with occurrence(k) <= when, -1 when the schedule starts after it"""
+        k=self.period_index(when)
+        if k<0:
+            return -1
+        return k if self.occurrence(k)<=when else k-1
+
+    def _ended(self,when):
+        return self.until is not None and when>self.until
+
+    def next_on_or_after(self,when):
+        """First occurrence on or after `when`, None once the schedule has ended"""
+        occurrence=self.occurrence(self.index_on_or_after(when))
+        return None if self._ended(occurrence) else occurrence
+
+    def next_after(self,when):
+        return self.next_on_or_after(when+timedelta(days=1))
+
+    def following(self,when):
+        """First occurrence in the period after the one `when` falls in. For a date on the schedule this is
+        the next occurrence, for one that drifted off it (e.g. Mar 28 for a 31st anchor) it skips the rest
+        of that month rather than charging twice in it. Ignores until"""
+        return self.occurrence(max(self.period_index(when)+1,0))
+
+    def between(self,start,end):
+        """All occurrences in [start,end] (inclusive), capped at until"""
+        if self.until is not None:
+            end=min(end,self.until)
+        if end<start:
+            return []
+        first,last=self.index_on_or_after(start),self.index_on_or_before(end)
+        return [self.occurrence(k) for k in range(first,last+1)]
+
+# fixed length frequencies step in days, calendar ones in months from the anchor
+DAY_STEPS={'daily':1,'weekly':7}
+MONTH_STEPS={'monthly':1,'yearly':12}
+
+def day_numbers(values):
+    """int64 day numbers (days since 1970-01-01) for a list of dates"""
+    return np.array(values,dtype='datetime64[D]').astype(np.int64)
+
+def month_start(months):
+    return months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+
+class Schedules:
+    """Many anchored rules of one kind (day or month steps) as arrays, the numpy twin of Recurrence.
+    Every date is an int64 day number and every method works on all rules at once. steps is the
+    per rule stride in days or months, last_day (monthly only) pins a rule to the month end"""
+    def __init__(self,anchors,steps,monthly,last_day=None):
+        self.steps=steps
+        self.monthly=monthly
+        if monthly:
+            self.origin=anchors.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+            self.day=anchors-month_start(self.origin)
+            if last_day is not None:
+                self.day=np.where(last_day,30,self.day)
+        else:
+            self.origin=anchors
+
+    def occurrence(self,k,rows=slice(None)):
+        if not self.monthly:
+            return self.origin[rows]+k*self.steps[rows]
+        #anchor day clamped to the month length, so the 31st gives 28/29, 31, 30 ... without drifting
+        months=self.origin[rows]+k*self.steps[rows]
+        start=month_start(months)
+        return start+np.minimum(self.day[rows],month_start(months+1)-start-1)
+
+    def period_index(self,days):
+        if not self.monthly:
+            return (days-self.origin)//self.steps
+        months=days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        return (months-self.origin)//self.steps
+
+    def index_on_or_after(self,days):
+        k=np.maximum(self.period_index(days),0)
+        return k+(self.occurrence(k)<days)
+
+    def index_on_or_before(self,days):
+        k=self.period_index(days)
+        return np.where(k<0,-1,k-(self.occurrence(k)>days))
+
+def expand(first,last):
+    """(rule index, k) pairs for every k in first..last of every rule, without a python loop over rules"""
+    counts=np.maximum(last-first+1,0)
+    rows=np.repeat(np.arange(len(first)),counts)
+    offsets=np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts,counts)
+    return rows,first[rows]+offsets
+
+def occurrences_between(rules,start,end):
+    """Occurrences in [start,end] for many rules at once, {key: [dates]} for a {key: Recurrence} mapping.
+    Same results as calling between() on each rule, but rules are grouped into day stepped and month
+    stepped Schedules so the work is a few array operations whatever the number of rules"""
+    keys=list(rules)
+    result={key:[] for key in keys}
+    if not keys or end<start:
+        return result
+    lower=day_numbers([start])[0]
+    upper=day_numbers([min(end,rule.until) if rule.until is not None else end for rule in rules.values()])
+    anchors=day_numbers([rule.anchor for rule in rules.values()])
+    for monthly,base in ((False,DAY_STEPS),(True,MONTH_STEPS)):
+        index=np.array([i for i,rule in enumerate(rules.values()) if rule.frequency in base],dtype=np.int64)
+        if not len(index):
+            continue
+        group=[rules[keys[i]] for i in index]
+        steps=np.array([base[rule.frequency]*rule.interval for rule in group],dtype=np.int64)
+        last_day=np.array([rule.last_day for rule in group]) if monthly else None
+        schedules=Schedules(anchors[index],steps,monthly,last_day)
+        rows,k=expand(schedules.index_on_or_after(np.full(len(index),lower)),schedules.index_on_or_before(upper[index]))
+        days=schedules.occurrence(k,rows).astype('datetime64[D]').tolist()
+        for row,day in zip(index[rows].tolist(),days):
+            result[keys[row]].append(day)
+    return result
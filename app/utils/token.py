@@ -1,7 +1,5 @@
 from flask import current_app
-from flask_mail import Message
 from itsdangerous import URLSafeTimedSerializer
-from ..extensions import mail
 
 def generate_reset_token(email):
     serializer=URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
@@ -16,17 +14,21 @@ def verify_reset_token(token,expire=3600):
         current_app.logger.error(f"{e}")
         return None
 #contains the content for email 
-def send_reset_email(email,reset_url):
-    msg = Message(
-        subject='Password Reset Request',
-        recipients=[email],
-        html=f'''
+def reset_email(reset_url):
+    subject='Password Reset Request'
+    html=f'''
         <h2>Password Reset Request</h2>
         <p>Looks like you are having some difficulty logging into your Alen's Expense Tracker Account. Please click the link below to reset it:</p>
         <p><a href="{reset_url}">Reset Password</a></p>
         <p>If you did not request this, please ignore this email.</p>
         <p>This link will expire in 1 hour.</p>
-        ''',
-        sender=current_app.config['MAIL_DEFAULT_SENDER']
-    )
-    mail.send(msg)
+        '''
+    return subject,html
+
+#queued in the outbox and sent by the outbox worker, so a slow mail server doesn't hold up the request
+def send_reset_email(email,reset_url):
+    from ..extensions import db
+    from ..models import OutboxMessage
+    subject,html=reset_email(reset_url)
+    OutboxMessage.enqueue(email,subject,html,transport='mail')
+    db.session.commit()
@@ -0,0 +1,81 @@
+"""scope expense search to the owner
+
+Revision ID: 5b2d8e4f9c13
+Revises: 3c9e5f0b7a21
+Create Date: 2026-10-18 20:05:12.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2d8e4f9c13'
+down_revision = '3c9e5f0b7a21'
+branch_labels = None
+depends_on = None
+
+
+def _drop_fts():
+    op.execute("DROP TRIGGER IF EXISTS expenses_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS expenses_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS expenses_fts_ai")
+    op.execute("DROP TABLE IF EXISTS expenses_fts")
+
+
+def upgrade():
+    # sqlite only: the postgres tsvector column sits on expenses, where the planner combines the GIN
+    # index with the user_id index already
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    # an indexed owner token ('u' || user_id) next to the description, so a search matches the owner's
+    # posting list instead of ranking every user's rows for the term. The view supplies it to 'rebuild'
+    _drop_fts()
+    op.execute("CREATE VIEW expenses_fts_source AS SELECT id, description, 'u' || user_id AS owner FROM expenses")
+    op.execute(
+        "CREATE VIRTUAL TABLE expenses_fts USING fts5("
+        "description, owner, content='expenses_fts_source', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    op.execute(
+        "CREATE TRIGGER expenses_fts_ai AFTER INSERT ON expenses BEGIN "
+        "INSERT INTO expenses_fts(rowid, description, owner) VALUES (new.id, new.description, 'u' || new.user_id); END"
+    )
+    op.execute(
+        "CREATE TRIGGER expenses_fts_ad AFTER DELETE ON expenses BEGIN "
+        "INSERT INTO expenses_fts(expenses_fts, rowid, description, owner) "
+        "VALUES ('delete', old.id, old.description, 'u' || old.user_id); END"
+    )
+    op.execute(
+        "CREATE TRIGGER expenses_fts_au AFTER UPDATE OF description, user_id ON expenses BEGIN "
+        "INSERT INTO expenses_fts(expenses_fts, rowid, description, owner) "
+        "VALUES ('delete', old.id, old.description, 'u' || old.user_id); "
+        "INSERT INTO expenses_fts(rowid, description, owner) VALUES (new.id, new.description, 'u' || new.user_id); END"
+    )
+    op.execute("INSERT INTO expenses_fts(expenses_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    _drop_fts()
+    op.execute("DROP VIEW IF EXISTS expenses_fts_source")
+    op.execute(
+        "CREATE VIRTUAL TABLE expenses_fts USING fts5("
+        "description, content='expenses', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    op.execute(
+        "CREATE TRIGGER expenses_fts_ai AFTER INSERT ON expenses BEGIN "
+        "INSERT INTO expenses_fts(rowid, description) VALUES (new.id, new.description); END"
+    )
+    op.execute(
+        "CREATE TRIGGER expenses_fts_ad AFTER DELETE ON expenses BEGIN "
+        "INSERT INTO expenses_fts(expenses_fts, rowid, description) VALUES ('delete', old.id, old.description); END"
+    )
+    op.execute(
+        "CREATE TRIGGER expenses_fts_au AFTER UPDATE OF description ON expenses BEGIN "
+        "INSERT INTO expenses_fts(expenses_fts, rowid, description) VALUES ('delete', old.id, old.description); "
+        "INSERT INTO expenses_fts(rowid, description) VALUES (new.id, new.description); END"
+    )
+    op.execute("INSERT INTO expenses_fts(expenses_fts) VALUES ('rebuild')")
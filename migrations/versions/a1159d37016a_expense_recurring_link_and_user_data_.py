@@ -0,0 +1,65 @@
+"""expense recurring link and user data version
+
+Revision ID: a1159d37016a
+Revises: d46222470101
+Create Date: 2026-10-18 18:51:06.945872
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1159d37016a'
+down_revision = 'd46222470101'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        # plain ALTER so the table is not recreated, which would drop the full text search triggers
+        op.execute("ALTER TABLE expenses ADD COLUMN recurring_expense_id INTEGER REFERENCES recurring_expenses (id)")
+    else:
+        with op.batch_alter_table('expenses', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('recurring_expense_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key('fk_expenses_recurring_expense_id', 'recurring_expenses', ['recurring_expense_id'], ['id'])
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('data_version', sa.Integer(), server_default='0', nullable=False))
+
+    # link expenses generated before the column existed through their "<title>(Recurring)" description
+    op.execute(
+        "UPDATE expenses SET recurring_expense_id = ("
+        "SELECT r.id FROM recurring_expenses r WHERE r.user_id = expenses.user_id "
+        "AND r.title || '(Recurring)' = expenses.description ORDER BY r.id LIMIT 1) "
+        "WHERE description LIKE '%(Recurring)'"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('data_version')
+
+    if op.get_bind().dialect.name == 'sqlite':
+        with op.batch_alter_table('expenses', schema=None, recreate='always') as batch_op:
+            batch_op.drop_column('recurring_expense_id')
+        # recreating the table dropped the full text search triggers, put them back
+        if op.get_bind().exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'expenses_fts'").first():
+            op.execute(
+                "CREATE TRIGGER expenses_fts_ai AFTER INSERT ON expenses BEGIN "
+                "INSERT INTO expenses_fts(rowid, description) VALUES (new.id, new.description); END"
+            )
+            op.execute(
+                "CREATE TRIGGER expenses_fts_ad AFTER DELETE ON expenses BEGIN "
+                "INSERT INTO expenses_fts(expenses_fts, rowid, description) VALUES ('delete', old.id, old.description); END"
+            )
+            op.execute(
+                "CREATE TRIGGER expenses_fts_au AFTER UPDATE OF description ON expenses BEGIN "
+                "INSERT INTO expenses_fts(expenses_fts, rowid, description) VALUES ('delete', old.id, old.description); "
+                "INSERT INTO expenses_fts(rowid, description) VALUES (new.id, new.description); END"
+            )
+    else:
+        with op.batch_alter_table('expenses', schema=None) as batch_op:
+            batch_op.drop_constraint('fk_expenses_recurring_expense_id', type_='foreignkey')
+            batch_op.drop_column('recurring_expense_id')
@@ -0,0 +1,59 @@
+"""expense description full text search
+
+Revision ID: d46222470101
+Revises: 4660296986da
+Create Date: 2026-10-18 18:50:05.059047
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd46222470101'
+down_revision = '4660296986da'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        # external content table over expenses.description, the triggers keep it in sync
+        op.execute(
+            "CREATE VIRTUAL TABLE expenses_fts USING fts5("
+            "description, content='expenses', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        op.execute(
+            "CREATE TRIGGER expenses_fts_ai AFTER INSERT ON expenses BEGIN "
+            "INSERT INTO expenses_fts(rowid, description) VALUES (new.id, new.description); END"
+        )
+        op.execute(
+            "CREATE TRIGGER expenses_fts_ad AFTER DELETE ON expenses BEGIN "
+            "INSERT INTO expenses_fts(expenses_fts, rowid, description) VALUES ('delete', old.id, old.description); END"
+        )
+        op.execute(
+            "CREATE TRIGGER expenses_fts_au AFTER UPDATE OF description ON expenses BEGIN "
+            "INSERT INTO expenses_fts(expenses_fts, rowid, description) VALUES ('delete', old.id, old.description); "
+            "INSERT INTO expenses_fts(rowid, description) VALUES (new.id, new.description); END"
+        )
+        op.execute("INSERT INTO expenses_fts(expenses_fts) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        op.execute(
+            "ALTER TABLE expenses ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(description, ''))) STORED"
+        )
+        op.execute("CREATE INDEX ix_expenses_search_vector ON expenses USING GIN (search_vector)")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS expenses_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS expenses_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS expenses_fts_ai")
+        op.execute("DROP TABLE IF EXISTS expenses_fts")
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_expenses_search_vector")
+        op.execute("ALTER TABLE expenses DROP COLUMN IF EXISTS search_vector")
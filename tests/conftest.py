@@ -0,0 +1,51 @@
+"""An app on an in-memory SQLite database for the tests that need one"""
+import os
+
+# read by app.config when it is first imported, so before any test module imports the app
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['SECRET_KEY'] = 'test'
+os.environ['SECURITY_PASSWORD_SALT'] = 'test'
+os.environ['OUTBOX_IN_PROCESS_WORKER'] = 'false'
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    # the tests call the monitor and the outbox themselves
+    from app import due_monitor
+    due_monitor.scheduler.pause()
+    return app
+
+
+@pytest.fixture
+def db(app):
+    """Fresh tables with three categories and two users for every test"""
+    from app.extensions import db
+    from app.models import Category, User
+    from app.services import category_cache, user_cache
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for name in ('Food', 'Bills', 'Other'):
+            db.session.add(Category(name=name))
+        for name in ('alice', 'bob'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password('secret1')
+            db.session.add(user)
+        db.session.commit()
+        category_cache.invalidate()
+        user_cache.invalidate()
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app, db):
+    """Test client logged in as alice"""
+    client = app.test_client()
+    client.post('/auth/login', data={'email': 'alice@example.com', 'password': 'secret1'})
+    return client
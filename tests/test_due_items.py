@@ -0,0 +1,69 @@
+"""DueItems.process generating the owed expenses and advancing the due dates, one occurrence or a catch up"""
+from datetime import date, datetime
+
+from app.models import Expense, MonthlyCategoryTotal, RecurringExpense
+from app.services import DueItems
+
+
+def rule(db, frequency, start, user_id=1, **kwargs):
+    row = RecurringExpense(title='Rent', amount=100, user_id=user_id, category_id=2, frequency=frequency,
+                           start_date=start, next_due_date=kwargs.pop('next_due_date', start), **kwargs)
+    db.session.add(row)
+    db.session.commit()
+    return row.id
+
+
+def generated(rule_id):
+    return [e.date.date() for e in Expense.query.filter_by(recurring_expense_id=rule_id).order_by(Expense.date)]
+
+
+def test_one_occurrence_without_catch_up(db):
+    rule_id = rule(db, 'monthly', date(2026, 1, 31))
+    processed = DueItems.process(1, [rule_id], today=date(2026, 4, 15))
+    assert [(p['occurrences'], p['due_date'], p['next_due']) for p in processed] == [(1, '2026-01-31', '2026-02-28')]
+    assert generated(rule_id) == [date(2026, 1, 31)]
+    # still behind, so the rule is due again
+    assert DueItems.count(1, date(2026, 4, 15)) == 1
+
+
+def test_monthly_catch_up_generates_every_missed_month(db):
+    rule_id = rule(db, 'monthly', date(2026, 1, 31))
+    processed = DueItems.process(1, [rule_id], today=date(2026, 4, 15), catch_up=True)
+    assert processed[0]['occurrences'] == 3 and processed[0]['amount'] == 300
+    assert processed[0]['due_date'] == '2026-01-31 to 2026-03-31'
+    assert generated(rule_id) == [date(2026, 1, 31), date(2026, 2, 28), date(2026, 3, 31)]
+    row = db.session.get(RecurringExpense, rule_id)
+    # back on the anchor day after February
+    assert (row.next_due_date, row.last_processed_date, row.total_processed, row.is_active) == \
+        (date(2026, 4, 30), date(2026, 3, 31), 3, True)
+    assert {m.month: m.total for m in MonthlyCategoryTotal.query.filter_by(user_id=1)} == \
+        {date(2026, 1, 1): 100, date(2026, 2, 1): 100, date(2026, 3, 1): 100}
+    assert DueItems.process(1, [rule_id], today=date(2026, 4, 15), catch_up=True) == []
+
+
+def test_daily_catch_up_stops_at_end_date_and_deactivates(db):
+    rule_id = rule(db, 'daily', date(2026, 3, 1), end_date=date(2026, 3, 5))
+    processed = DueItems.process(1, [rule_id], today=date(2026, 3, 10), catch_up=True)
+    assert processed[0]['occurrences'] == 5
+    assert generated(rule_id) == [date(2026, 3, day) for day in range(1, 6)]
+    row = db.session.get(RecurringExpense, rule_id)
+    assert row.next_due_date == date(2026, 3, 6) and not row.is_active
+    assert DueItems.count(1, date(2026, 3, 10)) == 0
+
+
+def test_daily_catch_up_up_to_today_stays_active(db):
+    rule_id = rule(db, 'daily', date(2026, 3, 1), end_date=date(2026, 12, 31))
+    DueItems.process(1, [rule_id], today=date(2026, 3, 3), catch_up=True)
+    row = db.session.get(RecurringExpense, rule_id)
+    assert generated(rule_id) == [date(2026, 3, 1), date(2026, 3, 2), date(2026, 3, 3)]
+    assert row.next_due_date == date(2026, 3, 4) and row.is_active
+
+
+def test_only_the_users_due_ids_are_processed(db):
+    mine = rule(db, 'monthly', date(2026, 1, 10))
+    future = rule(db, 'monthly', date(2026, 9, 10))
+    theirs = rule(db, 'monthly', date(2026, 1, 10), user_id=2)
+    processed = DueItems.process(1, [mine, future, theirs], today=date(2026, 2, 1), catch_up=True)
+    assert len(processed) == 1
+    assert generated(mine) == [date(2026, 1, 10)] and generated(future) == [] and generated(theirs) == []
+    assert Expense.query.filter_by(user_id=1).one().date == datetime(2026, 1, 10)
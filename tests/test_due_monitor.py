@@ -0,0 +1,101 @@
+"""The due expense monitor: the chunked scan over users with due recurring expenses and the notification ledger"""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app.models import RecurringExpense, User
+from app.services import DueItems
+
+
+@pytest.fixture
+def due(db):
+    """A due rule for each of users 1-5 (bob gets two) and one that isn't due yet"""
+    for name in ('carol', 'dave', 'erin'):
+        user = User(username=name, email=f'{name}@example.com')
+        user.set_password('secret1')
+        db.session.add(user)
+    today = date.today()
+    for user_id, days_ago in ((1, 0), (2, 3), (2, 1), (3, 0), (4, 10), (5, 0)):
+        db.session.add(RecurringExpense(title=f'Rule {user_id}', amount=10, user_id=user_id, category_id=2,
+                                        frequency='monthly', start_date=today - timedelta(days=days_ago),
+                                        next_due_date=today - timedelta(days=days_ago)))
+    db.session.add(RecurringExpense(title='Later', amount=10, user_id=3, category_id=2, frequency='monthly',
+                                    start_date=today + timedelta(days=5)))
+    db.session.commit()
+    return today
+
+
+def flatten(chunks):
+    return [(user.id, [expense.title for expense in expenses]) for chunk in chunks for user, expenses in chunk]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5, 500])
+def test_scan_covers_every_user_once_whatever_the_chunk_size(due, chunk_size):
+    chunks = list(DueItems.scan(due, chunk_size))
+    assert all(len(chunk) <= chunk_size for chunk in chunks)
+    assert flatten(chunks) == [(1, ['Rule 1']), (2, ['Rule 2', 'Rule 2']), (3, ['Rule 3']), (4, ['Rule 4']),
+                               (5, ['Rule 5'])]
+    # every chunk but the last is full and no empty chunk is yielded at the end
+    assert len(chunks) == -(-5 // chunk_size)
+
+
+def test_scan_orders_a_users_rows_by_due_date(due):
+    [[(user, expenses)]] = [chunk for chunk in DueItems.scan(due, 1) if chunk[0][0].id == 2]
+    assert [expense.next_due_date for expense in expenses] == [due - timedelta(days=3), due - timedelta(days=1)]
+
+
+def test_scan_refine_narrows_the_users_and_rows(due):
+    def overdue(select):
+        return select.where(RecurringExpense.next_due_date < due)
+    assert [(user_id, len(titles)) for user_id, titles in flatten(DueItems.scan(due, 1, refine=overdue))] == \
+        [(2, 2), (4, 1)]
+
+
+def pending(today, now, reminder_days=3):
+    from app.models import NotificationLedger
+    return flatten(DueItems.scan(today, 2, refine=lambda select: NotificationLedger.pending(select, today, now,
+                                                                                             reminder_days)))
+
+
+def test_a_second_monitor_run_queues_nothing(app, due):
+    from app import due_monitor
+    from app.models import OutboxMessage
+    due_monitor.check_newly_due_expenses()
+    assert sorted(message.to_email for message in OutboxMessage.query) == \
+        ['alice@example.com', 'bob@example.com', 'carol@example.com', 'dave@example.com', 'erin@example.com']
+    due_monitor.check_newly_due_expenses()
+    assert OutboxMessage.query.count() == 5
+    assert pending(due, datetime.utcnow()) == []
+
+
+def test_overdue_rows_are_reminded_every_reminder_days(db, due):
+    from app.models import NotificationLedger
+    now = datetime.utcnow()
+    NotificationLedger.record(RecurringExpense.query.filter(RecurringExpense.next_due_date <= due).all(), due, now)
+    db.session.commit()
+    assert pending(due, now + timedelta(days=2)) == []
+    # only the overdue rules come back, today's 'due' email is sent once
+    assert pending(due, now + timedelta(days=3)) == [(2, ['Rule 2', 'Rule 2']), (4, ['Rule 4'])]
+    assert pending(due, now + timedelta(days=30), reminder_days=0) == []
+
+
+def test_a_due_row_is_sent_again_once_it_turns_overdue(db, due):
+    from app.models import NotificationLedger
+    now = datetime.utcnow()
+    NotificationLedger.record(RecurringExpense.query.filter(RecurringExpense.next_due_date <= due).all(), due, now)
+    db.session.commit()
+    tomorrow = due + timedelta(days=1)
+    assert pending(tomorrow, now + timedelta(days=1)) == [(1, ['Rule 1']), (3, ['Rule 3']), (5, ['Rule 5'])]
+
+
+def test_processing_moves_the_due_date_past_the_ledger_entry(db, due):
+    from app.models import NotificationLedger
+    now = datetime.utcnow()
+    NotificationLedger.record(RecurringExpense.query.filter(RecurringExpense.next_due_date <= due).all(), due, now)
+    db.session.commit()
+    rule = RecurringExpense.query.filter_by(user_id=4).one()
+    DueItems.process(4, [rule.id], today=due)
+    next_due = db.session.get(RecurringExpense, rule.id).next_due_date
+    assert next_due > due
+    # the new due date has no ledger entry yet, so it is emailed when it comes round
+    assert (4, ['Rule 4']) in pending(next_due, now)
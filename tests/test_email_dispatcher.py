@@ -0,0 +1,106 @@
+"""GmailService.send_messages and EmailDispatcher against the local FakeGmailServer"""
+import time
+
+import pytest
+
+from app.services import EmailDispatcher, GmailService, TokenBucket
+from app.devtools import FakeGmailServer, gmail_env
+
+
+@pytest.fixture
+def fake():
+    with FakeGmailServer() as server, gmail_env(server):
+        yield server
+
+
+def messages(count):
+    return [{'to': f'user{i}@example.com', 'subject': 'Test', 'html': '<p>hi</p>', 'text': 'hi'}
+            for i in range(count)]
+
+
+def dispatcher(**options):
+    options.setdefault('units_per_second', 1e6)
+    options.setdefault('backoff_base', 0.01)
+    return EmailDispatcher(GmailService(), **options)
+
+
+def test_send_messages_reports_a_status_per_message(fake):
+    fake.script(None, 429, None, 500, 400)
+    assert GmailService().send_messages(messages(5)) == [None, 429, None, 500, 400]
+    assert fake.batch_sizes == [5]
+    assert fake.counts['send'] == 2
+
+
+def test_send_messages_sends_a_single_message_without_a_batch(fake):
+    assert GmailService().send_messages(messages(1)) == [None]
+    fake.script(503)
+    assert GmailService().send_messages(messages(1)) == [503]
+    assert fake.counts['batch'] == 0
+
+
+def test_send_messages_without_gmail_is_status_0():
+    with FakeGmailServer() as server:
+        url = server.url
+    # the server is gone, nothing listens on its port any more
+    gone = type('Gone', (), {'url': url})()
+    with gmail_env(gone):
+        assert GmailService().send_messages(messages(3)) == [0, 0, 0]
+
+
+def test_batches_split_at_email_batch_size(fake):
+    email = EmailDispatcher.from_config(GmailService(), {'EMAIL_BATCH_SIZE': 4, 'EMAIL_QUOTA_UNITS_PER_SECOND': 1e6})
+    results, stats = email.dispatch(messages(12))
+    assert results == [True] * 12
+    assert sorted(fake.batch_sizes) == [4, 4, 4]
+    assert stats['requests'] == 3 and stats['sent'] == 12
+
+
+def test_retries_429_and_5xx_with_backoff(fake):
+    email = dispatcher(batch_size=10, max_retries=3)
+    delays = []
+    backoff = email.backoff
+    email.backoff = lambda attempt: delays.append(attempt) or backoff(attempt)
+    fake.script(429, 503, None, 500, None, None, 502, None)
+    results, stats = email.dispatch(messages(5))
+    # the first round fails 3 of 5, the second 1 of those 3, the third sends the last one on its own
+    assert results == [True] * 5
+    assert stats['retries'] == 4 and stats['failed'] == 0
+    assert delays == [0, 1]
+    assert fake.batch_sizes == [5, 3]
+    assert fake.counts['send'] == 5
+
+
+def test_gives_up_after_max_retries_and_on_other_errors(fake):
+    email = dispatcher(batch_size=10, max_retries=2)
+    fake.script(429, 400, 429, 429)
+    results, stats = email.dispatch(messages(2))
+    assert results == [False, False]
+    # the 400 is not retried, the 429 is tried 1 + max_retries times
+    assert fake.counts['failed'] == 4
+    assert stats['failed'] == 2 and stats['retries'] == 2
+
+
+def test_backoff_grows_exponentially_with_jitter_and_is_capped():
+    email = dispatcher(backoff_base=1.0, backoff_max=10.0)
+    for attempt in range(8):
+        delay = email.backoff(attempt)
+        full = min(10.0, 2 ** attempt)
+        assert full / 2 <= delay <= full
+
+
+def test_token_bucket_paces_to_its_rate():
+    bucket = TokenBucket(rate=100, capacity=10)
+    started = time.monotonic()
+    for _ in range(30):
+        bucket.acquire()
+    # 10 go out as the initial burst, the other 20 at 100/s
+    assert 0.18 <= time.monotonic() - started < 1.0
+
+
+def test_dispatch_is_throttled_to_the_quota(fake):
+    # 100 units per send at 1000 units/s is 10 sends per second after a 10 send burst
+    email = dispatcher(batch_size=1, workers=4, units_per_second=1000, send_units=100)
+    started = time.monotonic()
+    results, _ = email.dispatch(messages(15))
+    assert all(results)
+    assert time.monotonic() - started >= 0.45
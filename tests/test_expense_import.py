@@ -0,0 +1,98 @@
+"""ExpenseImporter: which CSV/OFX lines become expenses and re-imports skipping what is already there"""
+from datetime import datetime
+
+import pytest
+
+from app.models import Expense
+from app.services import ExpenseImporter
+
+SIGNED_CSV = """Date,Description,Amount,Category
+2026-03-01,Groceries,-42.50,Food
+2026-03-02,Salary,2500.00,
+2026-03-03,Electricity,(80.00),Bills
+2026-03-04,Coffee,3.20-,
+2026-03-05,Groceries,-42.50,Food
+2026-03-05,Groceries,-42.50,Food
+"""
+
+DEBIT_CSV = """Txn Date,Narration,Withdrawal Amount
+01/03/2026,Rent,1200.00
+02/03/2026,Refund,
+03/03/2026,Bus pass,45.00
+"""
+
+OFX = """OFXHEADER:100
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20260301120000<TRNAMT>-19.99<FITID>A1<NAME>Streaming</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20260302<TRNAMT>100.00<FITID>A2<NAME>Transfer in</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20260303<TRNAMT>-19.99<FITID>A3<NAME>Streaming</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+
+def run(text, filename='statement.csv', user_id=1, **kwargs):
+    return ExpenseImporter(user_id, **kwargs).run(text.splitlines(keepends=True), filename=filename)
+
+
+def imported(user_id=1):
+    return [(e.date, e.amount, e.description, e.category_id)
+            for e in Expense.query.filter_by(user_id=user_id).order_by(Expense.date, Expense.id)]
+
+
+def test_signed_amounts_import_debits_and_skip_credits(db):
+    report = run(SIGNED_CSV)
+    assert (report['processed'], report['inserted'], report['skipped'], report['failed']) == (6, 5, 1, 0)
+    assert imported() == [
+        (datetime(2026, 3, 1), 42.5, 'Groceries', 1),
+        (datetime(2026, 3, 3), 80.0, 'Electricity', 2),
+        (datetime(2026, 3, 4), 3.2, 'Coffee', 3),
+        # two equal purchases on one day are both kept
+        (datetime(2026, 3, 5), 42.5, 'Groceries', 1),
+        (datetime(2026, 3, 5), 42.5, 'Groceries', 1),
+    ]
+
+
+def test_debit_sign_positive_flips_a_signed_column(db):
+    report = run("Date,Description,Amount\n2026-03-01,Card,12.00\n2026-03-02,Refund,-12.00\n", debit_sign='positive')
+    assert (report['inserted'], report['skipped']) == (1, 1)
+    assert imported() == [(datetime(2026, 3, 1), 12.0, 'Card', 3)]
+
+
+def test_debit_column_amounts_are_positive_and_empty_cells_are_credits(db):
+    report = run(DEBIT_CSV)
+    assert (report['inserted'], report['skipped'], report['failed']) == (2, 1, 0)
+    assert imported() == [(datetime(2026, 3, 1), 1200.0, 'Rent', 3), (datetime(2026, 3, 3), 45.0, 'Bus pass', 3)]
+
+
+def test_ofx_imports_debits_only(db):
+    report = run(OFX, filename='statement.ofx')
+    assert (report['inserted'], report['skipped']) == (2, 1)
+    assert [row[1:3] for row in imported()] == [(19.99, 'Streaming'), (19.99, 'Streaming')]
+
+
+@pytest.mark.parametrize('text,filename', [(SIGNED_CSV, 'statement.csv'), (DEBIT_CSV, 'statement.csv'),
+                                           (OFX, 'statement.ofx')])
+def test_reimporting_a_file_only_finds_duplicates(db, text, filename):
+    first = run(text, filename)
+    before = imported()
+    again = run(text, filename, batch_size=2)
+    assert again['inserted'] == 0 and again['duplicates'] == first['inserted']
+    assert imported() == before
+
+
+def test_a_file_overlapping_an_earlier_import_adds_only_the_new_lines(db):
+    run(SIGNED_CSV)
+    report = run(SIGNED_CSV + "2026-03-06,Groceries,-42.50,Food\n2026-03-05,Groceries,-42.50,Food\n")
+    # the third identical purchase on the 5th is new, the first two were imported before
+    assert (report['inserted'], report['duplicates']) == (2, 5)
+
+
+def test_duplicates_are_per_user(db):
+    run(SIGNED_CSV)
+    assert run(SIGNED_CSV, user_id=2)['inserted'] == 5
+
+
+def test_bad_lines_are_reported_and_the_rest_imported(db):
+    report = run("Date,Description,Amount\nyesterday,Lunch,-9.00\n2026-03-01,Lunch,-abc\n2026-03-02,Lunch,-9.00\n")
+    assert (report['inserted'], report['failed']) == (1, 2)
+    assert [error['line'] for error in report['errors']] == [2, 3]
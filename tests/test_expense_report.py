@@ -0,0 +1,49 @@
+"""ExpenseReport.from_args and the report routes with bad query args"""
+from datetime import date, datetime
+
+import pytest
+
+from app.services import ExpenseReport, ReportJobLimitError
+
+
+def test_from_args_parses_dates_and_category():
+    report = ExpenseReport.from_args(1, {'start_date': '2025-01-05', 'end_date': '2025-02-10', 'category': '2',
+                                         'subtotals': 'week'})
+    assert (report.start, report.end, report.category_id, report.subtotal_period) == \
+        (date(2025, 1, 5), date(2025, 2, 10), 2, 'week')
+
+
+@pytest.mark.parametrize('start_date', ['bad', '2025-13-01', '05/01/2025', ''])
+def test_malformed_dates_fall_back_to_month_to_date(start_date):
+    today = datetime.now().date()
+    report = ExpenseReport.from_args(1, {'start_date': start_date, 'end_date': start_date})
+    assert (report.start, report.end) == (today.replace(day=1), today)
+    report = ExpenseReport.from_args(1, {'start_date': '2025-01-05', 'end_date': start_date})
+    assert (report.start, report.end) == (date(2025, 1, 5), today)
+
+
+@pytest.mark.parametrize('url', ['/preview-report?start_date=bad', '/preview-report?end_date=2025-02-30',
+                                 '/export-pdf?start_date=bad&end_date=worse'])
+def test_report_routes_survive_malformed_dates(client, url):
+    response = client.get(url)
+    # nothing is cached, so /export-pdf hands over to the preview page with the fallback range
+    if url.startswith('/export-pdf'):
+        assert response.status_code == 302 and '/preview-report?export=1' in response.location
+    else:
+        assert response.status_code == 200
+
+
+def test_report_job_survives_malformed_dates(client, app, monkeypatch):
+    submitted = []
+
+    def submit(user_id, html, filename, cache_key=None):
+        submitted.append(filename)
+        raise ReportJobLimitError('full')
+
+    # stops at the queue, the html for the fallback range was rendered by then
+    monkeypatch.setattr(app.extensions['report_cache'], 'get', lambda key: None)
+    monkeypatch.setattr(app.extensions['report_jobs'], 'submit', submit)
+    response = client.post('/export-pdf/jobs', data={'start_date': 'bad', 'end_date': '2025-02-30'})
+    today = datetime.now().date()
+    assert response.status_code == 429
+    assert submitted == [f"expense_report_{today.replace(day=1):%Y-%m-%d}_{today:%Y-%m-%d}.pdf"]
@@ -0,0 +1,102 @@
+"""ExpenseSearch over the FTS5 index the migrations build, and its cached facets"""
+import importlib.util
+import os
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from werkzeug.datastructures import MultiDict
+
+from app.models import Category, Expense
+from app.services import ExpenseSearch
+
+VERSIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'migrations', 'versions')
+FTS_MIGRATIONS = ('d46222470101_expense_description_full_text_search.py',
+                  '5b2d8e4f9c13_scope_expense_search_to_the_owner.py')
+
+
+def migration(filename):
+    spec = importlib.util.spec_from_file_location(filename[:-3], os.path.join(VERSIONS, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@contextmanager
+def operations(db):
+    with db.engine.begin() as connection, Operations.context(MigrationContext.configure(connection)):
+        yield
+
+
+@pytest.fixture
+def fts(db):
+    """The tables from create_all plus the full text search migrations, undone afterwards"""
+    modules = [migration(filename) for filename in FTS_MIGRATIONS]
+    with operations(db):
+        for module in modules:
+            module.upgrade()
+    yield ExpenseSearch()
+    with operations(db):
+        for module in reversed(modules):
+            module.downgrade()
+        db.session.execute(db.text("DROP VIEW IF EXISTS expenses_fts_source"))
+
+
+def add(db, user_id, *descriptions):
+    db.session.add_all(Expense(user_id=user_id, category_id=1, amount=1, description=description,
+                               date=datetime(2026, 1, 1)) for description in descriptions)
+    db.session.commit()
+
+
+def search(fts, user_id, keyword):
+    query, score = fts.apply(Expense.query.filter_by(user_id=user_id), keyword, user_id)
+    return sorted(expense.description for expense in query.all()), score
+
+
+def test_fts_matches_only_the_searching_users_rows(fts, db):
+    add(db, 1, 'Coffee beans', 'coffee shop', 'Tea')
+    add(db, 2, 'Coffee for bob', 'coffeemaker')
+    assert fts.backend() == 'fts5'
+    descriptions, score = search(fts, 1, 'coff')
+    assert descriptions == ['Coffee beans', 'coffee shop'] and score is not None
+    assert search(fts, 2, 'coffee')[0] == ['Coffee for bob', 'coffeemaker']
+    # the owner token is only matched in the owner column, never as a search term
+    assert search(fts, 1, 'u2')[0] == []
+
+
+def test_fts_hits_are_scoped_inside_the_index(fts, db):
+    add(db, 1, 'coffee')
+    add(db, 2, *['coffee'] * 5)
+    # no user filter outside the index, only the owner token keeps bob's rows out
+    query, _ = fts.apply(Expense.query, 'coffee', 1)
+    assert [expense.user_id for expense in query.all()] == [1]
+
+def test_triggers_follow_edits_and_owner_changes(fts, db):
+    add(db, 1, 'Lunch')
+    expense = Expense.query.one()
+    expense.description = 'Dinner'
+    db.session.commit()
+    assert search(fts, 1, 'lunch')[0] == [] and search(fts, 1, 'dinner')[0] == ['Dinner']
+    expense.user_id = 2
+    db.session.commit()
+    assert search(fts, 1, 'dinner')[0] == [] and search(fts, 2, 'dinner')[0] == ['Dinner']
+    db.session.delete(expense)
+    db.session.commit()
+    assert search(fts, 2, 'dinner')[0] == []
+
+
+def test_cached_facets_show_renamed_categories(db):
+    add(db, 1, 'Coffee', 'Tea')
+    search = ExpenseSearch()
+    filters = search.parse_filters(MultiDict())
+    query = search.apply_filters(Expense.query.filter_by(user_id=1), filters)
+    first = search.facets(query, 1, '', filters)
+    assert [(c['name'], c['count']) for c in first['categories']] == [('Food', 2)]
+    db.session.get(Category, 1).name = 'Groceries'
+    db.session.commit()
+    # the rename doesn't touch the user's data version, the counts still come from the cache
+    search.facet_query = lambda query: pytest.fail('facets were recomputed')
+    assert [(c['name'], c['count']) for c in search.facets(query, 1, '', filters)['categories']] == [('Groceries', 2)]
+    assert first['categories'][0]['name'] == 'Food'
@@ -0,0 +1,101 @@
+"""CashFlowForecast: the numpy occurrence generation against stepping each rule with Recurrence, and the
+bucketed forecast the API returns"""
+import random
+from collections import Counter
+from datetime import date, timedelta
+
+import pytest
+
+from app.models import RecurringExpense
+from app.services import CashFlowForecast, forecast
+from app.utils.recurrence import FREQUENCIES, Recurrence
+
+
+def stepped(frequency, start_date, end_date, next_due_date, start, end):
+    """Occurrences in [start,end] of one rule, the way processing walks it: the stored due date, then
+    Recurrence.following from each charge"""
+    last = min(end, end_date or end)
+    due, found = next_due_date, []
+    while due <= last:
+        if due >= start:
+            found.append(due)
+        due = Recurrence(frequency, start_date).following(due)
+    return found
+
+
+def test_occurrences_match_stepping_each_rule():
+    rng = random.Random(19)
+    start = date(2026, 1, 1)
+    end = start + timedelta(days=400)
+    rows = []
+    for _ in range(300):
+        anchor = date(2024, 1, 1) + timedelta(days=rng.randrange(900))
+        frequency = rng.choice(FREQUENCIES)
+        # on the schedule, or a legacy due date that drifted off the anchor day
+        due = Recurrence(frequency, anchor).next_on_or_after(anchor + timedelta(days=rng.randrange(-30, 700)))
+        due -= timedelta(days=rng.choice([0, 0, 0, 1, 3]))
+        end_date = rng.choice([None, None, due + timedelta(days=rng.randrange(400))])
+        rows.append((frequency, anchor, end_date, max(due, anchor)))
+    index, days = CashFlowForecast.occurrences(rows, start, end)
+    found = Counter(zip(index.tolist(), days.astype('datetime64[D]').tolist()))
+    expected = Counter((i, day) for i, row in enumerate(rows) for day in stepped(*row, start, end))
+    assert found == expected
+
+
+def test_occurrences_of_nothing():
+    index, days = CashFlowForecast.occurrences([], date(2026, 1, 1), date(2026, 12, 31))
+    assert len(index) == len(days) == 0
+
+
+def add_rule(db, frequency, start_date, amount, category_id=2, user_id=1, **kwargs):
+    row = RecurringExpense(title='Rule', amount=amount, user_id=user_id, category_id=category_id,
+                           frequency=frequency, start_date=start_date, next_due_date=start_date, **kwargs)
+    db.session.add(row)
+    db.session.commit()
+    return row
+
+
+def test_forecast_buckets_by_month_and_category(db):
+    add_rule(db, 'monthly', date(2026, 1, 31), 100)
+    add_rule(db, 'weekly', date(2026, 2, 2), 10, category_id=1)
+    add_rule(db, 'daily', date(2026, 2, 1), 1, category_id=1, is_active=False)
+    add_rule(db, 'monthly', date(2026, 2, 1), 50, user_id=2)
+    result = forecast.forecast(1, 59, today=date(2026, 2, 1))
+    assert (result['start'], result['end'], result['horizon']) == ('2026-02-01', '2026-03-31', 59)
+    # Feb 28 and Mar 31 for the month end rule, Mondays Feb 2 to Mar 30 for the weekly one
+    assert result['occurrences'] == 2 + 9
+    assert result['total'] == 290.0
+    assert result['categories'] == {'Bills': 200.0, 'Food': 90.0}
+    assert [(b['start'], b['total'], b['categories']) for b in result['buckets']] == [
+        ('2026-02-01', 140.0, {'Food': 40.0, 'Bills': 100.0}),
+        ('2026-03-01', 150.0, {'Food': 50.0, 'Bills': 100.0}),
+    ]
+
+
+def test_forecast_by_week_starts_buckets_on_monday(db):
+    add_rule(db, 'daily', date(2026, 2, 4), 2)
+    result = forecast.forecast(1, 7, period='week', today=date(2026, 2, 4))
+    assert [(b['start'], b['total']) for b in result['buckets']] == [('2026-02-02', 10.0), ('2026-02-09', 4.0)]
+
+
+def test_editing_a_rule_refreshes_the_cached_forecast(db):
+    rule = add_rule(db, 'monthly', date(2026, 2, 10), 100)
+    today = date(2026, 2, 1)
+    assert forecast.forecast(1, 30, today=today)['total'] == 100.0
+    rule.amount = 120
+    db.session.commit()
+    assert forecast.forecast(1, 30, today=today)['total'] == 120.0
+
+
+@pytest.mark.parametrize('requested,days', [(None, None), ('30', 30), ('0', 1), ('abc', None), ('100000', 'max')])
+def test_horizon_is_clamped(app, requested, days):
+    expected = {None: app.config['FORECAST_DEFAULT_HORIZON'], 'max': app.config['FORECAST_MAX_HORIZON']}.get(days, days)
+    with app.app_context():
+        assert CashFlowForecast.horizon(requested) == expected
+
+
+def test_forecast_api(client, db):
+    add_rule(db, 'monthly', date.today() + timedelta(days=1), 25)
+    data = client.get('/api/forecast?horizon=40&period=day').get_json()
+    assert data['period'] == 'day' and data['horizon'] == 40
+    assert data['total'] >= 25.0 and data['buckets'][0]['categories'] == {'Bills': 25.0}
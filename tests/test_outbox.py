@@ -0,0 +1,195 @@
+"""OutboxWorker leasing, lease renewal and result recording, with the senders replaced"""
+import smtplib
+from datetime import datetime, timedelta
+
+from app.models import OutboxMessage
+from app.services import OutboxWorker
+from app.services import outbox as outbox_module
+
+
+class Dispatcher:
+    """Stands in for EmailDispatcher, before_round(n) runs as round n starts"""
+    workers = 1
+    batch_size = 2
+
+    def __init__(self, fail=(), before_round=None):
+        self.fail = set(fail)
+        self.before_round = before_round or (lambda n: None)
+        self.rounds = []
+
+    def dispatch(self, messages):
+        self.before_round(len(self.rounds))
+        self.rounds.append([message['to'] for message in messages])
+        return [message['to'] not in self.fail for message in messages], {}
+
+
+class SMTP:
+    """Stands in for a Flask-Mail connection, counts connects and raises errors[to] for a recipient"""
+
+    def __init__(self, errors=None, connect_error=None):
+        self.errors = errors or {}
+        self.connect_error = connect_error
+        self.connects = 0
+        self.sent = []
+
+    def __call__(self):
+        return self
+
+    def __enter__(self):
+        if self.connect_error:
+            raise self.connect_error
+        self.connects += 1
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def send(self, message):
+        to = message.recipients[0]
+        if to in self.errors:
+            raise self.errors[to]
+        self.sent.append(to)
+
+
+def queue(db, count, transport='gmail'):
+    for i in range(count):
+        OutboxMessage.enqueue(f'{transport}{i}@example.com', 'Subject', '<p>hi</p>', 'hi', transport=transport)
+    db.session.commit()
+
+
+def worker(app, dispatcher=None, smtp=None):
+    outbox = OutboxWorker(app)
+    outbox._dispatcher = dispatcher or Dispatcher()
+    if smtp is not None:
+        outbox.smtp_connection = smtp
+    return outbox
+
+
+def rows():
+    return {row.to_email: row for row in OutboxMessage.query.order_by(OutboxMessage.id)}
+
+
+def expire_leases(db, *emails):
+    stmt = db.update(OutboxMessage).values(leased_until=datetime.utcnow() - timedelta(seconds=1))
+    if emails:
+        stmt = stmt.where(OutboxMessage.to_email.in_(emails))
+    db.session.execute(stmt)
+    db.session.commit()
+
+
+def test_sends_and_records_both_transports(app, db):
+    queue(db, 3)
+    queue(db, 3, 'mail')
+    smtp = SMTP()
+    stats = worker(app, smtp=smtp).run_once()
+    assert stats['sent'] == 6 and stats['leased'] == 6
+    # every SMTP message goes over the one connection
+    assert smtp.connects == 1 and len(smtp.sent) == 3
+    assert {(row.status, row.attempts, row.lease_token) for row in rows().values()} == {('sent', 1, None)}
+
+
+def test_failures_back_off_then_dead_letter(app, db):
+    queue(db, 2)
+    app.config['OUTBOX_MAX_ATTEMPTS'] = 2
+    try:
+        outbox = worker(app, Dispatcher(fail={'gmail1@example.com'}))
+        assert outbox.run_once()['retried'] == 1
+        failed = rows()['gmail1@example.com']
+        assert failed.status == 'pending' and failed.attempts == 1 and failed.available_at > datetime.utcnow()
+        db.session.execute(db.update(OutboxMessage).values(available_at=datetime.utcnow()))
+        db.session.commit()
+        assert outbox.run_once()['dead'] == 1
+        assert rows()['gmail1@example.com'].status == 'dead'
+    finally:
+        app.config['OUTBOX_MAX_ATTEMPTS'] = 8
+
+
+def test_lease_is_renewed_between_rounds(app, db):
+    queue(db, 5)
+    queue(db, 3, 'mail')
+    outbox = worker(app, smtp=SMTP())
+    renewals = []
+    renew = outbox.renew
+    outbox.renew = lambda token: renewals.append(token) or renew(token)
+    outbox.run_once()
+    # 3 gmail rounds of 2 and 2 SMTP rounds of 2, renewed before all but the first
+    assert len(renewals) == 4
+
+
+def test_rows_taken_over_mid_batch_are_not_sent_or_recorded(app, db):
+    queue(db, 6)
+    taken = []
+
+    def lease_expires(round_number):
+        # the lease on the last two rows runs out during round 1 and a second worker takes them
+        if round_number == 1:
+            expire_leases(db, 'gmail4@example.com', 'gmail5@example.com')
+            taken.extend(OutboxWorker(app).lease(10))
+
+    dispatcher = Dispatcher(before_round=lease_expires)
+    stats = worker(app, dispatcher).run_once()
+    assert dispatcher.rounds == [['gmail0@example.com', 'gmail1@example.com'], ['gmail2@example.com', 'gmail3@example.com']]
+    assert stats['sent'] == 4
+    state = rows()
+    assert [row.status for row in state.values()] == ['sent'] * 4 + ['pending'] * 2
+    assert {state[to].lease_token for to in ('gmail4@example.com', 'gmail5@example.com')} == {taken[0].lease_token}
+    assert len(taken) == 2 and state['gmail4@example.com'].attempts == 0
+
+
+def test_stale_results_are_dropped_when_the_whole_lease_was_lost(app, db):
+    queue(db, 4)
+    second = []
+
+    def lease_lost(round_number):
+        if round_number == 0:
+            expire_leases(db)
+            second.extend(OutboxWorker(app).lease(10))
+
+    dispatcher = Dispatcher(before_round=lease_lost)
+    stats = worker(app, dispatcher).run_once()
+    # round 0 went out before anyone noticed, the rest was left to the new holder and nothing was written
+    assert dispatcher.rounds == [['gmail0@example.com', 'gmail1@example.com']]
+    assert len(second) == 4 and stats['sent'] == 2
+    assert {(row.status, row.attempts) for row in rows().values()} == {('pending', 0)}
+    assert all(row.lease_token == second[0].lease_token for row in rows().values())
+
+
+def test_smtp_connection_drop_fails_the_rest_without_sending(app, db):
+    queue(db, 4, 'mail')
+    smtp = SMTP(errors={'mail1@example.com': smtplib.SMTPServerDisconnected('Connection unexpectedly closed')})
+    stats = worker(app, smtp=smtp).run_once()
+    assert smtp.sent == ['mail0@example.com']
+    assert stats['sent'] == 1 and stats['retried'] == 3
+    assert rows()['mail3@example.com'].last_error == 'Connection unexpectedly closed'
+
+
+def test_smtp_message_errors_only_fail_that_message(app, db):
+    queue(db, 3, 'mail')
+    smtp = SMTP(errors={'mail1@example.com': smtplib.SMTPRecipientsRefused({'mail1@example.com': (550, b'no')})})
+    stats = worker(app, smtp=smtp).run_once()
+    assert smtp.sent == ['mail0@example.com', 'mail2@example.com'] and stats['retried'] == 1
+
+
+def test_smtp_connect_failure_retries_every_smtp_message(app, db):
+    queue(db, 2)
+    queue(db, 2, 'mail')
+    stats = worker(app, smtp=SMTP(connect_error=TimeoutError('timed out'))).run_once()
+    assert stats['sent'] == 2 and stats['retried'] == 2
+    assert rows()['mail0@example.com'].last_error == 'timed out'
+
+
+def test_smtp_socket_has_the_configured_timeout(app, monkeypatch):
+    opened = []
+
+    class FakeSMTP:
+        def __init__(self, host, port, timeout):
+            opened.append(timeout)
+
+        def set_debuglevel(self, level):
+            pass
+
+    monkeypatch.setattr(outbox_module.smtplib, 'SMTP', FakeSMTP)
+    mail = type('Mail', (), {'use_ssl': False, 'use_tls': False, 'username': None, 'password': None,
+                             'server': 'localhost', 'port': 25, 'debug': 0})()
+    outbox_module.SMTPConnection(mail, app.config['OUTBOX_SMTP_TIMEOUT']).configure_host()
+    assert opened == [app.config['OUTBOX_SMTP_TIMEOUT']]
@@ -0,0 +1,161 @@
+"""The anchored recurrence engine against the relativedelta stepping it replaced.
+
+old_initial/old_next are the RecurringExpense.calculate_initial_next_due_date and
+calculate_next_due_date bodies from before the engine. Both agree wherever an anchor day exists in
+every month. For anchors on the 29th-31st the old chain drifted to the shortest month seen so far,
+and the new one returns to the anchor day. Those differences are intended and asserted explicitly.
+"""
+import random
+from datetime import date, timedelta
+
+import pytest
+from dateutil.relativedelta import relativedelta
+
+from app.models import expense as expense_module
+from app.models.expense import RecurringExpense
+from app.utils.recurrence import FREQUENCIES, Recurrence, occurrences_between
+
+STEPS = {'daily': timedelta(days=1), 'weekly': timedelta(weeks=1),
+         'monthly': relativedelta(months=1), 'yearly': relativedelta(years=1)}
+
+
+def old_initial(frequency, start, today):
+    if start > today:
+        return start
+    if frequency == 'daily':
+        return start + timedelta(days=(today - start).days + 1)
+    if frequency == 'weekly':
+        weeks = (today - start).days // 7
+        next_date = start + timedelta(weeks=weeks)
+        return next_date if next_date > today else start + timedelta(weeks=weeks + 1)
+    next_date = start
+    while next_date <= today:
+        next_date += STEPS[frequency]
+    return next_date
+
+
+def old_next(frequency, due):
+    return due + STEPS[frequency]
+
+
+def random_date(rng, low=date(2019, 1, 1), days=3000):
+    return low + timedelta(days=rng.randrange(days))
+
+
+@pytest.fixture
+def today(monkeypatch):
+    """Set what date.today() returns inside the model"""
+    class FixedDate(date):
+        value = date(2026, 1, 1)
+
+        @classmethod
+        def today(cls):
+            return cls.value
+
+    monkeypatch.setattr(expense_module, 'date', FixedDate)
+    return FixedDate
+
+
+def make_rule(frequency, start, next_due_date=None):
+    return RecurringExpense(title='t', amount=1, user_id=1, category_id=1, frequency=frequency,
+                            start_date=start, next_due_date=next_due_date)
+
+
+def chain(rule, steps):
+    dates = [rule.next_due_date]
+    for _ in range(steps):
+        rule.next_due_date = rule.calculate_next_due_date()
+        dates.append(rule.next_due_date)
+    return dates
+
+
+def old_chain(frequency, first, steps):
+    dates = [first]
+    for _ in range(steps):
+        dates.append(old_next(frequency, dates[-1]))
+    return dates
+
+
+def test_matches_old_stepping_when_the_anchor_day_exists_every_month(today):
+    rng = random.Random(18)
+    for _ in range(3000):
+        frequency = rng.choice(FREQUENCIES)
+        start = random_date(rng)
+        if frequency in ('monthly', 'yearly') and start.day > 28:
+            start = start.replace(day=rng.randint(1, 28))
+        today.value = random_date(rng)
+        rule = make_rule(frequency, start)
+        expected = old_initial(frequency, start, today.value)
+        assert rule.next_due_date == expected, (frequency, start, today.value)
+        assert chain(rule, 30) == old_chain(frequency, expected, 30), (frequency, start)
+
+
+def test_occurrence_k_is_the_anchor_plus_k_periods():
+    # relativedelta from the anchor (not chained) clamps to the month end the same way
+    rng = random.Random(181)
+    for _ in range(3000):
+        frequency = rng.choice(FREQUENCIES)
+        anchor, interval, k = random_date(rng), rng.randint(1, 4), rng.randrange(200)
+        rule = Recurrence(frequency, anchor, interval=interval)
+        assert rule.occurrence(k) == anchor + STEPS[frequency] * (k * interval), (frequency, anchor, interval, k)
+
+
+@pytest.mark.parametrize('day', [29, 30, 31])
+def test_month_end_anchors_return_to_the_anchor_day(today, day):
+    today.value = date(2025, 1, 1)
+    rule = make_rule('monthly', date(2025, 1, day))
+    new, old = chain(rule, 12), old_chain('monthly', date(2025, 1, day), 12)
+    assert [(d.year, d.month) for d in new] == [(d.year, d.month) for d in old]
+    # February clamps both to the 28th, from March on the old chain stays there
+    assert new[1] == old[1] == date(2025, 2, 28)
+    assert new[2] == date(2025, 3, day) and old[2] == date(2025, 3, 28)
+    assert new[3] == date(2025, 4, min(day, 30)) and old[3] == date(2025, 4, 28)
+    assert all(d.day == 28 for d in old[1:])
+
+
+def test_month_end_anchor_days_follow_the_month_length(today):
+    rng = random.Random(1831)
+    for _ in range(500):
+        start = random_date(rng).replace(day=1)
+        day = rng.choice([29, 30, 31])
+        month_length = ((start + relativedelta(months=1)) - start).days
+        if day > month_length:
+            continue
+        start = start.replace(day=day)
+        today.value = start - timedelta(days=1)
+        new = chain(make_rule('monthly', start), 24)
+        old = old_chain('monthly', start, 24)
+        for n, o in zip(new, old):
+            last = ((n.replace(day=1) + relativedelta(months=1)) - timedelta(days=1)).day
+            assert n.day == min(day, last)
+            assert (n.year, n.month) == (o.year, o.month) and n >= o
+
+
+def test_leap_day_anchor():
+    rule = Recurrence('yearly', date(2024, 2, 29))
+    assert [rule.occurrence(k) for k in range(5)] == [date(2024, 2, 29), date(2025, 2, 28), date(2026, 2, 28),
+                                                      date(2027, 2, 28), date(2028, 2, 29)]
+    assert old_chain('yearly', date(2024, 2, 29), 4)[-1] == date(2028, 2, 28)
+
+
+def test_drifted_legacy_due_date_moves_back_to_the_anchor_day(today):
+    today.value = date(2025, 1, 1)
+    rule = make_rule('monthly', date(2025, 1, 31), next_due_date=date(2025, 3, 28))
+    assert rule.calculate_next_due_date() == date(2025, 4, 30)
+    assert old_next('monthly', date(2025, 3, 28)) == date(2025, 4, 28)
+
+
+def test_occurrences_between_matches_each_rule():
+    rng = random.Random(1832)
+    rules = {}
+    for i in range(2000):
+        frequency = rng.choice(FREQUENCIES)
+        anchor = random_date(rng)
+        until = anchor + timedelta(days=rng.randrange(2000)) if rng.random() < 0.3 else None
+        rules[i] = Recurrence(frequency, anchor, interval=rng.randint(1, 3),
+                              last_day=frequency in ('monthly', 'yearly') and rng.random() < 0.2, until=until)
+    start = date(2022, 1, 1)
+    for end in (date(2021, 12, 31), date(2022, 1, 1), date(2023, 6, 30), date(2027, 12, 31)):
+        batched = occurrences_between(rules, start, end)
+        assert batched == {key: rule.between(start, end) for key, rule in rules.items()}
+    assert occurrences_between({}, start, start) == {}
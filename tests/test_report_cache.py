@@ -0,0 +1,58 @@
+"""ReportCache keys move with every change to what a cached report shows"""
+from datetime import date, datetime
+
+import pytest
+
+from app.models import Category, Expense, User
+
+START, END = date(2026, 1, 1), date(2026, 1, 31)
+
+
+@pytest.fixture
+def key(app, db):
+    db.session.add_all([Expense(user_id=1, category_id=1, amount=10, description='Lunch', date=datetime(2026, 1, 5)),
+                        Expense(user_id=1, category_id=2, amount=20, description='Power', date=datetime(2026, 1, 9))])
+    db.session.commit()
+    cache = app.extensions['report_cache']
+    return lambda: cache.key(db.session.get(User, 1), START, END, None, 'main/expense_report.html')
+
+
+def edit(db, expense_id, **values):
+    expense = db.session.get(Expense, expense_id)
+    for name, value in values.items():
+        setattr(expense, name, value)
+    db.session.commit()
+
+
+def test_unchanged_data_keeps_the_key(key):
+    assert key() == key()
+
+
+@pytest.mark.parametrize('values', [{'description': 'Dinner'}, {'date': datetime(2026, 1, 6)}, {'category_id': 3}])
+def test_editing_a_row_in_range_moves_the_key(key, db, values):
+    # none of these change the count, sum or max id of the range
+    before = key()
+    edit(db, 1, **values)
+    assert key() != before
+
+
+def test_deleting_a_row_moves_the_key(key, db):
+    before = key()
+    db.session.delete(db.session.get(Expense, 1))
+    db.session.commit()
+    assert key() != before
+
+
+def test_renaming_a_category_moves_the_key(key, db):
+    before = key()
+    db.session.get(Category, 1).name = 'Groceries'
+    db.session.commit()
+    assert key() != before
+
+
+def test_other_users_writes_keep_the_key(key, db):
+    before = key()
+    db.session.add(Expense(user_id=2, category_id=1, amount=5, description='x', date=datetime(2026, 1, 5)))
+    db.session.commit()
+    edit(db, 3, description='y')
+    assert key() == before